@@ -17,19 +17,28 @@
 # THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
 
+import array
 import ConfigParser
+import copy
+import datetime
 import fcntl
 import getpass
+import gzip
+import math
 import MySQLdb
 import os
+import Queue
 import re
 import sys
 import socket
+import StringIO
+import threading
 import time
 import traceback
 import warnings
 from optparse import OptionParser
 from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
 
 import smtplib
 try:
@@ -42,11 +51,31 @@ except:
     except:
         pass
 
+try:
+    from hashlib import md5
+except ImportError:
+    # python 2.4
+    from md5 import md5
+try:
+    from urlparse import parse_qs
+except ImportError:
+    # python 2.5 and below
+    from cgi import parse_qs
+try:
+    import json
+except ImportError:
+    try:
+        # python 2.5 and below
+        import simplejson as json
+    except ImportError:
+        json = None
+
 
 
 def parse_options():
     global options
     global args
+    global option_types
     
     usage = """usage: mycheckpoint [options] [command [, command ...]]
 
@@ -54,9 +83,13 @@ See online documentation on http://code.openark.org/forge/mycheckpoint/documenta
 
 Available commands:
   http
+  daemon
+  collect_hosts
   deploy
   email_brief_report
   email_alert_pending_report
+  backtest
+  send_emails
     """
     parser = OptionParser(usage=usage)
     parser.add_option("-u", "--user", dest="user", help="MySQL user")
@@ -73,8 +106,16 @@ Available commands:
     parser.add_option("", "--defaults-file", dest="defaults_file", help="Read from MySQL configuration file. Overrides all other options")
     parser.add_option("-d", "--database", dest="database", help="Database name (required unless query uses fully qualified table names)")
     parser.add_option("", "--skip-aggregation", dest="skip_aggregation", action="store_true", default=False, help="Skip creating and maintaining aggregation tables")
+    parser.add_option("", "--materialize-diff", dest="materialize_diff", action="store_true", default=False, help="Compute per-sample diffs upon collection and store them in the status_variables_diff table, rather than computing them with each read")
+    parser.add_option("", "--incremental-aggregation", dest="incremental_aggregation", action="store_true", default=False, help="Fold each new sample into the aggregation tables, rather than re-aggregating the entire hour and day on each sample")
+    parser.add_option("", "--chart-cache", dest="chart_cache", action="store_true", default=False, help="Render charts upon collection and store them in the chart_cache table, rather than computing them with each read. Stale data is indicated when charts are read")
     parser.add_option("", "--rebuild-aggregation", dest="rebuild_aggregation", action="store_true", default=False, help="Completely rebuild (drop, create and populate) aggregation tables upon deploy")
     parser.add_option("", "--purge-days", dest="purge_days", type="int", help="Purge data older than specified amount of days (default: 182)")
+    parser.add_option("", "--purge-chunk-size", dest="purge_chunk_size", type="int", help="Purge old rows in chunks of up to this many primary key values. 0 purges in a single statement (default: 1000)")
+    parser.add_option("", "--purge-chunk-pause-millis", dest="purge_chunk_pause_millis", type="int", help="Milliseconds to pause between purge chunks (default: 100)")
+    parser.add_option("", "--purge-time-budget", dest="purge_time_budget", type="int", help="Max seconds to spend purging per run; remaining rows are purged on following runs (default: 20)")
+    parser.add_option("", "--partition-status-variables", dest="partition_status_variables", action="store_true", default=False, help="Partition the status_variables table by day. Purging then drops expired partitions rather than deleting rows")
+    parser.add_option("", "--partition-days-ahead", dest="partition_days_ahead", type="int", help="Number of days for which status_variables partitions are created in advance (default: 7)")
     parser.add_option("", "--disable-bin-log", dest="disable_bin_log", action="store_true", help="Disable binary logging (binary logging enabled by default)")
     parser.add_option("", "--skip-disable-bin-log", dest="disable_bin_log", action="store_false", help="Skip disabling the binary logging (this is default behaviour; binary logging enabled by default)")
     parser.add_option("", "--skip-check-replication", dest="skip_check_replication", action="store_true", help="Skip checking on master/slave status variables")
@@ -82,6 +123,11 @@ Available commands:
     parser.add_option("", "--skip-alerts", dest="skip_alerts", action="store_true", help="Skip evaluating alert conditions as well as sending email notifications")
     parser.add_option("", "--skip-emails", dest="skip_emails", action="store_true", help="Skip sending email notifications")
     parser.add_option("", "--force-emails", dest="force_emails", action="store_true", help="Force sending email notifications even if there's nothing wrong")
+    parser.add_option("", "--backtest-days", dest="backtest_days", type="int", help="Number of days over which alert conditions are backtested (argument is backtest) (default: 30)")
+    parser.add_option("", "--backtest-resolution", dest="backtest_resolution", help="Backtest alert conditions against 'sample', 'hour' or 'day' rows (argument is backtest) (default: sample)")
+    parser.add_option("", "--backtest-conditions", dest="backtest_conditions", help="Comma delimited alert_condition ids to backtest, including disabled conditions (argument is backtest) (default: all conditions)")
+    parser.add_option("", "--custom-query-concurrency", dest="custom_query_concurrency", type="int", help="Number of dedicated monitored host connections on which custom queries run concurrently (default: 4)")
+    parser.add_option("", "--custom-query-timeout", dest="custom_query_timeout", type="int", help="Seconds after which a custom query is aborted and its value recorded as NULL (default: 10)")
     parser.add_option("", "--skip-custom", dest="skip_custom", action="store_true", help="Skip custom query execution and evaluation")
     parser.add_option("", "--skip-defaults-file", dest="skip_defaults_file", action="store_true", help="Do not read defaults file. Overrides --defaults-file and ignores /etc/mycheckpoint.cnf")
     parser.add_option("", "--chart-width", dest="chart_width", type="int", help="Chart image width (default: 370, min value: 150)")
@@ -90,9 +136,21 @@ Available commands:
     parser.add_option("", "--smtp-host", dest="smtp_host", help="SMTP mail server host name or IP")
     parser.add_option("", "--smtp-from", dest="smtp_from", help="Address to use as mail sender")
     parser.add_option("", "--smtp-to", dest="smtp_to", help="Comma delimited email addresses to send emails to")
+    parser.add_option("", "--smtp-timeout", dest="smtp_timeout", type="int", help="Seconds after which SMTP operations time out (default: 30)")
+    parser.add_option("", "--email-max-attempts", dest="email_max_attempts", type="int", help="Max number of attempts at sending a queued alert email (default: 10)")
+    parser.add_option("", "--inline-emails", dest="inline_emails", action="store_true", default=False, help="Send queued alert emails at the end of a collection run, delaying it by up to --smtp-timeout per SMTP operation. By default, a collection run only queues alert emails: run the send_emails command on its own schedule (e.g. a separate cron entry). The collector daemon sends from a background thread")
     parser.add_option("", "--run-as-service", dest="run_as_service", action="store_true", help="Hint to this script that it is being executed as a linux service.")
     parser.add_option("", "--allow-http-as-service", dest="allow_http_as_service", action="store_true", help="Must be provided in order for mycheckpoint to be able to open HTTP when executed with '--run-as-service'")
     parser.add_option("", "--http-port", dest="http_port", type="int", help="Socket to listen on when running as web server (argument is http)")
+    parser.add_option("", "--http-cache-size", dest="http_cache_size", type="int", help="Max number of rendered pages cached by the web server. Cached pages are served until a new sample is taken. 0 disables caching (default: 64)")
+    parser.add_option("", "--http-downsample-max-rows", dest="http_downsample_max_rows", type="int", help="Max number of rows read for downsampled charts and series; longer ranges are read from hour or day aggregations (default: 100000)")
+    parser.add_option("", "--http-python-charts", dest="http_python_charts", action="store_true", default=False, help="Have the web server render zoom charts in-process from report data, rather than read them from the sv_report_chart_* views, which are computed by the write server")
+    parser.add_option("", "--http-databases-ttl", dest="http_databases_ttl", type="int", help="Seconds for which the list of mycheckpoint databases is cached by the web server; the list is refreshed in the background (default: 300)")
+    parser.add_option("", "--http-pool-size", dest="http_pool_size", type="int", help="Max number of database connections used by the web server; also max number of concurrently served requests (default: 8)")
+    parser.add_option("", "--daemon-interval", dest="daemon_interval", type="int", help="Seconds between samples when running as collector daemon (argument is daemon) (default: 60, min value: 1)")
+    parser.add_option("", "--hosts-file", dest="hosts_file", help="Configuration file listing monitored hosts, one section per host, each mapped to its own database (argument is collect_hosts)")
+    parser.add_option("", "--hosts-concurrency", dest="hosts_concurrency", type="int", help="Max number of hosts to collect concurrently (argument is collect_hosts) (default: 8)")
+    parser.add_option("", "--daemon-max-backoff", dest="daemon_max_backoff", type="int", help="Max seconds to wait between reconnect attempts when running as collector daemon (default: 600)")
     parser.add_option("", "--single", dest="single", action="store_true", help="Only allow one running instance of mycheckpoint at a time on this machine")
     parser.add_option("", "--debug", dest="debug", action="store_true", help="Print stack trace on error")
     parser.add_option("-v", "--verbose", dest="verbose", action="store_true", help="Print user friendly messages")
@@ -102,6 +160,8 @@ Available commands:
     option_types = {}
     for option in parser.option_list:
         option_types[option.dest] = option.type
+        if option.action in ["store_true", "store_false"]:
+            option_types[option.dest] = "bool"
         
     option_defaults = {
         "user": "",
@@ -118,14 +178,27 @@ Available commands:
         "defaults_file": "",
         "database": "mycheckpoint",
         "skip_aggregation": False,
+        "materialize_diff": False,
+        "incremental_aggregation": False,
+        "chart_cache": False,
         "rebuild_aggregation": False,
         "purge_days": 182,
+        "purge_chunk_size": 1000,
+        "purge_chunk_pause_millis": 100,
+        "purge_time_budget": 20,
+        "partition_status_variables": False,
+        "partition_days_ahead": 7,
         "disable_bin_log": False,
         "skip_check_replication": False,
         "force_os_monitoring": False,
         "skip_alerts": False,
         "skip_emails": False,
         "force_emails": False,
+        "backtest_days": 30,
+        "backtest_resolution": "sample",
+        "backtest_conditions": "",
+        "custom_query_concurrency": 4,
+        "custom_query_timeout": 10,
         "skip_custom": False,
         "skip_defaults_file": False,
         "chart_width": 370,
@@ -134,9 +207,21 @@ Available commands:
         "smtp_host": None,
         "smtp_from": None,
         "smtp_to": None,
+        "smtp_timeout": 30,
+        "email_max_attempts": 10,
+        "inline_emails": False,
         "run_as_service": False,
         "allow_http_as_service": False,
         "http_port": 12306,
+        "http_python_charts": False,
+        "http_databases_ttl": 300,
+        "http_pool_size": 8,
+        "http_cache_size": 64,
+        "http_downsample_max_rows": 100000,
+        "daemon_interval": 60,
+        "daemon_max_backoff": 600,
+        "hosts_file": None,
+        "hosts_concurrency": 8,
         "single": False,
         "debug": False,
         "verbose": False,
@@ -202,16 +287,10 @@ def sorted_list(l):
 
 def open_connections():
     if options.prompt_password:
-        password=getpass.getpass()
-    else:
-        password=options.password
-    write_connection = MySQLdb.connect(
-        host = options.host,
-        user = options.user,
-        passwd = password,
-        port = options.port,
-        unix_socket = options.socket,
-        db = database_name)
+        # Prompt once; connections may be reopened later on
+        options.password = getpass.getpass()
+        options.prompt_password = False
+    write_connection = open_write_connection()
 
     # If no read (monitored) host specified, then read+write hosts are the same one...
     if not options.monitored_host:
@@ -237,6 +316,31 @@ def open_connections():
     return monitored_connection, write_connection;
 
 
+def open_write_connection():
+    return MySQLdb.connect(
+        host = options.host,
+        user = options.user,
+        passwd = options.password,
+        port = options.port,
+        unix_socket = options.socket,
+        db = database_name)
+
+
+def open_monitored_connection():
+    """
+    Open an additional connection to the monitored host, which is the write host unless --monitored-host is given.
+    Assumes open_connections() has already been called.
+    """
+    if not options.monitored_host:
+        return open_write_connection()
+    return MySQLdb.connect(
+        user = options.monitored_user,
+        passwd = options.monitored_password,
+        host = options.monitored_host,
+        port = options.monitored_port,
+        unix_socket = options.monitored_socket)
+
+
 def init_connections():
     queries = [
                """SET @@group_concat_max_len = GREATEST(@@group_concat_max_len, @@max_allowed_packet)""",
@@ -249,16 +353,51 @@ def init_connections():
 
 def act_query(query, connection=None):
     """
-    Run the given query, commit changes
+    Run the given query, commit changes (unless within a write transaction)
+    """
+    num_affected_rows, _insert_id = act_insert_query(query, connection)
+    return num_affected_rows
+
+
+def act_insert_query(query, connection=None):
+    """
+    Run the given query, commit changes (unless within a write transaction).
+    Return the number of affected rows and the generated AUTO_INCREMENT id, as reported by the cursor.
     """
     if connection is None:
         connection = write_conn
     connection = write_conn
     cursor = connection.cursor()
     num_affected_rows = cursor.execute(query)
+    insert_id = cursor.lastrowid
     cursor.close()
-    connection.commit()
-    return num_affected_rows
+    if not write_transaction_active:
+        connection.commit()
+    return num_affected_rows, insert_id
+
+
+def begin_write_transaction():
+    """
+    Have following act_query() calls share a single transaction, until commit_write_transaction()
+    """
+    global write_transaction_active
+    write_transaction_active = True
+
+
+def commit_write_transaction():
+    global write_transaction_active
+    write_transaction_active = False
+    write_conn.commit()
+
+
+def rollback_write_transaction():
+    global write_transaction_active
+    write_transaction_active = False
+    try:
+        write_conn.rollback()
+    except MySQLdb.Error:
+        if options.debug:
+            traceback.print_exc()
 
 
 def act_query_ignore_error(query, connection=None):
@@ -295,24 +434,29 @@ def get_rows(query, connection=None):
     return rows
 
 
-def get_last_insert_id():
-    query = "SELECT LAST_INSERT_ID() AS id"
-    row = get_row(query, write_conn)
-    return int(row["id"])
-
+def get_sample_timestamp():
+    """
+    Return the current time on the write server, in its session time zone, as a 'YYYY-MM-DD HH:MM:SS' string.
+    Computed by local clock, adjusted by the server's clock skew and time zone offset. These are measured
+    once per connection and re-measured hourly (time zone offset may change with daylight saving time).
+    """
+    global server_clock
 
-def get_last_written_timestamp():
-    query = """
+    if server_clock is None or time.time() - server_clock["measured_at"] >= 3600:
+        query = """
             SELECT 
-              CONCAT(ts, '') AS ts_as_string 
-            FROM 
-              %s.%s
-            WHERE 
-              id = %d
-        """ % (database_name, table_name, status_variables_insert_id)
-
-    row = get_row(query, write_conn)
-    return row["ts_as_string"]
+              UNIX_TIMESTAMP() AS server_unix_timestamp, 
+              TIMESTAMPDIFF(SECOND, UTC_TIMESTAMP(), NOW()) AS time_zone_offset
+            """
+        measured_at = time.time()
+        row = get_row(query, write_conn)
+        server_clock = {
+            "measured_at": measured_at,
+            "skew": int(row["server_unix_timestamp"]) - int(measured_at),
+            "time_zone_offset": int(row["time_zone_offset"]),
+            }
+    server_time = int(time.time()) + server_clock["skew"] + server_clock["time_zone_offset"]
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(server_time))
 
 
 def get_current_timestamp():
@@ -949,13 +1093,22 @@ def get_column_sign_indicator(column_name):
 
 def create_status_variables_table():
     columns_listing = ",\n".join(["%s BIGINT %s" % (column_name, get_column_sign_indicator(column_name)) for column_name in get_status_variables_columns()])
+    primary_key_definition = "PRIMARY KEY (id)"
+    partitions_clause = ""
+    if options.partition_status_variables:
+        # Partitioning column must be part of any unique key
+        primary_key_definition = "PRIMARY KEY (id, ts)"
+        current_date = get_server_current_date()
+        partitions_clause = get_status_variables_partitions_clause(current_date, current_date + datetime.timedelta(days=options.partition_days_ahead))
     query = """CREATE TABLE %s.%s (
-            id INT AUTO_INCREMENT PRIMARY KEY,
+            id INT AUTO_INCREMENT,
             ts TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             %s,
+            %s,
             UNIQUE KEY ts (ts)
        )
-        """ % (database_name, table_name, columns_listing)
+       %s
+        """ % (database_name, table_name, columns_listing, primary_key_definition, partitions_clause)
 
     table_created = False
     try:
@@ -971,6 +1124,131 @@ def create_status_variables_table():
     return table_created
 
 
+def get_server_current_date():
+    row = get_row("SELECT CONCAT(CURDATE(), '') AS current_date_as_string", write_conn)
+    return parse_date(row["current_date_as_string"])
+
+
+def parse_date(date_as_string):
+    return datetime.date(*time.strptime(date_as_string[0:10], "%Y-%m-%d")[0:3])
+
+
+def get_partition_name(partition_date):
+    return "p%s" % partition_date.strftime("%Y%m%d")
+
+
+def get_partition_definition(partition_date):
+    """
+    A partition holds a single day of samples
+    """
+    next_date = partition_date + datetime.timedelta(days=1)
+    return "PARTITION %s VALUES LESS THAN (UNIX_TIMESTAMP('%s'))" % (get_partition_name(partition_date), next_date.strftime("%Y-%m-%d"))
+
+
+def get_partitions_definitions(from_date, to_date):
+    partitions_definitions = []
+    partition_date = from_date
+    while partition_date <= to_date:
+        partitions_definitions.append(get_partition_definition(partition_date))
+        partition_date = partition_date + datetime.timedelta(days=1)
+    return partitions_definitions
+
+
+def get_status_variables_partitions_clause(from_date, to_date):
+    partitions_definitions = get_partitions_definitions(from_date, to_date)
+    # Catch-all partition, in case partitions are not maintained in time
+    partitions_definitions.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+    return """PARTITION BY RANGE (UNIX_TIMESTAMP(ts)) (
+            %s
+       )""" % ",\n".join(partitions_definitions)
+
+
+def get_status_variables_partitions():
+    """
+    Return names of status_variables partitions, in order. An empty list indicates the table is not partitioned.
+    """
+    query = """
+        SELECT
+          PARTITION_NAME
+        FROM
+          INFORMATION_SCHEMA.PARTITIONS
+        WHERE
+          TABLE_SCHEMA = '%s'
+          AND TABLE_NAME = '%s'
+          AND PARTITION_NAME IS NOT NULL
+        ORDER BY
+          PARTITION_ORDINAL_POSITION
+        """ % (database_name, table_name)
+    return [row["PARTITION_NAME"] for row in get_rows(query, write_conn)]
+
+
+def get_partition_date(partition_name):
+    """
+    Return the date of a daily partition, or None for any other partition (e.g. pmax)
+    """
+    if not re.match("^p[\\d]{8}$", partition_name):
+        return None
+    return datetime.date(*time.strptime(partition_name[1:], "%Y%m%d")[0:3])
+
+
+def partition_status_variables_table():
+    """
+    Convert an existing, non partitioned status_variables table into a day-partitioned one.
+    Without --partition-status-variables, a partitioned table is converted back, so that the table layout
+    matches the purge path in use.
+    """
+    if not options.partition_status_variables:
+        if get_status_variables_partitions():
+            verbose("Will remove partitioning from %s table. This may take a while" % table_name)
+            act_query("ALTER TABLE %s.%s REMOVE PARTITIONING" % (database_name, table_name))
+            verbose("%s table partitioning removed" % table_name)
+        return
+    if get_status_variables_partitions():
+        return
+
+    row = get_row("SELECT CONCAT(DATE(MIN(ts)), '') AS min_date FROM %s.%s" % (database_name, table_name), write_conn)
+    current_date = get_server_current_date()
+    from_date = current_date
+    if row and row["min_date"]:
+        from_date = min(parse_date(row["min_date"]), current_date)
+    verbose("Will partition %s table. This may take a while" % table_name)
+    query = """ALTER TABLE %s.%s
+            DROP PRIMARY KEY,
+            ADD PRIMARY KEY (id, ts)
+            %s
+        """ % (database_name, table_name,
+               get_status_variables_partitions_clause(from_date, current_date + datetime.timedelta(days=options.partition_days_ahead)))
+    act_query(query)
+    verbose("%s table partitioned" % table_name)
+
+
+def maintain_status_variables_partitions(partitions):
+    """
+    Make sure partitions exist for the upcoming --partition-days-ahead days.
+    New partitions are split from the (normally empty) pmax partition.
+    """
+    partitions_dates = [get_partition_date(partition_name) for partition_name in partitions]
+    partitions_dates = [partition_date for partition_date in partitions_dates if partition_date is not None]
+    if not partitions_dates or "pmax" not in partitions:
+        return 0
+
+    current_date = get_server_current_date()
+    from_date = max(partitions_dates) + datetime.timedelta(days=1)
+    to_date = current_date + datetime.timedelta(days=options.partition_days_ahead)
+    if from_date > to_date:
+        return 0
+
+    partitions_definitions = get_partitions_definitions(from_date, to_date)
+    partitions_definitions.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+    query = """ALTER TABLE %s.%s
+            REORGANIZE PARTITION pmax INTO (
+              %s
+            )
+        """ % (database_name, table_name, ",\n".join(partitions_definitions))
+    act_query(query)
+    verbose("Added %d partitions to %s" % (len(partitions_definitions) - 1, table_name))
+    return len(partitions_definitions) - 1
+
 
 def create_metadata_table():
     query = """
@@ -989,7 +1267,8 @@ def create_metadata_table():
             last_deploy_successful TINYINT UNSIGNED NOT NULL DEFAULT 0,
             mysql_version VARCHAR(255) CHARSET ascii NOT NULL,
             database_name VARCHAR(255) CHARSET utf8 NOT NULL,
-            custom_queries VARCHAR(4096) CHARSET ascii NOT NULL
+            custom_queries VARCHAR(4096) CHARSET ascii NOT NULL,
+            deploy_options VARCHAR(255) CHARSET ascii NOT NULL DEFAULT ''
         )
         """ % database_name
 
@@ -1001,13 +1280,26 @@ def create_metadata_table():
 
     query = """
         REPLACE INTO %s.metadata
-            (revision, build, last_deploy_successful, mysql_version, database_name, custom_queries)
+            (revision, build, last_deploy_successful, mysql_version, database_name, custom_queries, deploy_options)
         VALUES
-            (%d, %d, 0, '%s', '%s', '')
-        """ % (database_name, revision_number, build_number, get_monitored_host_mysql_version(), database_name)
+            (%d, %d, 0, '%s', '%s', '', '%s')
+        """ % (database_name, revision_number, build_number, get_monitored_host_mysql_version(), database_name, get_deploy_options())
     act_query(query)
 
 
+def get_deploy_options():
+    """
+    Options which determine the deployed schema, as stored in the metadata table.
+    Running with options other than those deployed requires a re-deploy.
+    """
+    deploy_options = [
+        ("materialize_diff", options.materialize_diff),
+        ("partition_status_variables", options.partition_status_variables),
+        ("chart_cache", options.chart_cache),
+        ]
+    return ",".join(["%s=%d" % (option_name, int(bool(option_value))) for (option_name, option_value) in deploy_options])
+
+
 def finalize_deploy():
     query = """UPDATE ${database_name}.metadata 
         SET last_deploy_successful = 1
@@ -1079,6 +1371,40 @@ def create_charts_api_table():
     act_query(query)
 
 
+def create_chart_cache_table():
+    """
+    The chart_cache table holds the charts of each resolution, as rendered upon collection by refresh_chart_cache().
+    The sv_report_chart_* views then read from this table.
+    """
+    if not options.chart_cache:
+        return
+
+    query = """
+            DROP TABLE IF EXISTS %s.chart_cache
+        """ % database_name
+    try:
+        act_query(query)
+    except MySQLdb.Error:
+        exit_with_error("Cannot execute %s" % query )
+
+    query = """
+        CREATE TABLE %s.chart_cache (
+            resolution VARCHAR(16) CHARSET ascii COLLATE ascii_bin NOT NULL,
+            chart_alias VARCHAR(64) CHARSET ascii COLLATE ascii_bin NOT NULL,
+            chart TEXT CHARSET utf8,
+            chart_extended MEDIUMTEXT CHARSET utf8,
+            source_ts DATETIME,
+            PRIMARY KEY (resolution, chart_alias)
+        )
+        """ % database_name
+
+    try:
+        act_query(query)
+        verbose("chart_cache table created")
+    except MySQLdb.Error:
+        exit_with_error("Cannot create table %s.chart_cache" % database_name)
+
+
 def create_html_components_table():
     query = """
             DROP TABLE IF EXISTS %s.html_components
@@ -1193,7 +1519,14 @@ def create_custom_query_table():
           description VARCHAR(255) CHARSET utf8 COLLATE utf8_bin DEFAULT NULL,
           chart_type ENUM('value', 'value_psec', 'time') NOT NULL DEFAULT 'value',
           chart_order TINYINT(4) NOT NULL DEFAULT '0',
-          PRIMARY KEY (custom_query_id)
+          sample_interval INT UNSIGNED NOT NULL DEFAULT 0,
+          sample_interval_unit ENUM('samples', 'seconds') NOT NULL DEFAULT 'samples',
+          skipped_sample_value ENUM('carry_forward', 'null') NOT NULL DEFAULT 'carry_forward',
+          result_type ENUM('single_value', 'value_columns', 'name_value_rows') NOT NULL DEFAULT 'single_value',
+          source_custom_query_id INT UNSIGNED DEFAULT NULL,
+          value_name VARCHAR(64) CHARSET utf8 COLLATE utf8_general_ci DEFAULT NULL,
+          PRIMARY KEY (custom_query_id),
+          KEY source_custom_query_id (source_custom_query_id)
         )
         """ % database_name
     # Upgrade:
@@ -1201,10 +1534,25 @@ def create_custom_query_table():
         ALTER TABLE %s.custom_query 
           MODIFY COLUMN chart_type ENUM('value', 'value_psec', 'time', 'none') NOT NULL DEFAULT 'value'
         """ % database_name
+    alter_query_1 = """
+        ALTER TABLE %s.custom_query 
+          ADD COLUMN sample_interval INT UNSIGNED NOT NULL DEFAULT 0 AFTER chart_order,
+          ADD COLUMN sample_interval_unit ENUM('samples', 'seconds') NOT NULL DEFAULT 'samples' AFTER sample_interval,
+          ADD COLUMN skipped_sample_value ENUM('carry_forward', 'null') NOT NULL DEFAULT 'carry_forward' AFTER sample_interval_unit
+        """ % database_name
+    alter_query_2 = """
+        ALTER TABLE %s.custom_query 
+          ADD COLUMN result_type ENUM('single_value', 'value_columns', 'name_value_rows') NOT NULL DEFAULT 'single_value' AFTER skipped_sample_value,
+          ADD COLUMN source_custom_query_id INT UNSIGNED DEFAULT NULL AFTER result_type,
+          ADD COLUMN value_name VARCHAR(64) CHARSET utf8 COLLATE utf8_general_ci DEFAULT NULL AFTER source_custom_query_id,
+          ADD KEY source_custom_query_id (source_custom_query_id)
+        """ % database_name
 
     try:
         act_query(query)
         act_query(alter_query)
+        act_query_ignore_error(alter_query_1)
+        act_query_ignore_error(alter_query_2)
         verbose("custom_query table created")
     except MySQLdb.Error:
         if options.debug:
@@ -1227,6 +1575,31 @@ def create_custom_query_table():
     act_query(query)
 
 
+def create_custom_query_cache_table():
+    """
+    Last evaluated value of each custom query, used for custom queries with a sample_interval,
+    on samples where they are not evaluated.
+    """
+    query = """
+        CREATE TABLE IF NOT EXISTS %s.custom_query_cache (
+          custom_query_id INT UNSIGNED,
+          custom_value BIGINT DEFAULT NULL,
+          query_time INT UNSIGNED DEFAULT NULL,
+          evaluated_ts TIMESTAMP NULL DEFAULT NULL,
+          skipped_samples INT UNSIGNED NOT NULL DEFAULT 0,
+          PRIMARY KEY (custom_query_id)
+        )
+        """ % database_name
+
+    try:
+        act_query(query)
+        verbose("custom_query_cache table created")
+    except MySQLdb.Error:
+        if options.debug:
+            traceback.print_exc()
+        exit_with_error("Cannot create table %s.custom_query_cache" % database_name)
+
+
 def create_custom_query_view():
     query = """
         CREATE
@@ -1242,6 +1615,9 @@ def create_custom_query_view():
             description,
             chart_type,
             chart_order,
+            result_type,
+            source_custom_query_id,
+            value_name,
             CASE chart_type
                 WHEN 'value' THEN CONCAT('custom_', custom_query_id)
                 WHEN 'value_psec' THEN CONCAT('custom_', custom_query_id, '_psec')
@@ -1291,27 +1667,48 @@ def create_custom_query_top_navigation_view():
 
 
 
-def execute_custom_query(custom_query_id, query_eval):
+def execute_custom_query(custom_query_id, query_eval, connection=None, result_type="single_value"):
+    """
+    Execute a custom query. Returns (custom_value, query_time), or None on invalid result.
+    For 'single_value' queries, custom_value is an integer (or None).
+    For multi-value queries, custom_value is a dict mapping (lower case) value names to values:
+    - 'value_columns': a single row result; each column is a value, named by the column name
+    - 'name_value_rows': a two column result; each row is a value: first column is the name, second is the value
+    """
+    if connection is None:
+        connection = monitored_conn
     start_time = time.time()
-    rows = get_rows(query_eval)
+    cursor = connection.cursor()
+    cursor.execute(query_eval)
+    rows = cursor.fetchall()
+    column_names = [column_description[0] for column_description in cursor.description]
+    cursor.close()
     end_time = time.time()
     
-    query_error_message = "Custom query is expected to produce a single (int) column, single row result. custom_query_id=%d" % custom_query_id
-    if len(rows) != 1:
-        return print_error(query_error_message)
-        
-    row = rows[0]
-    if len(row) != 1:
-        return print_error(query_error_message)
+    if result_type == "value_columns":
+        query_error_message = "Custom query is expected to produce a single row result, with (int) columns. custom_query_id=%d" % custom_query_id
+        if len(rows) != 1:
+            return print_error(query_error_message)
+        named_values = zip(column_names, rows[0])
+    elif result_type == "name_value_rows":
+        query_error_message = "Custom query is expected to produce (name, int value) rows. custom_query_id=%d" % custom_query_id
+        if len(column_names) != 2:
+            return print_error(query_error_message)
+        named_values = [(row[0], row[1]) for row in rows]
+    else:
+        query_error_message = "Custom query is expected to produce a single (int) column, single row result. custom_query_id=%d" % custom_query_id
+        if len(rows) != 1:
+            return print_error(query_error_message)
+        if len(column_names) != 1:
+            return print_error(query_error_message)
+        named_values = None
     
-    # Expect an integer value:
-    custom_value = None
+    # Expect integer values:
     try:
-        raw_custom_value = row.values()[0]
-        if raw_custom_value is None:
-            custom_value = None
+        if named_values is None:
+            custom_value = get_custom_query_int_value(rows[0][0])
         else:
-            custom_value = int(raw_custom_value)
+            custom_value = dict([(get_custom_query_value_name(value_name), get_custom_query_int_value(raw_custom_value)) for (value_name, raw_custom_value) in named_values])
     except ValueError:
         return print_error(query_error_message)
     
@@ -1320,7 +1717,204 @@ def execute_custom_query(custom_query_id, query_eval):
     return custom_value, query_time
 
 
+def get_custom_query_value_name(value_name):
+    """
+    Normalize a multi-value custom query value name (as returned by the query, or as listed in custom_query)
+    into lower case unicode, so that non-ASCII names compare correctly.
+    """
+    if isinstance(value_name, str):
+        value_name = value_name.decode("utf8", "replace")
+    return unicode(value_name).lower()
+
+
+def get_custom_query_int_value(raw_custom_value):
+    if raw_custom_value is None:
+        return None
+    return int(raw_custom_value)
+
+
+def open_custom_query_connection():
+    """
+    Open a dedicated monitored host connection for custom queries, with server side execution timeout.
+    Returns a dict of the connection and its server side connection id (used for killing runaway queries).
+    """
+    connection = open_monitored_connection()
+    cursor = connection.cursor()
+    cursor.execute("SET @@session.sql_mode := REPLACE(@@session.sql_mode, 'ONLY_FULL_GROUP_BY', '')")
+    # MySQL 5.7 and above; MariaDB 10.1 and above. Older servers only get the client side deadline.
+    timeout_queries = [
+        "SET SESSION max_execution_time = %d" % (options.custom_query_timeout * 1000),
+        "SET SESSION max_statement_time = %d" % options.custom_query_timeout,
+        ]
+    for query in timeout_queries:
+        try:
+            cursor.execute(query)
+            break
+        except MySQLdb.Error:
+            pass
+    cursor.execute("SELECT CONNECTION_ID()")
+    connection_id = int(cursor.fetchone()[0])
+    cursor.close()
+    return {"connection": connection, "connection_id": connection_id}
+
+
+def close_custom_query_connections():
+    global custom_query_connections
+
+    for custom_query_connection in custom_query_connections:
+        try:
+            custom_query_connection["connection"].close()
+        except MySQLdb.Error:
+            pass
+    custom_query_connections = []
+
+
+def execute_custom_queries(custom_queries):
+    """
+    Execute given (custom_query_id, query_eval, result_type) tuples concurrently, each worker thread on its own dedicated
+    connection. Returns a dict mapping custom_query_id to (custom_value, query_time). A query which does not
+    complete within --custom-query-timeout of its own start is killed, and maps to (None, elapsed time).
+    Workers whose connection failed (or whose query was killed) do not take further queries; replacement
+    workers, on new connections, take over the pending queries.
+    Failed queries are not included in the result.
+    A connection is only ever used, and closed, by its worker thread.
+    """
+    global custom_query_connections
+
+    num_workers = min(options.custom_query_concurrency, len(custom_queries))
+    while len(custom_query_connections) < num_workers:
+        custom_query_connections.append(open_custom_query_connection())
+    worker_connections = custom_query_connections[0:num_workers]
+
+    pending_queue = Queue.Queue()
+    for custom_query in custom_queries:
+        pending_queue.put(custom_query)
+    results = {}
+    running = {}
+    failed_connections = []
+    lock = threading.Lock()
+    # Set by workers whenever a query completes
+    query_completed = threading.Event()
+
+    def worker(custom_query_connection):
+        while True:
+            lock.acquire()
+            try:
+                try:
+                    custom_query_id, query_eval, result_type = pending_queue.get_nowait()
+                except Queue.Empty:
+                    return
+                running[custom_query_id] = (custom_query_connection, time.time())
+            finally:
+                lock.release()
+            try:
+                custom_query_result = execute_custom_query(custom_query_id, query_eval, custom_query_connection["connection"], result_type)
+            except MySQLdb.Error, err:
+                print_error("Custom query failed. custom_query_id=%d: %s" % (custom_query_id, err))
+                custom_query_result = None
+                lock.acquire()
+                failed_connections.append(custom_query_connection)
+                lock.release()
+            except Exception, err:
+                # The connection itself is fine
+                print_error("Custom query failed. custom_query_id=%d: %s" % (custom_query_id, err))
+                if options.debug:
+                    traceback.print_exc()
+                custom_query_result = None
+            lock.acquire()
+            if custom_query_id in running:
+                del running[custom_query_id]
+                if custom_query_result is not None:
+                    results[custom_query_id] = custom_query_result
+            connection_failed = custom_query_connection in failed_connections
+            lock.release()
+            query_completed.set()
+            if connection_failed:
+                # Connection may be broken (or its query killed); do not reuse
+                try:
+                    custom_query_connection["connection"].close()
+                except MySQLdb.Error:
+                    pass
+                return
+
+    started_connections = []
+    def start_worker(custom_query_connection):
+        started_connections.append(custom_query_connection)
+        thread = threading.Thread(target=worker, args=(custom_query_connection,))
+        thread.setDaemon(True)
+        thread.start()
+
+    for custom_query_connection in worker_connections:
+        start_worker(custom_query_connection)
+
+    while True:
+        # Cleared before inspecting state, so that no completion goes unnoticed
+        query_completed.clear()
+        now = time.time()
+        lock.acquire()
+        timed_out = [(custom_query_id, custom_query_connection, query_start_time) 
+            for (custom_query_id, (custom_query_connection, query_start_time)) in running.items() 
+            if now - query_start_time >= options.custom_query_timeout]
+        for (custom_query_id, custom_query_connection, query_start_time) in timed_out:
+            # Its connection is closed by its worker thread once the query is killed.
+            del running[custom_query_id]
+            failed_connections.append(custom_query_connection)
+            results[custom_query_id] = (None, int(1000*(now - query_start_time)))
+        num_pending_queries = pending_queue.qsize()
+        num_live_workers = len([custom_query_connection for custom_query_connection in started_connections if custom_query_connection not in failed_connections])
+        next_deadline = min([query_start_time + options.custom_query_timeout for (custom_query_connection, query_start_time) in running.values()] or [None])
+        lock.release()
+
+        for (custom_query_id, custom_query_connection, query_start_time) in timed_out:
+            print_error("Custom query timed out after %d seconds. custom_query_id=%d" % (options.custom_query_timeout, custom_query_id))
+            try:
+                cursor = monitored_conn.cursor()
+                cursor.execute("KILL QUERY %d" % custom_query_connection["connection_id"])
+                cursor.close()
+            except MySQLdb.Error:
+                if options.debug:
+                    traceback.print_exc()
+        for i in range(min(num_workers - num_live_workers, num_pending_queries)):
+            try:
+                replacement_connection = open_custom_query_connection()
+            except MySQLdb.Error, err:
+                print_error("Cannot open custom query connection: %s" % err)
+                break
+            lock.acquire()
+            custom_query_connections.append(replacement_connection)
+            lock.release()
+            start_worker(replacement_connection)
+            num_live_workers += 1
+        if num_pending_queries and not num_live_workers:
+            # No worker is left to run the pending queries
+            while True:
+                try:
+                    custom_query_id, query_eval, result_type = pending_queue.get_nowait()
+                except Queue.Empty:
+                    break
+                print_error("Custom query not executed: no custom query connection. custom_query_id=%d" % custom_query_id)
+            num_pending_queries = 0
+
+        if next_deadline is None:
+            if not num_pending_queries:
+                break
+            # Pending queries are about to be picked up by workers
+            query_completed.wait(0.1)
+        else:
+            query_completed.wait(max(0, next_deadline - time.time()))
+
+    lock.acquire()
+    for custom_query_connection in failed_connections:
+        if custom_query_connection in custom_query_connections:
+            custom_query_connections.remove(custom_query_connection)
+    lock.release()
+    return results
+
+
 def collect_custom_data():
+    """
+    Evaluate custom queries into status_dict, so that they are written along with the sample.
+    """
     if options.skip_custom:
         verbose("Skipping custom queries")
         return
@@ -1329,37 +1923,132 @@ def collect_custom_data():
     
     query = """
             SELECT 
-              * 
+              custom_query.custom_query_id,
+              custom_query.query_eval,
+              custom_query.description,
+              custom_query.sample_interval,
+              custom_query.sample_interval_unit,
+              custom_query.skipped_sample_value,
+              custom_query.result_type,
+              custom_query.source_custom_query_id,
+              custom_query.value_name,
+              custom_query_cache.custom_query_id IS NOT NULL AS is_cached,
+              custom_query_cache.custom_value AS cached_value,
+              custom_query_cache.skipped_samples,
+              TIMESTAMPDIFF(SECOND, custom_query_cache.evaluated_ts, NOW()) AS seconds_since_evaluation
             FROM 
               ${database_name}.custom_query
+              LEFT JOIN ${database_name}.custom_query_cache USING (custom_query_id)
             WHERE
               enabled = 1
+            ORDER BY
+              custom_query_id
         """
     query = query.replace("${database_name}", database_name)
-    custom_updates = []
-    for custom_query in get_rows(query, write_conn):
+    rows = get_rows(query, write_conn)
+    # Values of multi-value custom queries are each stored by their own (source_custom_query_id referencing) custom query
+    value_custom_queries = {}
+    for custom_query in rows:
+        if custom_query["source_custom_query_id"] is not None:
+            value_custom_queries.setdefault(int(custom_query["source_custom_query_id"]), []).append(custom_query)
+
+    custom_queries = []
+    interval_custom_query_ids = []
+    skipped_custom_query_ids = []
+    for custom_query in rows:
+        if custom_query["source_custom_query_id"] is not None:
+            continue
         custom_query_id = int(custom_query["custom_query_id"])
-        query_eval = custom_query["query_eval"]
-        description = custom_query["description"]
-        verbose("Custom query: %s" % description)
-        custom_query_result = execute_custom_query(custom_query_id, query_eval)
-        if custom_query_result is not None:
-            custom_value, query_time = custom_query_result
+        custom_query_and_values = [custom_query] + value_custom_queries.get(custom_query_id, [])
+        sample_interval = int(custom_query["sample_interval"])
+        if sample_interval > 1:
+            interval_custom_query_ids.extend([int(row["custom_query_id"]) for row in custom_query_and_values])
+        if not is_custom_query_due(custom_query):
+            verbose("Custom query: %s; skipped (sample interval: %d %s)" % (custom_query["description"], sample_interval, custom_query["sample_interval_unit"]))
+            for row in custom_query_and_values:
+                skipped_custom_query_id = int(row["custom_query_id"])
+                skipped_custom_query_ids.append(skipped_custom_query_id)
+                if custom_query["skipped_sample_value"] == "carry_forward":
+                    status_dict["custom_%d" % skipped_custom_query_id] = row["cached_value"]
+                else:
+                    status_dict["custom_%d" % skipped_custom_query_id] = None
+                status_dict["custom_%d_time" % skipped_custom_query_id] = None
+            continue
+        verbose("Custom query: %s" % custom_query["description"])
+        custom_queries.append((custom_query_id, custom_query["query_eval"], custom_query["result_type"]))
+
+    custom_query_results = {}
+    if custom_queries:
+        custom_query_results = execute_custom_queries(custom_queries)
+    for (custom_query_id, (custom_value, query_time)) in custom_query_results.items():
+        if isinstance(custom_value, dict):
+            # A multi-value custom query: itself records the number of values returned
+            named_values = custom_value
+            custom_value = len(named_values)
+            for value_custom_query in value_custom_queries.get(custom_query_id, []):
+                value_custom_query_id = int(value_custom_query["custom_query_id"])
+                value_name = get_custom_query_value_name(value_custom_query["value_name"] or "")
+                custom_query_results[value_custom_query_id] = (named_values.get(value_name), query_time)
+        elif custom_value is None:
+            # Timed out; so are all its values
+            for value_custom_query in value_custom_queries.get(custom_query_id, []):
+                custom_query_results[int(value_custom_query["custom_query_id"])] = (None, query_time)
+        custom_query_results[custom_query_id] = (custom_value, query_time)
+    for (custom_query_id, (custom_value, query_time)) in custom_query_results.items():
+        status_dict["custom_%d" % custom_query_id] = custom_value
+        status_dict["custom_%d_time" % custom_query_id] = query_time
+    write_custom_query_cache(
+        [(custom_query_id, custom_query_result) for (custom_query_id, custom_query_result) in custom_query_results.items() if custom_query_id in interval_custom_query_ids],
+        skipped_custom_query_ids)
+
+
+def is_custom_query_due(custom_query):
+    """
+    A custom query is evaluated on every sample, unless it has a sample_interval. It is then evaluated once
+    every sample_interval samples or seconds, as of its last evaluation.
+    """
+    sample_interval = int(custom_query["sample_interval"])
+    if sample_interval <= 1:
+        return True
+    if not int(custom_query["is_cached"]):
+        return True
+    if custom_query["sample_interval_unit"] == "seconds":
+        seconds_since_evaluation = custom_query["seconds_since_evaluation"]
+        return seconds_since_evaluation is None or int(seconds_since_evaluation) >= sample_interval
+    return int(custom_query["skipped_samples"]) + 1 >= sample_interval
+
+
+def write_custom_query_cache(custom_query_results, skipped_custom_query_ids):
+    """
+    Cache the values of evaluated custom queries, and count skipped samples for the others.
+    """
+    if custom_query_results:
+        cached_values = []
+        for (custom_query_id, (custom_value, query_time)) in custom_query_results:
             if custom_value is None:
-                custom_updates.append("custom_%d = NULL, custom_%d_time = %d" % (custom_query_id, custom_query_id, query_time,))
-            else:
-                custom_updates.append("custom_%d = %d, custom_%d_time = %d" % (custom_query_id, custom_value, custom_query_id, query_time,))
-    if custom_updates:
+                custom_value = "NULL"
+            cached_values.append("(%d, %s, %d, NOW(), 0)" % (custom_query_id, custom_value, query_time))
         query = """
-            UPDATE 
-              %s.%s 
-            SET %s
-            WHERE 
-              id = %d""" % (
-            database_name, table_name, 
-            ",".join(custom_updates), 
-            status_variables_insert_id)
-        act_query(query) 
+            INSERT INTO ${database_name}.custom_query_cache
+              (custom_query_id, custom_value, query_time, evaluated_ts, skipped_samples)
+            VALUES
+              %s
+            ON DUPLICATE KEY UPDATE
+              custom_value = VALUES(custom_value),
+              query_time = VALUES(query_time),
+              evaluated_ts = VALUES(evaluated_ts),
+              skipped_samples = 0
+            """ % ",\n              ".join(cached_values)
+        query = query.replace("${database_name}", database_name)
+        act_query(query)
+    if skipped_custom_query_ids:
+        query = """
+            UPDATE ${database_name}.custom_query_cache
+            SET skipped_samples = skipped_samples + 1
+            WHERE custom_query_id IN (%s)
+            """ % ", ".join(["%d" % custom_query_id for custom_query_id in skipped_custom_query_ids])
+        query = query.replace("${database_name}", database_name)
+        act_query(query)
 
 
 def get_processlist_summary():
@@ -1417,11 +2106,21 @@ def create_alert_condition_table():
           ADD COLUMN monitored_host_condition_eval VARCHAR(4095) CHARSET utf8 COLLATE utf8_bin NOT NULL
           AFTER condition_eval
         """ % database_name
+    alter_query_2 = """
+        ALTER TABLE %s.alert_condition 
+          ADD COLUMN window_function ENUM('none', 'avg', 'min', 'max', 'count') NOT NULL DEFAULT 'none'
+            AFTER monitored_host_condition_eval,
+          ADD COLUMN window_eval VARCHAR(4095) CHARSET utf8 COLLATE utf8_bin NOT NULL DEFAULT ''
+            AFTER window_function,
+          ADD COLUMN window_minutes SMALLINT UNSIGNED NOT NULL DEFAULT 0
+            AFTER window_eval
+        """ % database_name
 
     try:
         act_query(query)
         act_query_ignore_error(alter_query_0)
         act_query_ignore_error(alter_query_1)
+        act_query_ignore_error(alter_query_2)
         verbose("alert_condition table created")
     except MySQLdb.Error:
         if options.debug:
@@ -1450,6 +2149,74 @@ def create_alert_table():
         exit_with_error("Cannot create table %s.alert" % database_name)
 
 
+def create_alert_condition_window_value_table():
+    """
+    Per windowed alert condition, the values of window_eval within the last window_minutes.
+    This is the incrementally maintained window state: each check adds one row per condition and
+    expires rows which fall out of the window. The latest value is always in the window; thus a window_minutes
+    of 0 only holds the latest value.
+    """
+    query = """
+        CREATE TABLE IF NOT EXISTS %s.alert_condition_window_value (
+          alert_condition_id INT(11) UNSIGNED NOT NULL,
+          sv_report_sample_id INT(11) NOT NULL,
+          ts DATETIME NOT NULL,
+          value DOUBLE DEFAULT NULL,
+          PRIMARY KEY (alert_condition_id, sv_report_sample_id),
+          KEY (ts)
+        )
+        """ % database_name
+
+    try:
+        act_query(query)
+        verbose("alert_condition_window_value table created")
+    except MySQLdb.Error:
+        if options.debug:
+            traceback.print_exc()
+        exit_with_error("Cannot create table %s.alert_condition_window_value" % database_name)
+
+
+def create_alert_email_outbox_table():
+    """
+    Alert emails are queued here by the collector, and sent by send_queued_emails() from the send_emails command
+    or the daemon's sender thread, so that the collector does not wait on the SMTP server.
+    """
+    query = """
+        CREATE TABLE IF NOT EXISTS %s.alert_email_outbox (
+          alert_email_outbox_id INT(11) UNSIGNED NOT NULL AUTO_INCREMENT,
+          ts_queued DATETIME NOT NULL,
+          subject VARCHAR(255) CHARSET utf8 COLLATE utf8_bin NOT NULL,
+          message MEDIUMTEXT CHARSET utf8 COLLATE utf8_bin NOT NULL,
+          num_attempts SMALLINT UNSIGNED NOT NULL DEFAULT 0,
+          ts_next_attempt DATETIME NOT NULL,
+          ts_sent DATETIME DEFAULT NULL,
+          last_error VARCHAR(1023) CHARSET utf8 COLLATE utf8_bin DEFAULT NULL,
+          claimed_by BIGINT UNSIGNED DEFAULT NULL,
+          ts_claimed DATETIME DEFAULT NULL,
+          PRIMARY KEY (alert_email_outbox_id),
+          KEY (ts_sent, ts_next_attempt),
+          KEY (claimed_by)
+        )
+        """ % database_name
+
+    # Upgrade:
+    alter_query_0 = """
+        ALTER TABLE %s.alert_email_outbox 
+          ADD COLUMN claimed_by BIGINT UNSIGNED DEFAULT NULL AFTER last_error,
+          ADD COLUMN ts_claimed DATETIME DEFAULT NULL AFTER claimed_by,
+          ADD KEY (claimed_by)
+        """ % database_name
+
+    try:
+        act_query(query)
+        act_query_ignore_error(alter_query_0)
+        verbose("alert_email_outbox table created")
+    except MySQLdb.Error:
+        if options.debug:
+            traceback.print_exc()
+        exit_with_error("Cannot create table %s.alert_email_outbox" % database_name)
+
+
 def create_alert_view():
     query = """
         CREATE
@@ -1502,6 +2269,11 @@ def create_alert_pending_table():
         exit_with_error("Cannot create table %s.alert_pending" % database_name)
 
 
+# Samples are taken by cron or by the daemon, and are a few seconds late at times: five samples taken a minute
+# apart may span just short of 4 minutes. An alert's elapsed minutes are rounded up within this slack.
+alert_elapsed_slack_seconds = 3
+
+
 def create_alert_pending_view():
     query = """
         CREATE
@@ -1520,8 +2292,8 @@ def create_alert_pending_view():
             alert_condition.alert_delay_minutes AS alert_delay_minutes,
             sv_report_sample_start.ts AS ts_start,
             sv_report_sample_end.ts AS ts_end,
-            (TIMESTAMPDIFF(SECOND, sv_report_sample_start.ts, sv_report_sample_end.ts)+3) DIV 60 AS elapsed_minutes, 
-            (TIMESTAMPDIFF(SECOND, sv_report_sample_start.ts, sv_report_sample_end.ts)+3) DIV 60 >= alert_delay_minutes AS in_error,
+            (TIMESTAMPDIFF(SECOND, sv_report_sample_start.ts, sv_report_sample_end.ts)+${alert_elapsed_slack_seconds}) DIV 60 AS elapsed_minutes, 
+            (TIMESTAMPDIFF(SECOND, sv_report_sample_start.ts, sv_report_sample_end.ts)+${alert_elapsed_slack_seconds}) DIV 60 >= alert_delay_minutes AS in_error,
             alert_pending.ts_notified IS NOT NULL AS is_notified,
             alert_pending.ts_notified AS ts_notified,
             alert_pending.resolved AS resolved,
@@ -1539,6 +2311,7 @@ def create_alert_pending_view():
             alert_condition_id ASC
     """
     query = query.replace("${database_name}", database_name)
+    query = query.replace("${alert_elapsed_slack_seconds}", "%d" % alert_elapsed_slack_seconds)
     act_query(query)
 
     verbose("alert_pending_view created")
@@ -1747,13 +2520,34 @@ def create_alert_condition_query_view():
         exit_with_error("Cannot create view %s.alert_condition_query_view" % database_name)
 
 
-def generate_alert_condition_query():
+def get_alert_condition_text(condition_eval):
+    """
+    Condition text, as read from alert_condition, for composing queries. Strings (str or unicode) are kept
+    as they are: str() fails on non-ASCII unicode.
+    """
+    if isinstance(condition_eval, basestring):
+        return condition_eval
+    return u"%s" % condition_eval
 
-    query = """
+
+def generate_alert_condition_query():
+    """
+    Return the enabled alert conditions' ids, along with the query evaluating them on the latest sample, the 
+    query evaluating their monitored host conditions (None when there are no such conditions), and the
+    windowed conditions.
+    Conditions are evaluated against a single row derived table, which only computes the report columns 
+    referenced by the conditions, rather than against the full sv_report_sample view.
+    For windowed conditions, the query evaluates window_eval rather than condition_eval. The condition itself
+    is later evaluated against the window aggregation; see evaluate_alert_condition_windows().
+    """
+    query = """
             SELECT 
               alert_condition_id, 
               IF(monitored_host_condition_eval = '', true, monitored_host_condition_eval) AS monitored_host_condition_eval, 
-              IF(condition_eval = '', true, condition_eval) AS condition_eval 
+              IF(condition_eval = '', true, condition_eval) AS condition_eval,
+              window_function,
+              IF(window_eval = '', NULL, window_eval) AS window_eval,
+              window_minutes
             FROM 
               ${database_name}.alert_condition
             WHERE
@@ -1762,53 +2556,172 @@ def generate_alert_condition_query():
     query = query.replace("${database_name}", database_name)
     rows = get_rows(query, write_conn)
     if not rows:
-        return (None, None, None)
+        return (None, None, None, None)
     
     alert_condition_ids = [int(row["alert_condition_id"]) for row in rows]
+    window_conditions = [row for row in rows if row["window_function"] != "none"]
+
+    sample_evals = [row["condition_eval"] for row in rows if row["window_function"] == "none"]
+    sample_evals.extend([row["window_eval"] or "" for row in window_conditions])
+    referenced_names = set(re.findall("[a-z_][a-z0-9_]*", " ".join([get_alert_condition_text(sample_eval).lower() for sample_eval in sample_evals])))
+    report_columns_listing = ",\n".join([column_expression for (column_name, column_expression) in get_report_columns_expressions() if column_name in referenced_names])
+    if report_columns_listing:
+        report_columns_listing = ",\n%s" % report_columns_listing
+    if status_variables_insert_id is None:
+        sample_id_expression = "(SELECT MAX(id) FROM ${database_name}.%s)" % table_name
+    else:
+        sample_id_expression = "%d" % status_variables_insert_id
 
-    query_conditions = ["%s AS condition_%d" % (row["condition_eval"], int(row["alert_condition_id"])) for row in rows]
+    query_conditions = ["%s AS condition_%d" % (row["condition_eval"], int(row["alert_condition_id"])) for row in rows if row["window_function"] == "none"]
+    query_conditions.extend(["%s AS window_value_%d" % (row["window_eval"] or "NULL", int(row["alert_condition_id"])) for row in window_conditions])
     query = """
         SELECT
           id, 
+          ts,
           %s 
         FROM
-          ${database_name}.sv_report_sample
-        ORDER BY 
-          id DESC
-        LIMIT 1
-      """ % (",".join(query_conditions))
+          (
+            SELECT
+              id,
+              ts,
+              ts_diff_seconds%s
+            FROM
+              ${database_name}.sv_sample
+            WHERE
+              id = ${sample_id_expression}
+          ) AS sv_report_sample
+      """ % (",".join(query_conditions), report_columns_listing)
+    query = query.replace("${sample_id_expression}", sample_id_expression)
+    query = query.replace("${database_name}", database_name)
+
+    monitored_host_query = None
+    # Conditions with no monitored host condition read "1" (as a string: the column's type is that of the condition text)
+    if [row for row in rows if get_alert_condition_text(row["monitored_host_condition_eval"]).strip() != "1"]:
+        monitored_host_query_conditions = ["%s AS condition_%d" % (row["monitored_host_condition_eval"], int(row["alert_condition_id"])) for row in rows]
+        monitored_host_query = """
+            SELECT
+              %s 
+          """ % (",".join(monitored_host_query_conditions))
+    
+    return alert_condition_ids, query, monitored_host_query, window_conditions
+
+
+def write_alert_condition_window_values(window_conditions, row):
+    """
+    Add the latest sample's window_eval values to the conditions' windows, and expire values which are
+    out of their window (or which belong to conditions no longer windowed). The latest sample's values are
+    never expired, even with a window_minutes of 0.
+    """
+    if not window_conditions:
+        return
+
+    window_values = []
+    for window_condition in window_conditions:
+        alert_condition_id = int(window_condition["alert_condition_id"])
+        value = row["window_value_%d" % alert_condition_id]
+        if value is None:
+            value = "NULL"
+        window_values.append("(%d, %d, '%s', %s)" % (alert_condition_id, int(row["id"]), row["ts"], value))
+    query = """
+        INSERT INTO 
+          ${database_name}.alert_condition_window_value (alert_condition_id, sv_report_sample_id, ts, value) 
+        VALUES 
+          %s
+        ON DUPLICATE KEY UPDATE
+          value = VALUES(value)
+        """ % ",".join(window_values)
+    query = query.replace("${database_name}", database_name)
+    act_query(query)
+
+    query = """
+        DELETE 
+          alert_condition_window_value
+        FROM 
+          ${database_name}.alert_condition_window_value
+          LEFT JOIN ${database_name}.alert_condition USING (alert_condition_id)
+        WHERE
+          alert_condition.alert_condition_id IS NULL
+          OR alert_condition.window_function = 'none'
+          OR (
+            alert_condition_window_value.ts <= '%s' - INTERVAL alert_condition.window_minutes MINUTE
+            AND alert_condition_window_value.sv_report_sample_id != %d
+          )
+        """ % (row["ts"], int(row["id"]))
     query = query.replace("${database_name}", database_name)
+    num_affected_rows = act_query(query)
+    verbose("Expired %d alert condition window values" % num_affected_rows)
+
 
-    monitored_host_query_conditions = ["%s AS condition_%d" % (row["monitored_host_condition_eval"], int(row["alert_condition_id"])) for row in rows]
-    monitored_host_query = """
+def evaluate_alert_condition_windows(window_conditions):
+    """
+    Evaluate windowed conditions, where condition_eval refers to the window aggregation as "window_value".
+    Each window is read by primary key, and only holds the values within the last window_minutes.
+    """
+    window_aggregation_expressions = {
+        "avg": "AVG(value)",
+        "min": "MIN(value)",
+        "max": "MAX(value)",
+        "count": "SUM(value != 0)",
+        }
+    query_conditions = []
+    query_windows = []
+    for window_condition in window_conditions:
+        alert_condition_id = int(window_condition["alert_condition_id"])
+        window_value_name = "window_value_%d" % alert_condition_id
+        condition_eval = re.sub("\\bwindow_value\\b", window_value_name, get_alert_condition_text(window_condition["condition_eval"]))
+        query_conditions.append("%s AS condition_%d" % (condition_eval, alert_condition_id))
+        query_windows.append("""
+          (
+            SELECT 
+              %s AS %s 
+            FROM 
+              ${database_name}.alert_condition_window_value 
+            WHERE 
+              alert_condition_id = %d
+          ) AS window_%d""" % (window_aggregation_expressions[window_condition["window_function"]], window_value_name, alert_condition_id, alert_condition_id))
+    query = """
         SELECT
           %s 
-      """ % (",".join(monitored_host_query_conditions))
-    
-    return alert_condition_ids, query, monitored_host_query
+        FROM
+          %s
+      """ % (",".join(query_conditions), ",".join(query_windows))
+    query = query.replace("${database_name}", database_name)
+    return get_row(query, write_conn)
 
 
-def write_alert(alert_condition_id, report_sample_id):
+def write_alerts(alert_condition_ids, report_sample_id):
+    """
+    Write an alert for each of given conditions, in a single multi-row statement
+    """
+    if not alert_condition_ids:
+        return
+
     query = """
         INSERT /*! IGNORE */ INTO 
           ${database_name}.alert (alert_condition_id, sv_report_sample_id) 
         VALUES 
-          (%d, %d)
-        """ % (alert_condition_id, report_sample_id)
+          %s
+        """ % ",".join(["(%d, %d)" % (alert_condition_id, report_sample_id) for alert_condition_id in alert_condition_ids])
     query = query.replace("${database_name}", database_name)
     act_query(query)
 
 
 
-def write_alert_pending(alert_condition_id, report_sample_id):
+def write_alerts_pending(alert_condition_ids, report_sample_id):
+    """
+    Open or extend the pending alert of each of given conditions, in a single multi-row statement
+    """
+    if not alert_condition_ids:
+        return
+
     query = """
         INSERT INTO 
           ${database_name}.alert_pending (alert_condition_id, sv_report_sample_id_start, sv_report_sample_id_end) 
         VALUES 
-          (%d, %d, %d)
+          %s
         ON DUPLICATE KEY UPDATE
-          sv_report_sample_id_end = %d
-        """ % (alert_condition_id, report_sample_id, report_sample_id, report_sample_id)
+          sv_report_sample_id_end = VALUES(sv_report_sample_id_end)
+        """ % ",".join(["(%d, %d, %d)" % (alert_condition_id, report_sample_id, report_sample_id) for alert_condition_id in alert_condition_ids])
     query = query.replace("${database_name}", database_name)
     act_query(query)
     
@@ -1825,6 +2738,7 @@ def mark_resolved_alerts(report_sample_id):
     query = query.replace("${database_name}", database_name)
     num_affected_rows = act_query(query)
     verbose("Marked %d pending alerts as resolved" % num_affected_rows)
+    return num_affected_rows
     
     
 def remove_resolved_alerts():
@@ -1840,6 +2754,9 @@ def remove_resolved_alerts():
 
 
 def mark_notified_pending_alerts(notified_pending_alert_ids):    
+    """
+    Mark notified pending alerts. Resolved alerts are skipped, as they are about to be removed.
+    """
     if not notified_pending_alert_ids:
         return
 
@@ -1850,6 +2767,7 @@ def mark_notified_pending_alerts(notified_pending_alert_ids):
           ts_notified = NOW()
         WHERE 
           alert_pending_id IN (%s)
+          AND resolved = 0
         """ % ",".join(["%d" % notified_pending_alert_id for notified_pending_alert_id in notified_pending_alert_ids])
     query = query.replace("${database_name}", database_name)
     act_query(query)
@@ -1860,40 +2778,260 @@ def check_alerts():
         verbose("Skipping alerts")
         return
 
-    alert_condition_ids, query, monitored_host_query = generate_alert_condition_query()
+    alert_condition_ids, query, monitored_host_query, window_conditions = generate_alert_condition_query()
     if not alert_condition_ids:
         verbose("No alert conditions defined")
         return
     
     row = get_row(query, write_conn)
-    monitored_host_row = get_row(monitored_host_query, monitored_conn)
+    if not row:
+        verbose("No sample to check alerts on")
+        return
+    monitored_host_row = None
+    if monitored_host_query:
+        monitored_host_row = get_row(monitored_host_query, monitored_conn)
     report_sample_id = int(row["id"])
-    num_alerts = 0
+    if window_conditions:
+        write_alert_condition_window_values(window_conditions, row)
+        row.update(evaluate_alert_condition_windows(window_conditions))
     
+    # Collect all firing conditions first, then write them in bulk
+    firing_alert_condition_ids = []
     for alert_condition_id in alert_condition_ids:
         condition_result = row["condition_%d" % alert_condition_id]
-        monitored_host_condition_result = monitored_host_row["condition_%d" % alert_condition_id]
+        monitored_host_condition_result = 1
+        if monitored_host_row:
+            monitored_host_condition_result = monitored_host_row["condition_%d" % alert_condition_id]
         if condition_result is None:
             condition_result = 0
         if monitored_host_condition_result is None:
             monitored_host_condition_result = 0
         if int(condition_result) != 0 and int(monitored_host_condition_result) != 0: 
-            write_alert(alert_condition_id, report_sample_id)
-            write_alert_pending(alert_condition_id, report_sample_id)
-            num_alerts += 1
-    verbose("Found %s alerts" % num_alerts)
-    mark_resolved_alerts(report_sample_id)
+            firing_alert_condition_ids.append(alert_condition_id)
+    verbose("Found %s alerts" % len(firing_alert_condition_ids))
+    write_alerts(firing_alert_condition_ids, report_sample_id)
+    write_alerts_pending(firing_alert_condition_ids, report_sample_id)
+    num_resolved_alerts = mark_resolved_alerts(report_sample_id)
     
-    notified_pending_alert_ids = send_alert_email()
+    notified_pending_alert_ids = queue_alert_email()
     if notified_pending_alert_ids:
         # Alerts which have been notified must be marked as such
         mark_notified_pending_alerts(notified_pending_alert_ids)
-    remove_resolved_alerts()
+    if num_resolved_alerts:
+        remove_resolved_alerts()
+
+
+def get_backtest_alert_conditions():
+    """
+    Return the alert conditions to backtest: those listed by --backtest-conditions, or else all conditions,
+    including disabled ones.
+    """
+    query = """
+            SELECT 
+              alert_condition_id, 
+              enabled,
+              IF(condition_eval = '', true, condition_eval) AS condition_eval,
+              TRIM(description) AS description,
+              alert_delay_minutes,
+              window_function,
+              IF(window_eval = '', NULL, window_eval) AS window_eval,
+              window_minutes
+            FROM 
+              ${database_name}.alert_condition
+            %s
+            ORDER BY
+              alert_condition_id
+        """
+    if options.backtest_conditions:
+        alert_condition_ids = [int(token) for token in options.backtest_conditions.split(",") if token.strip()]
+        query = query % ("WHERE alert_condition_id IN (%s)" % ",".join(["%d" % alert_condition_id for alert_condition_id in alert_condition_ids]))
+    else:
+        query = query % ""
+    query = query.replace("${database_name}", database_name)
+    return get_rows(query, write_conn)
+
+
+def get_backtest_query(alert_conditions):
+    """
+    A single query evaluating all given (non windowed) conditions, or the window_eval of windowed conditions,
+    on each row within the backtest range. Only the report columns referenced by the conditions are computed.
+    """
+    sample_evals = [alert_condition["condition_eval"] for alert_condition in alert_conditions if alert_condition["window_function"] == "none"]
+    sample_evals.extend([alert_condition["window_eval"] or "" for alert_condition in alert_conditions if alert_condition["window_function"] != "none"])
+    referenced_names = set(re.findall("[a-z_][a-z0-9_]*", " ".join([get_alert_condition_text(sample_eval).lower() for sample_eval in sample_evals])))
+    report_columns_listing = ",\n".join([column_expression for (column_name, column_expression) in get_report_columns_expressions() if column_name in referenced_names])
+    if report_columns_listing:
+        report_columns_listing = ",\n%s" % report_columns_listing
+
+    query_evals = []
+    for alert_condition in alert_conditions:
+        if alert_condition["window_function"] == "none":
+            query_evals.append(alert_condition["condition_eval"])
+        else:
+            query_evals.append(alert_condition["window_eval"] or "NULL")
+    query = """
+        SELECT
+          UNIX_TIMESTAMP(ts) AS ts, 
+          %s 
+        FROM
+          (
+            SELECT
+              id,
+              ts,
+              ts_diff_seconds%s
+            FROM
+              ${database_name}.sv_${view_name_extension}
+            WHERE
+              ts >= NOW() - INTERVAL %d DAY
+          ) AS sv_report_sample
+        ORDER BY
+          id
+      """ % (",".join(query_evals), report_columns_listing, options.backtest_days)
+    query = query.replace("${view_name_extension}", options.backtest_resolution)
+    query = query.replace("${database_name}", database_name)
+    return query
+
+
+def get_backtest_window_values(alert_condition, timestamps, values):
+    """
+    Given the window_eval values of a windowed condition, return the window aggregation value per row.
+    The window slides along with the rows; avg and count are maintained incrementally. As with
+    write_alert_condition_window_values(), the current row is always within the window.
+    """
+    window_seconds = 60*int(alert_condition["window_minutes"])
+    window_function = alert_condition["window_function"]
+    window_values = []
+    window_start = 0
+    window_sum = 0.0
+    window_count = 0
+    window_nonzero_count = 0
+    for (i, value) in enumerate(values):
+        if value is not None:
+            window_sum += value
+            window_count += 1
+            window_nonzero_count += int(value != 0)
+        while window_start < i and timestamps[window_start] <= timestamps[i] - window_seconds:
+            expired_value = values[window_start]
+            if expired_value is not None:
+                window_sum -= expired_value
+                window_count -= 1
+                window_nonzero_count -= int(expired_value != 0)
+            window_start += 1
+        if window_function == "count":
+            window_values.append(window_nonzero_count)
+        elif not window_count:
+            window_values.append(None)
+        elif window_function == "avg":
+            window_values.append(window_sum/window_count)
+        else:
+            in_window_values = [in_window_value for in_window_value in values[window_start:i+1] if in_window_value is not None]
+            if window_function == "min":
+                window_values.append(min(in_window_values))
+            else:
+                window_values.append(max(in_window_values))
+    return window_values
+
+
+def evaluate_backtest_window_condition(alert_condition, window_values):
+    """
+    Evaluate condition_eval (which refers to "window_value") on the distinct window values, in chunks.
+    Return an array of per row results.
+    """
+    distinct_window_values = list(set(window_values))
+    results = {}
+    chunk_size = 1000
+    for chunk_start in range(0, len(distinct_window_values), chunk_size):
+        chunk = distinct_window_values[chunk_start:chunk_start+chunk_size]
+        window_values_listing = " UNION ALL ".join([
+            "SELECT %d AS window_value_index, %s AS window_value" % (i, sql_number_literal(window_value)) 
+            for (i, window_value) in enumerate(chunk)])
+        query = """
+            SELECT
+              window_value_index,
+              %s AS condition_result
+            FROM
+              (%s) AS sv_report_sample
+          """ % (alert_condition["condition_eval"], window_values_listing)
+        for row in get_rows(query, write_conn):
+            results[chunk[int(row["window_value_index"])]] = row["condition_result"]
+    return array.array("b", [int(bool(results[window_value])) for window_value in window_values])
 
 
-def send_alert_email():
+def get_backtest_episodes(alert_condition, timestamps, fires):
+    """
+    Return (start, end, elapsed minutes, notified) for each consecutive run of firing rows.
+    A run is notified when it lasts alert_delay_minutes, as with alert_pending_view (including its
+    alert_elapsed_slack_seconds tolerance for sampling jitter).
+    """
+    alert_delay_minutes = int(alert_condition["alert_delay_minutes"])
+    episodes = []
+    episode_start = None
+    for i in range(len(fires) + 1):
+        fired = (i < len(fires)) and fires[i]
+        if fired and episode_start is None:
+            episode_start = i
+        elif not fired and episode_start is not None:
+            ts_start = timestamps[episode_start]
+            ts_end = timestamps[i - 1]
+            elapsed_minutes = int(ts_end - ts_start + alert_elapsed_slack_seconds) // 60
+            episodes.append((ts_start, ts_end, elapsed_minutes, elapsed_minutes >= alert_delay_minutes))
+            episode_start = None
+    return episodes
+
+
+def backtest_alert_conditions():
+    """
+    Report how often alert conditions would have fired over the last --backtest-days days.
+    All conditions are evaluated by a single pass over history; the results are kept in arrays, from which
+    windows, fire counts and episodes are computed in-process.
+    Monitored host conditions refer to the current state of the monitored host, and are not backtested.
+    """
+    alert_conditions = get_backtest_alert_conditions()
+    if not alert_conditions:
+        print "-- No alert conditions to backtest"
+        return
+
+    timestamps = array.array("d")
+    evals = [[] for alert_condition in alert_conditions]
+    cursor = write_conn.cursor()
+    cursor.execute(get_backtest_query(alert_conditions))
+    while True:
+        rows = cursor.fetchmany(10000)
+        if not rows:
+            break
+        for row in rows:
+            timestamps.append(float(row[0]))
+            for (i, value) in enumerate(row[1:]):
+                if value is not None:
+                    value = float(value)
+                evals[i].append(value)
+    cursor.close()
+    verbose("Loaded %d %s rows" % (len(timestamps), options.backtest_resolution))
+
+    print "-- Backtest over the last %d days, %s resolution: %d rows" % (options.backtest_days, options.backtest_resolution, len(timestamps))
+    for (alert_condition, values) in zip(alert_conditions, evals):
+        if alert_condition["window_function"] == "none":
+            fires = array.array("b", [int(bool(value)) for value in values])
+        else:
+            window_values = get_backtest_window_values(alert_condition, timestamps, values)
+            fires = evaluate_backtest_window_condition(alert_condition, window_values)
+        episodes = get_backtest_episodes(alert_condition, timestamps, fires)
+        notified_episodes = [episode for episode in episodes if episode[3]]
+
+        print "--"
+        print "-- alert_condition id: %d%s: %s" % (int(alert_condition["alert_condition_id"]), {True: "", False: " (disabled)"}[bool(alert_condition["enabled"])], alert_condition["description"] or alert_condition["condition_eval"])
+        if alert_condition["window_function"] != "none":
+            print "--   window: %s(%s) over %d minutes" % (alert_condition["window_function"], alert_condition["window_eval"], int(alert_condition["window_minutes"]))
+        print "--   firing rows: %d" % sum(fires)
+        print "--   episodes: %d, longest: %d minutes" % (len(episodes), max([0] + [episode[2] for episode in episodes]))
+        print "--   notified episodes (alert delay: %d minutes): %d" % (int(alert_condition["alert_delay_minutes"]), len(notified_episodes))
+        for (ts_start, ts_end, elapsed_minutes, notified) in notified_episodes[-10:]:
+            print "--     %s - %s: %d minutes" % (datetime.datetime.fromtimestamp(ts_start), datetime.datetime.fromtimestamp(ts_end), elapsed_minutes)
+
+
+def queue_alert_email():
     """
-    Send an email including all never-sent pending alerts.
+    Queue an email including all never-sent pending alerts. The email is sent by send_queued_emails().
     Returns the ids of pending alerts
     """    
     query = """
@@ -1924,7 +3062,7 @@ This is an alert mail sent by mycheckpoint, monitoring your %s MySQL database.
 All seems to be well.
                 """ % (database_name, database_name,)
         email_subject = "%s: mycheckpoint OK notification" % database_name
-        send_email_message("alert notifications", email_subject, email_message)
+        queue_email_message(email_subject, email_message)
         return None
         
 
@@ -1966,10 +3104,23 @@ The following problems have been found:
 %s
         """ % (database_name, get_current_timestamp(), database_name, "\n\n".join(email_rows), processlist_clause)
     email_subject = "%s: mycheckpoint alert notification" % database_name
-    if send_email_message("alert notifications", email_subject, email_message):
-        return alert_pending_ids
-    else:
-        return None
+    queue_email_message(email_subject, email_message)
+    return alert_pending_ids
+
+
+def queue_email_message(subject, message):
+    """
+    Write the message to the alert_email_outbox table. It is committed along with the alerts it reports.
+    """
+    query = """
+        INSERT INTO 
+          ${database_name}.alert_email_outbox (ts_queued, subject, message, ts_next_attempt) 
+        VALUES 
+          (NOW(), %s, %s, NOW())
+        """ % (sql_string_literal(subject), sql_string_literal(message))
+    query = query.replace("${database_name}", database_name)
+    act_query(query)
+    verbose("Queued alert notifications message: %s" % subject)
 
 
 def get_monitored_host_mysql_version():
@@ -1985,6 +3136,7 @@ def is_same_deploy():
               AND build = %d 
               AND mysql_version = '%s'
               AND database_name = '%s'
+              AND deploy_options = '%s'
               AND custom_queries = 
                 (
                   SELECT 
@@ -1998,7 +3150,7 @@ def is_same_deploy():
                     ${database_name}.custom_query
                 )
               AND last_deploy_successful = 1
-              """ % (revision_number, build_number, get_monitored_host_mysql_version(), database_name)
+              """ % (revision_number, build_number, get_monitored_host_mysql_version(), database_name, get_deploy_options())
         query = query.replace("${database_name}", database_name)
         same_deploy = get_row(query, write_conn)["same_deploy"]
         return (same_deploy > 0)
@@ -2102,6 +3254,100 @@ def upgrade_status_variables_day_aggregation_table():
     return upgrade_status_variables_aggregation_table("status_variables_aggregated_day")
 
 
+def create_status_variables_diff_table():
+    """
+    The status_variables_diff table materializes per-sample diffs, which are otherwise computed by sv_diff's self join.
+    _psec values are not stored (see InnoDB's 1000 columns limitation); they are cheaply computed from the _diff columns.
+    """
+    if not options.materialize_diff:
+        return
+
+    _global_variables, status_columns = get_variables_and_status_columns()
+    diff_columns_listing = ",\n".join(["%s_diff BIGINT" % (column_name,) for column_name in status_columns])
+
+    query = """CREATE TABLE %s.status_variables_diff (
+            id INT PRIMARY KEY,
+            ts TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            ts_diff_seconds INT,
+            %s
+       )
+        """ % (database_name, diff_columns_listing,)
+
+    table_created = False
+    try:
+        act_query(query)
+        table_created = True
+    except MySQLdb.Error:
+        if options.debug:
+            traceback.print_exc()
+        pass
+
+    if table_created:
+        verbose("status_variables_diff table created")
+    else:
+        verbose("status_variables_diff table exists")
+    return table_created
+
+
+def upgrade_status_variables_diff_table():
+    _global_variables, status_columns = get_variables_and_status_columns()
+
+    query = """
+            SHOW COLUMNS FROM %s.status_variables_diff
+        """ % (database_name,)
+    existing_columns = [row["Field"] for row in get_rows(query, write_conn)]
+
+    new_columns = ["%s_diff" % column_name for column_name in status_columns if "%s_diff" % column_name not in existing_columns]
+    if new_columns:
+        verbose("Will add the following columns to status_variables_diff: %s" % ", ".join(new_columns))
+        query = """ALTER TABLE %s.status_variables_diff
+                %s
+        """ % (database_name, ",\n".join(["ADD COLUMN %s BIGINT" % column_name for column_name in new_columns]))
+        act_query(query)
+        verbose("status_variables_diff table upgraded")
+    return len(new_columns)
+
+
+def detect_status_variables_diff_missing_values():
+    """
+    Compute diffs for samples not yet having a status_variables_diff row. This happens
+    upon first deploy with --materialize-diff, or following collection without it.
+    """
+    if not options.materialize_diff:
+        return
+
+    _global_variables, status_columns = get_variables_and_status_columns()
+    diff_signed_columns_listing, diff_unsigned_columns_listing = get_status_variables_diff_columns_listings(status_columns)
+    diff_columns_names = ",\n".join(
+        ["%s_diff" % column_name for column_name in status_columns if is_signed_column(column_name)] +
+        ["%s_diff" % column_name for column_name in status_columns if not is_signed_column(column_name)])
+
+    query = """
+        INSERT /*! IGNORE */ INTO ${database_name}.status_variables_diff
+          (id, ts, ts_diff_seconds, %s)
+          SELECT
+            ${status_variables_table_alias}2.id,
+            ${status_variables_table_alias}2.ts,
+            TIMESTAMPDIFF(SECOND, ${status_variables_table_alias}1.ts, ${status_variables_table_alias}2.ts) AS ts_diff_seconds,
+            %s,
+            %s
+          FROM
+            ${database_name}.${status_variables_table_name} AS ${status_variables_table_alias}2
+            INNER JOIN ${database_name}.${status_variables_table_name} AS ${status_variables_table_alias}1
+            ON (${status_variables_table_alias}1.id = ${status_variables_table_alias}2.id-GREATEST(1, IFNULL(${status_variables_table_alias}2.auto_increment_increment, 1)))
+            LEFT JOIN ${database_name}.status_variables_diff ON (status_variables_diff.id = ${status_variables_table_alias}2.id)
+          WHERE
+            status_variables_diff.id IS NULL
+    """ % (diff_columns_names, diff_signed_columns_listing, diff_unsigned_columns_listing)
+    query = query.replace("${database_name}", database_name)
+    query = query.replace("${status_variables_table_name}", table_name)
+    query = query.replace("${status_variables_table_alias}", table_name)
+
+    num_affected_rows = act_query(query)
+    if num_affected_rows:
+        verbose("%d missing entries computed into status_variables_diff" % num_affected_rows)
+
+
 def create_status_variables_latest_view():
     query = """
         CREATE
@@ -2123,17 +3369,57 @@ def create_status_variables_latest_view():
     verbose("sv_latest view created")
 
 
+def get_status_variables_diff_columns_listings(status_columns):
+    """
+    Return the signed & unsigned diff expressions of given status columns, comparing
+    ${status_variables_table_alias}2 (a sample) to ${status_variables_table_alias}1 (the sample preceding it)
+    """
+    # Status variables are diffed. This does not make sense for all of them, but we do it for all nonetheless.
+    diff_signed_columns_listing = ",\n".join([" ${status_variables_table_alias}2.%s - ${status_variables_table_alias}1.%s AS %s_diff" % (column_name, column_name, column_name, ) for column_name in status_columns if is_signed_column(column_name)])
+    # When either sv1's or sv2's variable is NULL, the IF condition fails and we do the "-" math, leading again to NULL. 
+    # I *want* the diff to be NULL. This makes more sense than choosing sv2's value.
+    diff_unsigned_columns_listing = ",\n".join([" IF(${status_variables_table_alias}2.%s < ${status_variables_table_alias}1.%s, ${status_variables_table_alias}2.%s, ${status_variables_table_alias}2.%s - ${status_variables_table_alias}1.%s) AS %s_diff" % (column_name, column_name, column_name, column_name, column_name, column_name, ) for column_name in status_columns if not is_signed_column(column_name)])
+    return diff_signed_columns_listing, diff_unsigned_columns_listing
+
+
 def create_status_variables_diff_view():
     global_variables, status_columns = get_variables_and_status_columns()
+
+    if options.materialize_diff:
+        # Rely on status_variables_diff table; this is a simple join on primary key
+        global_variables_columns_listing = ",\n".join([" ${status_variables_table_name}.%s AS %s" % (column_name, column_name,) for column_name in global_variables])
+        status_columns_listing = ",\n".join([" ${status_variables_table_name}.%s AS %s" % (column_name, column_name,) for column_name in status_columns])
+        diff_columns_listing = ",\n".join([" status_variables_diff.%s_diff AS %s_diff" % (column_name, column_name,) for column_name in status_columns])
+        query = """
+            CREATE
+            OR REPLACE
+            ALGORITHM = MERGE
+            DEFINER = CURRENT_USER
+            SQL SECURITY INVOKER
+            VIEW ${database_name}.sv_diff AS
+              SELECT
+                ${status_variables_table_name}.id,
+                ${status_variables_table_name}.ts,
+                status_variables_diff.ts_diff_seconds,
+                %s,
+                %s,
+                %s
+              FROM
+                ${database_name}.${status_variables_table_name}
+                INNER JOIN ${database_name}.status_variables_diff ON (status_variables_diff.id = ${status_variables_table_name}.id)
+        """ % (status_columns_listing, diff_columns_listing, global_variables_columns_listing)
+        query = query.replace("${database_name}", database_name)
+        query = query.replace("${status_variables_table_name}", table_name)
+        act_query(query)
+
+        verbose("sv_diff view created")
+        return
+
     # Global variables are used as-is
     global_variables_columns_listing = ",\n".join([" ${status_variables_table_alias}2.%s AS %s" % (column_name, column_name,) for column_name in global_variables])
     # status variables as they were:
     status_columns_listing = ",\n".join([" ${status_variables_table_alias}2.%s AS %s" % (column_name, column_name,) for column_name in status_columns])
-    # Status variables are diffed. This does not make sense for all of them, but we do it for all nonetheless.
-    diff_signed_columns_listing = ",\n".join([" ${status_variables_table_alias}2.%s - ${status_variables_table_alias}1.%s AS %s_diff" % (column_name, column_name, column_name, ) for column_name in status_columns if is_signed_column(column_name)])
-    # When either sv1's or sv2's variable is NULL, the IF condition fails and we do the "-" math, leading again to NULL. 
-    # I *want* the diff to be NULL. This makes more sense than choosing sv2's value.
-    diff_unsigned_columns_listing = ",\n".join([" IF(${status_variables_table_alias}2.%s < ${status_variables_table_alias}1.%s, ${status_variables_table_alias}2.%s, ${status_variables_table_alias}2.%s - ${status_variables_table_alias}1.%s) AS %s_diff" % (column_name, column_name, column_name, column_name, column_name, column_name, ) for column_name in status_columns if not is_signed_column(column_name)])
+    diff_signed_columns_listing, diff_unsigned_columns_listing = get_status_variables_diff_columns_listings(status_columns)
 
     query = """
         CREATE
@@ -2171,6 +3457,19 @@ def create_status_variables_sample_view():
     diff_columns_listing = ",\n".join([" %s_diff" % (column_name,) for column_name in status_columns])
     change_psec_columns_listing = ",\n".join([" ROUND(%s_diff/ts_diff_seconds, 2) AS %s_psec" % (column_name, column_name,) for column_name in status_columns])
 
+    if options.materialize_diff:
+        # Read directly from status_variables & status_variables_diff; no self join and no diff computation
+        global_variables_columns_listing = ",\n".join(["${status_variables_table_name}.%s" % (column_name,) for column_name in global_variables])
+        status_columns_listing = ",\n".join([" ${status_variables_table_name}.%s" % (column_name,) for column_name in status_columns])
+        diff_columns_listing = ",\n".join([" status_variables_diff.%s_diff" % (column_name,) for column_name in status_columns])
+        change_psec_columns_listing = ",\n".join([" ROUND(status_variables_diff.%s_diff/status_variables_diff.ts_diff_seconds, 2) AS %s_psec" % (column_name, column_name,) for column_name in status_columns])
+        sample_source = """${database_name}.${status_variables_table_name}
+            INNER JOIN ${database_name}.status_variables_diff ON (status_variables_diff.id = ${status_variables_table_name}.id)"""
+        sample_key_columns = "${status_variables_table_name}.id, ${status_variables_table_name}.ts, status_variables_diff.ts_diff_seconds"
+    else:
+        sample_source = "${database_name}.sv_diff"
+        sample_key_columns = "id, ts, ts_diff_seconds"
+
     query = """
         CREATE
         OR REPLACE
@@ -2179,17 +3478,16 @@ def create_status_variables_sample_view():
         SQL SECURITY INVOKER
         VIEW ${database_name}.sv_sample AS
           SELECT
-            id,
-            ts,
-            ts_diff_seconds,
+            %s,
             %s,
             %s,
             %s,
             %s
           FROM
-            ${database_name}.sv_diff
-        """ % (status_columns_listing, diff_columns_listing, change_psec_columns_listing, global_variables_columns_listing)
+            %s
+        """ % (sample_key_columns, status_columns_listing, diff_columns_listing, change_psec_columns_listing, global_variables_columns_listing, sample_source)
     query = query.replace("${database_name}", database_name)
+    query = query.replace("${status_variables_table_name}", table_name)
     act_query(query)
 
     verbose("sv_sample view created")
@@ -2711,16 +4009,12 @@ def create_report_recent_views():
     verbose("recent reports views created")
 
 
-def create_report_sample_recent_aggregated_view():
-    all_columns = report_columns
-    columns_listing = ",\n".join(["AVG(%s) AS %s" % (column_name, column_name,) for column_name in all_columns])
+def get_report_sample_recent_aggregated_query(column_names):
+    """
+    10 minute averages of the given report columns over the recent samples
+    """
+    columns_listing = ",\n".join(["AVG(%s) AS %s" % (column_name, column_name,) for column_name in column_names])
     query = """
-        CREATE
-        OR REPLACE
-        ALGORITHM = TEMPTABLE
-        DEFINER = CURRENT_USER
-        SQL SECURITY INVOKER
-        VIEW ${database_name}.sv_report_sample_recent_aggregated AS
           SELECT
             MAX(id) AS id,
             ts
@@ -2735,31 +4029,34 @@ def create_report_sample_recent_aggregated_view():
               - INTERVAL SECOND(ts) SECOND
               - INTERVAL (MINUTE(ts) %% 10) MINUTE
         """ % (columns_listing)
+    return query
+
+
+def create_report_sample_recent_aggregated_view():
+    query = """
+        CREATE
+        OR REPLACE
+        ALGORITHM = TEMPTABLE
+        DEFINER = CURRENT_USER
+        SQL SECURITY INVOKER
+        VIEW ${database_name}.sv_report_sample_recent_aggregated AS
+        %s
+        """ % get_report_sample_recent_aggregated_query(report_columns)
     query = query.replace("${database_name}", database_name)
     act_query(query)
 
     verbose("sv_report_sample_recent_aggregated view created")
 
 
-def create_report_minmax_views():
+def get_report_minmax_query(column_names, input_source):
     """
-    Generate min/max values view for the report views.
-    These are used by the chart labels views and the chart views.
+    Min/max values and rounding digits of the given report columns, as read from input_source
     """
-
-    all_columns = report_columns
-
-    min_columns_listing = ",\n".join(["MIN(%s) AS %s_min" % (column_name, column_name,) for column_name in all_columns])
-    max_columns_listing = ",\n".join(["MAX(%s) AS %s_max" % (column_name, column_name,) for column_name in all_columns])
-    round_digits_columns_listing = ",\n".join(["GREATEST(1, IFNULL(CEIL(-LOG(MAX(%s)-MIN(%s))), 0)) AS %s_round_digits" % (column_name, column_name, column_name,) for column_name in all_columns])
+    min_columns_listing = ",\n".join(["MIN(%s) AS %s_min" % (column_name, column_name,) for column_name in column_names])
+    max_columns_listing = ",\n".join(["MAX(%s) AS %s_max" % (column_name, column_name,) for column_name in column_names])
+    round_digits_columns_listing = ",\n".join(["GREATEST(1, IFNULL(CEIL(-LOG(MAX(%s)-MIN(%s))), 0)) AS %s_round_digits" % (column_name, column_name, column_name,) for column_name in column_names])
 
     query = """
-        CREATE
-        OR REPLACE
-        ALGORITHM = TEMPTABLE
-        DEFINER = CURRENT_USER
-        SQL SECURITY INVOKER
-        VIEW ${database_name}.sv_report_${view_name_extension}_minmax AS
           SELECT
             COUNT(*) AS count_rows,
             MIN(ts) AS ts_min,
@@ -2769,9 +4066,26 @@ def create_report_minmax_views():
             %s,
             %s
           FROM
-            ${database_name}.sv_report_${input_view_extension}
-        """ % (min_columns_listing, max_columns_listing, round_digits_columns_listing)
-    query = query.replace("${database_name}", database_name)
+            %s
+        """ % (min_columns_listing, max_columns_listing, round_digits_columns_listing, input_source)
+    return query
+
+
+def create_report_minmax_views():
+    """
+    Generate min/max values view for the report views.
+    These are used by the chart labels views and the chart views.
+    """
+    query = """
+        CREATE
+        OR REPLACE
+        ALGORITHM = TEMPTABLE
+        DEFINER = CURRENT_USER
+        SQL SECURITY INVOKER
+        VIEW ${database_name}.sv_report_${view_name_extension}_minmax AS
+        %s
+        """ % get_report_minmax_query(report_columns, "${database_name}.sv_report_${input_view_extension}")
+    query = query.replace("${database_name}", database_name)
 
     input_views_extensions = {
         "sample_recent": "sample_recent_aggregated",
@@ -2789,114 +4103,79 @@ def create_report_minmax_views():
     verbose("reports minmax views created")
 
 
-def create_report_chart_sample_timeseries_view():
-    query = """
-        CREATE
-        OR REPLACE
-        ALGORITHM = TEMPTABLE
-        DEFINER = CURRENT_USER
-        SQL SECURITY INVOKER
-        VIEW ${database_name}.sv_report_chart_sample_timeseries AS
-          SELECT
-            ts_min
-              - INTERVAL SECOND(ts_min) SECOND
-              - INTERVAL (MINUTE(ts_min) % 10) MINUTE
-              + INTERVAL (numbers.n*10) MINUTE
-              AS timeseries_ts,
-            numbers.n AS timeseries_key,
-            sv_report_sample_recent_aggregated.*
-          FROM
-            ${database_name}.numbers
-            JOIN ${database_name}.sv_report_sample_recent_minmax
-            LEFT JOIN ${database_name}.sv_report_sample_recent_aggregated ON (
-              ts_min
-                - INTERVAL SECOND(ts_min) SECOND
-                - INTERVAL (MINUTE(ts_min) % 10) MINUTE
-                + INTERVAL (numbers.n*10) MINUTE
-              = ts
-            )
-          WHERE
-            numbers.n <= TIMESTAMPDIFF(MINUTE, ts_min, ts_max)/10 + 1
-            AND ts_min
+def get_report_chart_timeseries_query(view_name_extension, rows_source, minmax_source):
+    """
+    Chart rows by timeseries key: rows_source is outer joined onto evenly spaced timestamps between
+    minmax_source's ts_min and ts_max, such that missing rows are charted as missing values.
+    Sample charts are in 10 minutes steps; hour and day charts in hour and day steps.
+    """
+    timeseries_ts_expressions = {
+        "sample": """ts_min
               - INTERVAL SECOND(ts_min) SECOND
               - INTERVAL (MINUTE(ts_min) % 10) MINUTE
-              + INTERVAL (numbers.n*10) MINUTE <= ts_max
-        """
-    query = query.replace("${database_name}", database_name)
-    act_query(query)
-
-    verbose("sv_report_chart_sample_timeseries view created")
-
-
-def create_report_chart_hour_timeseries_view():
+              + INTERVAL (numbers.n*10) MINUTE""",
+        "hour": """ts_min
+              + INTERVAL numbers.n HOUR""",
+        "day": """ts_min
+              + INTERVAL numbers.n DAY""",
+        }
+    timeseries_limits = {
+        "sample": "TIMESTAMPDIFF(MINUTE, ts_min, ts_max)/10 + 1",
+        "hour": "TIMESTAMPDIFF(HOUR, ts_min, ts_max) + 1",
+        "day": "TIMESTAMPDIFF(DAY, ts_min, ts_max) + 1",
+        }
     query = """
-        CREATE
-        OR REPLACE
-        ALGORITHM = TEMPTABLE
-        DEFINER = CURRENT_USER
-        SQL SECURITY INVOKER
-        VIEW ${database_name}.sv_report_chart_hour_timeseries AS
           SELECT
-            ts_min
-              + INTERVAL numbers.n HOUR
+            ${timeseries_ts}
               AS timeseries_ts,
             numbers.n AS timeseries_key,
-            sv_report_hour_recent.*
+            chart_rows.*
           FROM
             ${database_name}.numbers
-            JOIN ${database_name}.sv_report_hour_recent_minmax
-            LEFT JOIN ${database_name}.sv_report_hour_recent ON (
-              ts_min
-                + INTERVAL numbers.n HOUR
+            JOIN ${minmax_source} AS chart_minmax
+            LEFT JOIN ${rows_source} AS chart_rows ON (
+              ${timeseries_ts}
               = ts
             )
           WHERE
-            numbers.n <= TIMESTAMPDIFF(HOUR, ts_min, ts_max) + 1
-            AND ts_min
-              + INTERVAL numbers.n HOUR <= ts_max
+            numbers.n <= ${timeseries_limit}
+            AND ${timeseries_ts} <= ts_max
         """
-    query = query.replace("${database_name}", database_name)
-    act_query(query)
-
-    verbose("sv_report_chart_hour_timeseries view created")
+    query = query.replace("${timeseries_ts}", timeseries_ts_expressions[view_name_extension])
+    query = query.replace("${timeseries_limit}", timeseries_limits[view_name_extension])
+    query = query.replace("${minmax_source}", minmax_source)
+    query = query.replace("${rows_source}", rows_source)
+    return query
 
 
-def create_report_chart_day_timeseries_view():
-    query = """
-        CREATE
-        OR REPLACE
-        ALGORITHM = TEMPTABLE
-        DEFINER = CURRENT_USER
-        SQL SECURITY INVOKER
-        VIEW ${database_name}.sv_report_chart_day_timeseries AS
-          SELECT
-            ts_min
-              + INTERVAL numbers.n DAY
-              AS timeseries_ts,
-            numbers.n AS timeseries_key,
-            sv_report_day_recent.*
-          FROM
-            ${database_name}.numbers
-            JOIN ${database_name}.sv_report_day_recent_minmax
-            LEFT JOIN ${database_name}.sv_report_day_recent ON (
-              ts_min
-                + INTERVAL numbers.n DAY
-              = ts
-            )
-          WHERE
-            numbers.n <= TIMESTAMPDIFF(DAY, ts_min, ts_max) + 1
-            AND ts_min
-              + INTERVAL numbers.n DAY <= ts_max
-        """
-    query = query.replace("${database_name}", database_name)
-    act_query(query)
+def create_report_chart_timeseries_views():
+    rows_views_extensions = {
+        "sample": "sample_recent_aggregated",
+        "hour":   "hour_recent",
+        "day":    "day_recent",
+        }
+    for view_name_extension in ["sample", "hour", "day"]:
+        query = """
+            CREATE
+            OR REPLACE
+            ALGORITHM = TEMPTABLE
+            DEFINER = CURRENT_USER
+            SQL SECURITY INVOKER
+            VIEW ${database_name}.sv_report_chart_${view_name_extension}_timeseries AS
+            %s
+            """ % get_report_chart_timeseries_query(view_name_extension, 
+                "${database_name}.sv_report_%s" % rows_views_extensions[view_name_extension],
+                "${database_name}.sv_report_%s_recent_minmax" % view_name_extension)
+        query = query.replace("${database_name}", database_name)
+        query = query.replace("${view_name_extension}", view_name_extension)
+        act_query(query)
 
-    verbose("sv_report_chart_day_timeseries view created")
+    verbose("report chart timeseries views created")
 
 
-def create_report_chart_labels_views():
+def get_report_chart_labels_query(view_name_extension, minmax_source):
     """
-    Generate x-axis labels for the google api report views
+    x-axis labels, title and colors of the google api report charts, given ts_min and ts_max of minmax_source
     """
 
     title_ts_formats = {
@@ -2941,12 +4220,6 @@ def create_report_chart_labels_views():
         }
 
     query = """
-        CREATE
-        OR REPLACE
-        ALGORITHM = TEMPTABLE
-        DEFINER = CURRENT_USER
-        SQL SECURITY INVOKER
-        VIEW ${database_name}.sv_report_chart_${view_name_extension}_labels AS
           SELECT
             IFNULL(${x_axis_step_size}, '') AS x_axis_step_size,
             IFNULL(${x_axis_offset}, '') AS x_axis_offset,
@@ -2971,45 +4244,65 @@ def create_report_chart_labels_views():
             IF (${stale_error_condition}, '808080', '303030') AS chart_title_color,
             IF (${stale_error_condition}, 'f0f0f0', 'ffffff') AS chart_bg_color
           FROM
-            ${database_name}.sv_report_${view_name_extension}_recent_minmax, ${database_name}.numbers
+            ${minmax_source} AS chart_minmax, ${database_name}.numbers
           WHERE
             ${base_ts} + INTERVAL numbers.n ${interval_unit} >= ts_min
             AND ${base_ts} + INTERVAL numbers.n ${interval_unit} <= ts_max
             AND numbers.n <= ${labels_limit}
           GROUP BY
-            sv_report_${view_name_extension}_recent_minmax.ts_min, sv_report_${view_name_extension}_recent_minmax.ts_max 
+            chart_minmax.ts_min, chart_minmax.ts_max 
         """
-    query = query.replace("${database_name}", database_name)
 
+    title_ts_format = title_ts_formats[view_name_extension]
+    title_numeric_description, title_unit_description = title_descriptions[view_name_extension]
+    base_ts, interval_unit = labels_times[view_name_extension]
+    ts_step_seconds = ts_step_seconds_map[view_name_extension]
+    ts_format = ts_formats[view_name_extension]
+    label_function, labels_step, labels_limit = labels_step_and_limits[view_name_extension]
+    x_axis_step_size, x_axis_offset = x_axis_map[view_name_extension]
+    stale_error_condition = stale_error_conditions[view_name_extension]
+    query = query.replace("${view_name_extension}", view_name_extension)
+    query = query.replace("${base_ts}", base_ts)
+    query = query.replace("${title_ts_format}", title_ts_format)
+    query = query.replace("${title_numeric_description}", title_numeric_description)
+    query = query.replace("${title_unit_description}", title_unit_description)
+    query = query.replace("${interval_unit}", interval_unit)
+    query = query.replace("${ts_step_seconds}", "%d" % ts_step_seconds)
+    query = query.replace("${ts_format}", str(ts_format))
+    query = query.replace("${labels_step}", str(labels_step))
+    query = query.replace("${label_function}", label_function)
+    query = query.replace("${labels_limit}", str(labels_limit))
+    query = query.replace("${x_axis_step_size}", str(x_axis_step_size))
+    query = query.replace("${x_axis_offset}", str(x_axis_offset))
+    query = query.replace("${stale_error_condition}", stale_error_condition)
+    query = query.replace("${minmax_source}", minmax_source)
+    return query
+
+
+def create_report_chart_labels_views():
+    """
+    Generate x-axis labels for the google api report views
+    """
     for view_name_extension in ["sample", "hour", "day"]:
-        title_ts_format = title_ts_formats[view_name_extension]
-        title_numeric_description, title_unit_description = title_descriptions[view_name_extension]
-        base_ts, interval_unit = labels_times[view_name_extension]
-        ts_step_seconds = ts_step_seconds_map[view_name_extension]
-        ts_format = ts_formats[view_name_extension]
-        label_function, labels_step, labels_limit = labels_step_and_limits[view_name_extension]
-        x_axis_step_size, x_axis_offset = x_axis_map[view_name_extension]
-        stale_error_condition = stale_error_conditions[view_name_extension]
-        custom_query = query
-        custom_query = custom_query.replace("${view_name_extension}", view_name_extension)
-        custom_query = custom_query.replace("${base_ts}", base_ts)
-        custom_query = custom_query.replace("${title_ts_format}", title_ts_format)
-        custom_query = custom_query.replace("${title_numeric_description}", title_numeric_description)
-        custom_query = custom_query.replace("${title_unit_description}", title_unit_description)
-        custom_query = custom_query.replace("${interval_unit}", interval_unit)
-        custom_query = custom_query.replace("${ts_step_seconds}", "%d" % ts_step_seconds)
-        custom_query = custom_query.replace("${ts_format}", str(ts_format))
-        custom_query = custom_query.replace("${labels_step}", str(labels_step))
-        custom_query = custom_query.replace("${label_function}", label_function)
-        custom_query = custom_query.replace("${labels_limit}", str(labels_limit))
-        custom_query = custom_query.replace("${x_axis_step_size}", str(x_axis_step_size))
-        custom_query = custom_query.replace("${x_axis_offset}", str(x_axis_offset))
-        custom_query = custom_query.replace("${stale_error_condition}", stale_error_condition)
-        act_query(custom_query)
+        query = """
+            CREATE
+            OR REPLACE
+            ALGORITHM = TEMPTABLE
+            DEFINER = CURRENT_USER
+            SQL SECURITY INVOKER
+            VIEW ${database_name}.sv_report_chart_${view_name_extension}_labels AS
+            %s
+            """ % get_report_chart_labels_query(view_name_extension, "${database_name}.sv_report_%s_recent_minmax" % view_name_extension)
+        query = query.replace("${database_name}", database_name)
+        act_query(query)
 
     verbose("report charts labels views created")
 
 
+# Colors of a chart's series, in order
+default_chart_colors = ["ff8c00", "4682b4", "9acd32", "dc143c", "9932cc", "ffd700", "191970", "7fffd4", "808080", "dda0dd"]
+
+
 def generate_google_chart_query(chart_columns, alias, scale_from_0=False, scale_to_100=False, chart_colors = []):
     chart_columns_list = [column_name.strip() for column_name in chart_columns.lower().split(",")]
 
@@ -3038,7 +4331,7 @@ def generate_google_chart_query(chart_columns, alias, scale_from_0=False, scale_
     chart_colors = [chart_color.replace("#", "") for chart_color in chart_colors]
     chart_colors = None
     if (not chart_colors) or (len(chart_colors) < len(chart_columns_list)):
-        chart_colors = ["ff8c00", "4682b4", "9acd32", "dc143c", "9932cc", "ffd700", "191970", "7fffd4", "808080", "dda0dd"]
+        chart_colors = default_chart_colors
     chart_colors = chart_colors[0:len(chart_columns_list)]
 
     # '_' is used for missing (== NULL) values.
@@ -3133,10 +4426,397 @@ def generate_google_chart_query(chart_columns, alias, scale_from_0=False, scale_
     return query
 
 
-def create_report_google_chart_views(charts_list):
+def get_report_chart_query(view_name_extension, chart_columns, alias, scale_from_0=False, scale_to_100=False):
+    """
+    Compute a single chart of the sv_report_chart_* views. Unlike these views, which compute all charts 
+    over all report columns, only the chart's own columns are read.
+    """
+    column_names = [column_name.strip() for column_name in chart_columns.lower().split(",")]
+    if view_name_extension == "sample":
+        rows_source = "(%s)" % get_report_sample_recent_aggregated_query(column_names)
+    else:
+        rows_source = "(SELECT ts, %s FROM ${database_name}.sv_report_%s_recent)" % (", ".join(column_names), view_name_extension)
+    minmax_source = "(%s)" % get_report_minmax_query(column_names, "%s AS chart_rows" % rows_source)
+    query = """
+        SELECT
+          %s
+        FROM
+          (%s) AS sv_report_chart_${view_name_extension}_timeseries,
+          %s AS sv_report_${view_name_extension}_recent_minmax,
+          ${database_name}.charts_api,
+          (%s) AS sv_report_chart_${view_name_extension}_labels
+        """ % (generate_google_chart_query(chart_columns, alias, scale_from_0, scale_to_100),
+               get_report_chart_timeseries_query(view_name_extension, rows_source, minmax_source),
+               minmax_source,
+               get_report_chart_labels_query(view_name_extension, minmax_source))
+    query = query.replace("${view_name_extension}", view_name_extension)
+    return query
+
+
+def get_report_chart_views():
+    """
+    Report charts: (comma separated columns, chart alias, scale from 0, scale to 100, colors)
+    """
+    return [
+        ("uptime_percent", "uptime_percent", True, True, ["#ff8c00", ]),
+
+        ("innodb_read_hit_percent", "innodb_read_hit_percent", False, False, ["#9acd32", ]),
+        ("innodb_buffer_pool_reads_psec, innodb_buffer_pool_pages_flushed_psec", "innodb_io", True, False, ["#4682b4", "#9acd32", ]),
+        ("innodb_data_files_writes_psec, innodb_log_writes_psec, innodb_dblwr_writes_psec, innodb_data_reads_psec", "innodb_rw", True, False, ["#4682b4", "#9acd32", ]),
+        ("innodb_buffer_pool_used_percent, innodb_buffer_pool_pages_dirty_percent", "innodb_buffer_pool_usage", True, True, ["#dda0dd", ]),
+        ("innodb_buffer_pool_pages_total, innodb_buffer_pool_pages_data, innodb_buffer_pool_pages_dirty", "innodb_buffer_pool_pages", True, False, ["#dda0dd", ]),
+        ("innodb_estimated_log_mb_written_per_hour", "innodb_estimated_log_mb_written_per_hour", True, False, ["9932cc", ]),
+        ("innodb_row_lock_time_psec", "innodb_row_lock_time_psec", True, False, ["808080", ]),
+        ("innodb_buffer_pool_read_ahead_psec, innodb_buffer_pool_read_ahead_evicted_psec", "innodb_buffer_pool_read_ahead", True, False, ["#dda0dd", ]),
+
+        ("mega_bytes_sent_psec, mega_bytes_received_psec", "network_io", True, False, ["#7fffd4", "808080", ]),
+
+        ("key_buffer_used_percent", "myisam_key_buffer_used_percent", True, True, ["191970", ]),
+        ("key_read_requests_psec, key_reads_psec, key_write_requests_psec, key_writes_psec", "myisam_key_hit", True, False, ["#9acd32", "#ff8c00", "#ffd700", "#4682b4", ]),
+
+        ("com_select_psec, com_insert_psec, com_insert_select_psec, com_delete_psec, com_update_psec, com_replace_psec", "DML", True, False, ["#dc143c", "#ffd700", "#4682b4", "9acd32", "808080", ]),
+        ("queries_psec, questions_psec, slow_queries_psec, com_commit_psec, com_set_option_psec", "questions", True, False, ["#7fffd4", "#ff8c00", "#4682b4", "9932cc", "ffd700", ]),
+        ("innodb_rows_inserted_psec, innodb_rows_deleted_psec, innodb_rows_updated_psec", "innodb_rows", True, False, ["#dda0dd", "#7fffd4", "#4682b4", ]),
+
+        ("created_tmp_tables_psec, created_tmp_disk_tables_psec", "tmp_tables", True, False, ["#9932cc", "#ff8c00", ]),
+        ("handler_read_rnd_psec, handler_read_rnd_next_psec, handler_read_first_psec, handler_read_next_psec, handler_read_prev_psec, handler_read_key_psec", "read_patterns", True, False, ["#ff8c00", "#ffd700", "#7fffd4", "#dc143c", "9acd32", "808080" ]),
+
+        ("table_locks_waited_psec", "table_locks_waited_psec", True, False, ["dc143c", ]),
+
+        ("table_cache_size, open_tables, table_definition_cache_size, open_table_definitions", "table_cache_use", True, False, ["#9932cc", "7fffd4", ]),
+        ("opened_tables_psec, opened_table_definitions_psec", "opened_tables_psec", True, False, ["#4682b4", "dc143c", ]),
+
+        ("connections_psec, aborted_connects_psec, threads_created_psec", "connections", True, False, ["#ff8c00", "#dda0dd", ]),
+        ("max_connections, threads_connected, threads_running", "connections_usage", True, False, ["#808080", "#ffd700", "#7fffd4", ]),
+
+        ("thread_cache_size, threads_cached", "thread_cache_use", True, False, ["#808080", "#ff8c00", ]),
+        ("threads_created_psec", "threads_created_psec", True, False, ["9932cc", ]),
+
+        ("relay_log_space_limit_mb, relay_log_space_mb", "relay_log_used_mb", True, False, ["191970", ]),
+        ("seconds_behind_master", "seconds_behind_master", True, True, ["#005E5E", "#0F006C", "#538F00", ]),
+        ("seconds_behind_master_psec", "seconds_behind_master_psec", True, False, ["4682b4", ]),
+        ("estimated_slave_catchup_seconds", "estimated_slave_catchup_seconds", True, False, ["9932cc", ]),
+
+        ("os_cpu_utilization_percent", "os_cpu_utilization_percent", True, True, ["ff8c00", ]),
+        ("os_loadavg, os_total_cpu_cores", "os_loadavg", True, False, ["dc143c", "7fffd4", ]),
+        ("os_mem_total_mb, os_mem_used_mb, os_mem_active_mb, os_swap_total_mb, os_swap_used_mb", "os_memory", True, False, ["#7fffd4", "#191970", "#ffd700", "#4682b4", "#dc143c", ]),
+        ("os_page_ins_psec, os_page_outs_psec", "os_page_io", True, False, ["#9acd32", "#ff8c00", ]),
+        ("os_swap_ins_psec, os_swap_outs_psec", "os_swap_io", True, False, ["#4682b4", "#dc143c", ]),
+
+        ("os_root_mountpoint_usage_percent, os_datadir_mountpoint_usage_percent, os_tmpdir_mountpoint_usage_percent", "os_mountpoints_usage_percent", True, True, ["#ff8c00", "#ffd700", "#4682b4", ]),
+        ]
+
+
+def get_all_report_chart_views():
+    """
+    Report charts, along with a chart per custom query column
+    """
+    report_chart_views = get_report_chart_views()
+    report_chart_views.extend([
+        (custom_variable, custom_variable, True, False, []) for custom_variable in get_custom_status_variables()
+        ])
+    report_chart_views.extend([
+        (custom_variable, custom_variable, True, False, []) for custom_variable in get_custom_time_status_variables()
+        ])
+    report_chart_views.extend([
+        (custom_variable, custom_variable, True, False, []) for custom_variable in get_custom_status_variables_psec()
+        ])
+    return report_chart_views
+
+
+def get_chart_definition(chart_alias):
+    """
+    Return the (columns list, scale from 0, scale to 100) definition of a report or custom chart, or None.
+    """
+    for (chart_columns, alias, scale_from_0, scale_to_100, chart_colors) in get_report_chart_views():
+        if alias == chart_alias:
+            return ([column_name.strip() for column_name in chart_columns.lower().split(",")], scale_from_0, scale_to_100)
+    if re.match("^custom_[0-9]+(_psec|_time)?$", chart_alias):
+        return ([chart_alias], True, False)
+    return None
+
+
+def sql_number_literal(value):
+    if value is None:
+        return "NULL"
+    return repr(float(value))
+
+
+def sql_string_literal(value):
+    if value is None:
+        return "NULL"
+    return "'%s'" % value.replace("\\", "\\\\").replace("'", "''")
+
+
+def get_chart_rows_query(chart_database_name, view_name_extension, column_names):
+    """
+    Return a query reading the given report columns of the rows charted for a resolution: 24 hours of
+    10 minute averages, 10 days of hours, or a year of days. These are the rows charted by the
+    sv_report_chart_* views; here only the requested columns are computed.
+    """
+    if view_name_extension == "sample":
+        chart_ts_expression = "ts - INTERVAL SECOND(ts) SECOND - INTERVAL (MINUTE(ts) % 10) MINUTE"
+        columns_listing = ", ".join(["AVG(%s) AS %s" % (column_name, column_name,) for column_name in column_names])
+        group_by_clause = "GROUP BY %s" % chart_ts_expression
+    else:
+        chart_ts_expression = "ts"
+        columns_listing = ", ".join(column_names)
+        group_by_clause = ""
+    query = """
+        SELECT
+          %s AS chart_ts,
+          NOW() AS chart_now,
+          %s
+        FROM
+          ${database_name}.sv_report_${view_name_extension}_recent
+        %s
+        ORDER BY
+          chart_ts
+        """ % (chart_ts_expression, columns_listing, group_by_clause)
+    query = query.replace("${database_name}", chart_database_name)
+    query = query.replace("${view_name_extension}", view_name_extension)
+    return query
+
+
+def get_chart_datetime(value):
+    if isinstance(value, datetime.datetime):
+        return value
+    return datetime.datetime(value.year, value.month, value.day)
+
+
+def get_chart_round_digits(min_value, max_value):
+    """
+    Number of decimal digits for chart values; same as the *_round_digits columns of sv_report_*_minmax views.
+    """
+    if min_value is None or max_value is None or max_value <= min_value:
+        return 1
+    return max(1, int(math.ceil(-math.log(max_value - min_value))))
+
+
+def format_chart_value(value, round_digits=2):
+    if value is None:
+        return "_"
+    formatted_value = ("%%.%df" % round_digits) % value
+    if "." in formatted_value:
+        formatted_value = formatted_value.rstrip("0").rstrip(".")
+    if formatted_value == "-0":
+        formatted_value = "0"
+    return formatted_value
+
+
+def format_chart_timestamp(ts, time_format):
+    # Python's strftime has no equivalent to MySQL's %e (day of month without leading zero)
+    return ts.strftime(time_format.replace("%e", str(ts.day)))
+
+
+def format_chart_label(ts, view_name_extension):
+    if view_name_extension == "sample":
+        return ts.strftime("%H:00")
+    if view_name_extension == "hour":
+        # As MySQL's %D: day of month with English suffix
+        if ts.day in [11, 12, 13]:
+            return "%dth" % ts.day
+        return "%d%s" % (ts.day, {1: "st", 2: "nd", 3: "rd"}.get(ts.day % 10, "th"))
+    return format_chart_timestamp(ts, "%b %e").lower()
+
+
+def get_chart_labels(view_name_extension, ts_min, ts_max, chart_now):
+    """
+    Python counterpart of the sv_report_chart_*_labels views: x-axis labels and grid, title and colors.
+    """
+    # (unit seconds, grid step in units, grid offset in units, first label time, label step seconds, max labels, label value, labels step)
+    labels_settings = {
+        "sample": (60, 60, (60 - ts_min.minute) % 60, 
+            datetime.datetime(ts_min.year, ts_min.month, ts_min.day, ts_min.hour), 60*60, 24, lambda ts: ts.hour, 4),
+        "hour":   (60*60, 24, (24 - ts_min.hour) % 24, 
+            datetime.datetime(ts_min.year, ts_min.month, ts_min.day), 24*60*60, 10, lambda ts: ts.day, 1),
+        "day":    (24*60*60, 7, (7 - ts_min.weekday()) % 7, 
+            datetime.datetime(ts_min.year, ts_min.month, ts_min.day) - datetime.timedelta(days=ts_min.weekday()), 7*24*60*60, 52, lambda ts: ts.day, 1),
+        }
+    title_settings = {
+        "sample": ("%b %e, %H:%M", 60*60, "hours", 60*60),
+        "hour":   ("%b %e, %H:00", 24*60*60, "days", 2*60*60),
+        "day":    ("%b %e, %Y", 24*60*60, "days", 24*60*60),
+        }
+    (unit_seconds, step_units, offset_units, base_ts, label_step_seconds, labels_limit, label_value, labels_step) = labels_settings[view_name_extension]
+    (title_ts_format, title_unit_seconds, title_unit_description, stale_seconds) = title_settings[view_name_extension]
+
+    ts_diff = ts_max - ts_min
+    ts_diff_seconds = ts_diff.days*24*60*60 + ts_diff.seconds
+    ts_diff_units = ts_diff_seconds // unit_seconds
+    x_axis_step_size = ""
+    x_axis_offset = ""
+    x_axis_labels = []
+    x_axis_labels_positions = []
+    if ts_diff_units:
+        step_size = round(step_units*100.0/ts_diff_units, 2)
+        offset = round(offset_units*100.0/ts_diff_units, 2)
+        x_axis_step_size = format_chart_value(step_size)
+        x_axis_offset = format_chart_value(offset)
+        for n in range(0, labels_limit + 1):
+            label_ts = base_ts + datetime.timedelta(seconds=n*label_step_seconds)
+            if label_ts < ts_min:
+                continue
+            if label_ts > ts_max:
+                break
+            if label_value(label_ts) % labels_step == 0:
+                x_axis_labels.append(format_chart_label(label_ts, view_name_extension))
+            elif label_value(label_ts) % labels_step == labels_step/2.0:
+                x_axis_labels.append(" ")
+            else:
+                x_axis_labels.append("")
+            if base_ts < ts_min:
+                x_axis_labels_positions.append(format_chart_value(offset + step_size*(n-1)))
+            else:
+                x_axis_labels_positions.append(format_chart_value(offset + step_size*n))
+
+    # Without chart_now (cached charts), staleness is left to be determined at read time
+    is_stale = (chart_now is not None) and (ts_max < chart_now - datetime.timedelta(seconds=stale_seconds))
+    if is_stale:
+        title_prefix = "STALE DATA! "
+    else:
+        title_prefix = "Latest "
+    chart_time_description = "%s%d %s: %s  -  %s" % (
+        title_prefix, int(round(float(ts_diff_seconds)/title_unit_seconds)), title_unit_description,
+        format_chart_timestamp(ts_min, title_ts_format), format_chart_timestamp(ts_max, title_ts_format))
+    return {
+        "x_axis_step_size": x_axis_step_size,
+        "x_axis_offset": x_axis_offset,
+        "x_axis_labels": "|".join(x_axis_labels),
+        "x_axis_labels_positions": ",".join(x_axis_labels_positions),
+        "chart_time_description": chart_time_description,
+        "chart_title_color": {True: "808080", False: "303030"}[is_stale],
+        "chart_bg_color": {True: "f0f0f0", False: "ffffff"}[is_stale],
+        }
+
+
+def get_range_chart_labels(chart_title, ts_start, range_seconds):
+    """
+    Labels of a chart over an arbitrary time range (get_chart_labels() is for the fixed resolutions):
+    given title, and evenly spaced x-axis labels.
+    """
+    num_labels = 8
+    if range_seconds > 2*24*60*60:
+        label_format = "%m-%d"
+    else:
+        label_format = "%H:%M"
+    x_axis_step = 100.0/num_labels
+    return {
+        "x_axis_step_size": format_chart_value(x_axis_step),
+        "x_axis_offset": "0",
+        "x_axis_labels": "|".join([(ts_start + datetime.timedelta(seconds=i*range_seconds/num_labels)).strftime(label_format) for i in range(num_labels)]),
+        "x_axis_labels_positions": ",".join([format_chart_value(i*x_axis_step) for i in range(num_labels)]),
+        "chart_time_description": chart_title,
+        "chart_title_color": "303030",
+        "chart_bg_color": "ffffff",
+        }
+
+
+def render_chart(chart_columns_list, series, scale_from_0, scale_to_100, ts_start, ts_step_seconds, labels, charts_api):
+    """
+    Render a single chart, given its series: lists of evenly spaced (in time) values, None for missing values,
+    starting at ts_start, ts_step_seconds apart. labels are as returned by get_chart_labels() or get_range_chart_labels().
+    Return the chart's (Google simple encoding URL, openark extended URL).
+    """
+    round_digits = []
+    values = []
+    for series_values in series:
+        series_existing_values = [value for value in series_values if value is not None]
+        if series_existing_values:
+            round_digits.append(get_chart_round_digits(min(series_existing_values), max(series_existing_values)))
+        else:
+            round_digits.append(1)
+        values.extend(series_existing_values)
+    least_value = 0
+    greatest_value = 0
+    if values:
+        least_value = min(values)
+        greatest_value = max(values)
+    if scale_from_0:
+        least_value = min(0, least_value)
+    if scale_to_100:
+        greatest_value = max(100, greatest_value)
+
+    simple_encoding = charts_api["simple_encoding"]
+    def simple_encode(value):
+        if value is None or greatest_value <= least_value:
+            return "_"
+        return simple_encoding[int(round(61*(value - least_value)/(greatest_value - least_value)))]
+
+    simple_column_values = ",".join(["".join([simple_encode(value) for value in series_values]) for series_values in series])
+    extended_column_values = "|".join([",".join([format_chart_value(value, round_digits[i]) for value in series[i]]) for i in range(len(series))])
+    url = "".join([
+        "%s?cht=lc&chs=%sx%s&chts=%s,12&chtt=%s&chf=c,s,%s" % (charts_api["service_url"], charts_api["chart_width"], charts_api["chart_height"],
+            labels["chart_title_color"], labels["chart_time_description"], labels["chart_bg_color"]),
+        "&chdl=%s&chdlp=b&chco=%s&chd=${encoding_type}:${column_values}" % ("|".join(chart_columns_list), ",".join(default_chart_colors[0:len(chart_columns_list)])),
+        "&chxt=x,y&chxr=1,%s,%s&chxl=0:|%s|&chxs=0,505050,10,0,lt" % (format_chart_value(least_value, max(round_digits + [1])), format_chart_value(greatest_value, max(round_digits + [1])), labels["x_axis_labels"]),
+        "&chg=%s,25,1,2,%s,0&chxp=0,%s&tsstart=%s&tsstep=%d" % (labels["x_axis_step_size"], labels["x_axis_offset"], labels["x_axis_labels_positions"],
+            ts_start.strftime("%Y-%m-%d %H:%M:%S"), ts_step_seconds),
+        ])
+    return (
+        url.replace("${encoding_type}", "s").replace("${column_values}", simple_column_values).replace(" ", "+"),
+        url.replace("${encoding_type}", "t").replace("${column_values}", extended_column_values).replace(" ", "+"),
+        )
+
+
+def render_charts(view_name_extension, rows, charts_list, charts_api, mark_stale=True):
+    """
+    Python counterpart of the sv_report_chart_* views. Given rows read by get_chart_rows_query(), and charts
+    as listed by get_report_chart_views(), return a dict mapping each chart alias to its (Google simple encoding URL,
+    openark extended URL). Missing points are filled in-process, so there is no limit on the number of points.
+    URLs are None when there are no rows.
+    With mark_stale=False, charts are never titled as stale; see get_chart_cache_stale_expression().
+    """
+    if not rows:
+        return dict([(alias, (None, None)) for (chart_columns, alias, scale_from_0, scale_to_100, chart_colors) in charts_list])
+
+    ts_step_seconds = {"sample": 60*10, "hour": 60*60, "day": 60*60*24}[view_name_extension]
+    rows_by_ts = dict([(get_chart_datetime(row["chart_ts"]), row) for row in rows])
+    ts_min = min(rows_by_ts.keys())
+    ts_max = max(rows_by_ts.keys())
+    timeseries_rows = []
+    ts = ts_min
+    while ts <= ts_max:
+        timeseries_rows.append(rows_by_ts.get(ts))
+        ts += datetime.timedelta(seconds=ts_step_seconds)
+    chart_now = None
+    if mark_stale:
+        chart_now = rows[0]["chart_now"]
+    labels = get_chart_labels(view_name_extension, ts_min, ts_max, chart_now)
+
+    charts = {}
+    for (chart_columns, alias, scale_from_0, scale_to_100, _chart_colors) in charts_list:
+        chart_columns_list = [column_name.strip() for column_name in chart_columns.lower().split(",")]
+        series = [[row and get_float_value(row[column_name]) for row in timeseries_rows] for column_name in chart_columns_list]
+        charts[alias] = render_chart(chart_columns_list, series, scale_from_0, scale_to_100, ts_min, ts_step_seconds, labels, charts_api)
+    return charts
+
+
+def get_chart_cache_stale_expression(view_name_extension, chart_column):
+    """
+    Cached charts are rendered with a "Latest" title. Whether they are stale depends on the time they are read,
+    so the stale title and colors (as in the sv_report_chart_*_labels views) are applied by the reading view.
+    """
+    stale_error_conditions = {
+        "sample": "source_ts < NOW() - INTERVAL 1 HOUR",
+        "hour":   "source_ts < NOW() - INTERVAL 2 HOUR",
+        "day":    "source_ts < NOW() - INTERVAL 1 DAY",
+        }
+    return """IF(%s, 
+          REPLACE(REPLACE(REPLACE(%s, 'chts=303030,', 'chts=808080,'), '&chtt=Latest+', '&chtt=STALE+DATA!+'), '&chf=c,s,ffffff', '&chf=c,s,f0f0f0'), 
+          %s)""" % (stale_error_conditions[view_name_extension], chart_column, chart_column)
+
+
+def create_report_chart_cache_views(charts_list):
+    """
+    With --chart-cache, the sv_report_chart_* views flatten the chart_cache table into a single row, 
+    with the same columns as when charts are computed by SQL.
+    """
     for view_name_extension in ["sample", "hour", "day"]:
-        charts_queries = [generate_google_chart_query(chart_columns, alias, scale_from_0, scale_to_100, chart_colors) for (chart_columns, alias, scale_from_0, scale_to_100, chart_colors) in charts_list]
-        charts_query = ",".join(charts_queries)
+        charts_columns = []
+        for (chart_columns, alias, scale_from_0, scale_to_100, chart_colors) in charts_list:
+            charts_columns.append("MAX(IF(chart_alias = '%s', %s, NULL)) AS %s" % (alias, get_chart_cache_stale_expression(view_name_extension, "chart"), alias,))
+            charts_columns.append("MAX(IF(chart_alias = '%s', %s, NULL)) AS %s_extended" % (alias, get_chart_cache_stale_expression(view_name_extension, "chart_extended"), alias,))
         query = """
             CREATE
             OR REPLACE
@@ -3147,7 +4827,35 @@ def create_report_google_chart_views(charts_list):
               SELECT
                 %s
               FROM
-                ${database_name}.sv_report_chart_${view_name_extension}_timeseries, ${database_name}.sv_report_${view_name_extension}_recent_minmax, ${database_name}.charts_api, ${database_name}.sv_report_chart_${view_name_extension}_labels
+                ${database_name}.chart_cache
+              WHERE
+                resolution = '${view_name_extension}'
+            """ % ",\n                ".join(charts_columns)
+        query = query.replace("${database_name}", database_name)
+        query = query.replace("${view_name_extension}", view_name_extension)
+        act_query(query)
+
+    verbose("report charts views created over chart_cache")
+
+
+def create_report_google_chart_views(charts_list):
+    if options.chart_cache:
+        create_report_chart_cache_views(charts_list)
+        return
+    for view_name_extension in ["sample", "hour", "day"]:
+        charts_queries = [generate_google_chart_query(chart_columns, alias, scale_from_0, scale_to_100, chart_colors) for (chart_columns, alias, scale_from_0, scale_to_100, chart_colors) in charts_list]
+        charts_query = ",".join(charts_queries)
+        query = """
+            CREATE
+            OR REPLACE
+            ALGORITHM = TEMPTABLE
+            DEFINER = CURRENT_USER
+            SQL SECURITY INVOKER
+            VIEW ${database_name}.sv_report_chart_${view_name_extension} AS
+              SELECT
+                %s
+              FROM
+                ${database_name}.sv_report_chart_${view_name_extension}_timeseries, ${database_name}.sv_report_${view_name_extension}_recent_minmax, ${database_name}.charts_api, ${database_name}.sv_report_chart_${view_name_extension}_labels
             """ % charts_query
         query = query.replace("${database_name}", database_name)
         query = query.replace("${view_name_extension}", view_name_extension)
@@ -3979,24 +5687,11 @@ def create_report_views(columns_listing):
     verbose("report views created")
 
 
-def create_status_variables_views_and_aggregations():
-    # General status variables views:
-    create_status_variables_latest_view()
-    create_status_variables_diff_view()
-    create_status_variables_sample_view()
-    # If aggregation tables are enabled, then the hour and day views rely on aggregation tables rather than on sv_sample
-    if not options.skip_aggregation:
-        # aggregation is enabled
-        if not create_status_variables_hour_aggregation_table():
-            upgrade_status_variables_hour_aggregation_table()
-        if not create_status_variables_day_aggregation_table():
-            upgrade_status_variables_day_aggregation_table()
-    create_status_variables_hour_view()
-    create_status_variables_day_view()
-    create_status_variables_parameter_change_view()
-
-    # Report views:
-    create_report_views("""
+def get_report_columns_listing():
+    """
+    Report columns, one per line, as listed by the sv_report_* views
+    """
+    return """
             uptime,
             LEAST(100, ROUND(100*uptime_diff/NULLIF(ts_diff_seconds, 0), 1)) AS uptime_percent,
 
@@ -4156,7 +5851,44 @@ def create_status_variables_views_and_aggregations():
                ",\n".join(get_custom_status_variables_psec()),  
                ",\n".join(get_custom_time_status_variables()),
                )
-        )
+
+
+def get_report_columns_expressions():
+    """
+    Return (column name, column expression) of report columns, parsed the same way as by create_report_views()
+    """
+    columns_expressions = []
+    for column_line in get_report_columns_listing().split("\n"):
+        column_expression = column_line.strip().rstrip(",").strip()
+        if not column_expression:
+            continue
+        column_name = column_expression.lower().split(" as ")[-1].strip()
+        columns_expressions.append((column_name, column_expression))
+    return columns_expressions
+
+
+def create_status_variables_views_and_aggregations():
+    # If diff materialization is enabled, then sv_diff and sv_sample rely on the diff table rather than on a self join
+    if options.materialize_diff:
+        if not create_status_variables_diff_table():
+            upgrade_status_variables_diff_table()
+    # General status variables views:
+    create_status_variables_latest_view()
+    create_status_variables_diff_view()
+    create_status_variables_sample_view()
+    # If aggregation tables are enabled, then the hour and day views rely on aggregation tables rather than on sv_sample
+    if not options.skip_aggregation:
+        # aggregation is enabled
+        if not create_status_variables_hour_aggregation_table():
+            upgrade_status_variables_hour_aggregation_table()
+        if not create_status_variables_day_aggregation_table():
+            upgrade_status_variables_day_aggregation_table()
+    create_status_variables_hour_view()
+    create_status_variables_day_view()
+    create_status_variables_parameter_change_view()
+
+    # Report views:
+    create_report_views(get_report_columns_listing())
     create_report_24_7_view()
     create_report_recent_views()
     create_report_sample_recent_aggregated_view()
@@ -4164,68 +5896,9 @@ def create_status_variables_views_and_aggregations():
     create_report_human_views()
 
     # Report chart views:
-    create_report_chart_sample_timeseries_view()
-    create_report_chart_hour_timeseries_view()
-    create_report_chart_day_timeseries_view()
+    create_report_chart_timeseries_views()
     create_report_chart_labels_views()
-    report_chart_views = [
-        ("uptime_percent", "uptime_percent", True, True, ["#ff8c00", ]),
-
-        ("innodb_read_hit_percent", "innodb_read_hit_percent", False, False, ["#9acd32", ]),
-        ("innodb_buffer_pool_reads_psec, innodb_buffer_pool_pages_flushed_psec", "innodb_io", True, False, ["#4682b4", "#9acd32", ]),
-        ("innodb_data_files_writes_psec, innodb_log_writes_psec, innodb_dblwr_writes_psec, innodb_data_reads_psec", "innodb_rw", True, False, ["#4682b4", "#9acd32", ]),
-        ("innodb_buffer_pool_used_percent, innodb_buffer_pool_pages_dirty_percent", "innodb_buffer_pool_usage", True, True, ["#dda0dd", ]),
-        ("innodb_buffer_pool_pages_total, innodb_buffer_pool_pages_data, innodb_buffer_pool_pages_dirty", "innodb_buffer_pool_pages", True, False, ["#dda0dd", ]),
-        ("innodb_estimated_log_mb_written_per_hour", "innodb_estimated_log_mb_written_per_hour", True, False, ["9932cc", ]),
-        ("innodb_row_lock_time_psec", "innodb_row_lock_time_psec", True, False, ["808080", ]),
-        ("innodb_buffer_pool_read_ahead_psec, innodb_buffer_pool_read_ahead_evicted_psec", "innodb_buffer_pool_read_ahead", True, False, ["#dda0dd", ]),
-
-        ("mega_bytes_sent_psec, mega_bytes_received_psec", "network_io", True, False, ["#7fffd4", "808080", ]),
-
-        ("key_buffer_used_percent", "myisam_key_buffer_used_percent", True, True, ["191970", ]),
-        ("key_read_requests_psec, key_reads_psec, key_write_requests_psec, key_writes_psec", "myisam_key_hit", True, False, ["#9acd32", "#ff8c00", "#ffd700", "#4682b4", ]),
-
-        ("com_select_psec, com_insert_psec, com_insert_select_psec, com_delete_psec, com_update_psec, com_replace_psec", "DML", True, False, ["#dc143c", "#ffd700", "#4682b4", "9acd32", "808080", ]),
-        ("queries_psec, questions_psec, slow_queries_psec, com_commit_psec, com_set_option_psec", "questions", True, False, ["#7fffd4", "#ff8c00", "#4682b4", "9932cc", "ffd700", ]),
-        ("innodb_rows_inserted_psec, innodb_rows_deleted_psec, innodb_rows_updated_psec", "innodb_rows", True, False, ["#dda0dd", "#7fffd4", "#4682b4", ]),
-
-        ("created_tmp_tables_psec, created_tmp_disk_tables_psec", "tmp_tables", True, False, ["#9932cc", "#ff8c00", ]),
-        ("handler_read_rnd_psec, handler_read_rnd_next_psec, handler_read_first_psec, handler_read_next_psec, handler_read_prev_psec, handler_read_key_psec", "read_patterns", True, False, ["#ff8c00", "#ffd700", "#7fffd4", "#dc143c", "9acd32", "808080" ]),
-
-        ("table_locks_waited_psec", "table_locks_waited_psec", True, False, ["dc143c", ]),
-
-        ("table_cache_size, open_tables, table_definition_cache_size, open_table_definitions", "table_cache_use", True, False, ["#9932cc", "7fffd4", ]),
-        ("opened_tables_psec, opened_table_definitions_psec", "opened_tables_psec", True, False, ["#4682b4", "dc143c", ]),
-
-        ("connections_psec, aborted_connects_psec, threads_created_psec", "connections", True, False, ["#ff8c00", "#dda0dd", ]),
-        ("max_connections, threads_connected, threads_running", "connections_usage", True, False, ["#808080", "#ffd700", "#7fffd4", ]),
-
-        ("thread_cache_size, threads_cached", "thread_cache_use", True, False, ["#808080", "#ff8c00", ]),
-        ("threads_created_psec", "threads_created_psec", True, False, ["9932cc", ]),
-
-        ("relay_log_space_limit_mb, relay_log_space_mb", "relay_log_used_mb", True, False, ["191970", ]),
-        ("seconds_behind_master", "seconds_behind_master", True, True, ["#005E5E", "#0F006C", "#538F00", ]),
-        ("seconds_behind_master_psec", "seconds_behind_master_psec", True, False, ["4682b4", ]),
-        ("estimated_slave_catchup_seconds", "estimated_slave_catchup_seconds", True, False, ["9932cc", ]),
-
-        ("os_cpu_utilization_percent", "os_cpu_utilization_percent", True, True, ["ff8c00", ]),
-        ("os_loadavg, os_total_cpu_cores", "os_loadavg", True, False, ["dc143c", "7fffd4", ]),
-        ("os_mem_total_mb, os_mem_used_mb, os_mem_active_mb, os_swap_total_mb, os_swap_used_mb", "os_memory", True, False, ["#7fffd4", "#191970", "#ffd700", "#4682b4", "#dc143c", ]),
-        ("os_page_ins_psec, os_page_outs_psec", "os_page_io", True, False, ["#9acd32", "#ff8c00", ]),
-        ("os_swap_ins_psec, os_swap_outs_psec", "os_swap_io", True, False, ["#4682b4", "#dc143c", ]),
-
-        ("os_root_mountpoint_usage_percent, os_datadir_mountpoint_usage_percent, os_tmpdir_mountpoint_usage_percent", "os_mountpoints_usage_percent", True, True, ["#ff8c00", "#ffd700", "#4682b4", ]),
-        ]
-    report_chart_views.extend([
-        (custom_variable, custom_variable, True, False, []) for custom_variable in get_custom_status_variables()
-        ])
-    report_chart_views.extend([
-        (custom_variable, custom_variable, True, False, []) for custom_variable in get_custom_time_status_variables()
-        ])
-    report_chart_views.extend([
-        (custom_variable, custom_variable, True, False, []) for custom_variable in get_custom_status_variables_psec()
-        ])
-    create_report_google_chart_views(report_chart_views)
+    create_report_google_chart_views(get_all_report_chart_views())
     report_24_7_columns = [
         "innodb_read_hit_percent",
         "innodb_buffer_pool_reads_psec",
@@ -4308,37 +5981,54 @@ def create_status_variables_views_and_aggregations():
     create_custom_html_brief_view()
 
 
-def send_email_message(description, subject, message, attachment=None):
-    try:
-        smtp_to = options.smtp_to
-        smtp_from = options.smtp_from
-        smtp_host = options.smtp_host
-        
-        # Create the container (outer) email message.
-        msg = MIMEMultipart()
-        msg["Subject"] = subject
-        msg["From"] = smtp_from 
-        msg["To"] = smtp_to
+def open_smtp_session(smtp_host):
+    """
+    Connect to the SMTP server, with --smtp-timeout. smtplib accepts a timeout as of python 2.6; with older
+    versions the timeout only applies once connected.
+    """
+    if sys.version_info >= (2, 6):
+        return smtplib.SMTP(smtp_host, timeout=options.smtp_timeout)
+    smtp_session = smtplib.SMTP(smtp_host)
+    smtp_session.sock.settimeout(options.smtp_timeout)
+    return smtp_session
+
+
+def get_email_message(subject, message, attachment=None):
+    # Create the container (outer) email message.
+    msg = MIMEMultipart()
+    msg["Subject"] = subject
+    msg["From"] = options.smtp_from 
+    msg["To"] = options.smtp_to
 
-        message_suffix = """
+    message_suffix = """
     
 You are receiving this email from a mycheckpoint -- MySQL monitoring utility -- installation.
 Please consult your system or database administrator if you do not know why you got this mail.
 -------
 mycheckpoint home page: http://code.openark.org/forge/mycheckpoint
-            """
-        message = message + message_suffix
-        msg.preamble = message
-        
-        if attachment:
-            msg.attach(attachment)
+        """
+    message = message + message_suffix
+    msg.preamble = message
+    
+    if attachment:
+        msg.attach(attachment)
+    
+    text_message = MIMEText(message)
+    msg.attach(text_message)
+    return msg
+
+
+def send_email_message(description, subject, message, attachment=None):
+    try:
+        smtp_to = options.smtp_to
+        smtp_from = options.smtp_from
+        smtp_host = options.smtp_host
         
-        text_message = MIMEText(message)
-        msg.attach(text_message)
+        msg = get_email_message(subject, message, attachment)
     
         verbose("Sending %s message from %s to: %s via: %s" % (description, smtp_from, smtp_to, smtp_host))
         # Send the email via our own SMTP server.
-        s = smtplib.SMTP(smtp_host)
+        s = open_smtp_session(smtp_host)
         s.sendmail(smtp_from, smtp_to.split(","), msg.as_string())
         s.quit()
         verbose("+ Sent")
@@ -4350,6 +6040,162 @@ mycheckpoint home page: http://code.openark.org/forge/mycheckpoint
         return False
     
     
+def update_queued_emails(connection, set_clause, alert_email_outbox_ids):
+    query = """
+        UPDATE 
+          ${database_name}.alert_email_outbox
+        SET 
+          %s
+        WHERE 
+          alert_email_outbox_id IN (%s)
+        """ % (set_clause, ",".join(["%d" % alert_email_outbox_id for alert_email_outbox_id in alert_email_outbox_ids]))
+    query = query.replace("${database_name}", database_name)
+    cursor = connection.cursor()
+    cursor.execute(query)
+    cursor.close()
+    connection.commit()
+
+
+def send_queued_emails(connection=None):
+    """
+    Send queued alert emails over a single SMTP session.
+    Messages are first claimed by this sender's connection, so that concurrent senders (the daemon's sender
+    thread, the send_emails command, a collection run with --inline-emails) never send the same message. Claims of a sender which
+    died are released after the time it would take to time out on a full batch.
+    Upon SMTP failure, the unsent messages are retried later on, with exponential backoff, 
+    up to --email-max-attempts attempts.
+    Returns the number of sent messages.
+    """
+    if connection is None:
+        connection = write_conn
+    smtp_to = options.smtp_to
+    smtp_from = options.smtp_from
+    smtp_host = options.smtp_host
+    batch_size = 100
+
+    query = """
+        UPDATE 
+          ${database_name}.alert_email_outbox
+        SET
+          claimed_by = CONNECTION_ID(),
+          ts_claimed = NOW()
+        WHERE 
+          ts_sent IS NULL
+          AND ts_next_attempt <= NOW()
+          AND num_attempts < %d
+          AND (claimed_by IS NULL OR ts_claimed < NOW() - INTERVAL %d SECOND)
+        ORDER BY 
+          alert_email_outbox_id
+        LIMIT %d
+        """ % (options.email_max_attempts, options.smtp_timeout * (batch_size + 1), batch_size)
+    query = query.replace("${database_name}", database_name)
+    if not (smtp_to and smtp_from and smtp_host):
+        # Do not claim messages which cannot be sent
+        row = get_row("SELECT COUNT(*) AS num_queued FROM %s.alert_email_outbox WHERE ts_sent IS NULL AND num_attempts < %d" % (database_name, options.email_max_attempts), connection)
+        connection.commit()
+        if row and row["num_queued"]:
+            print_error("Cannot send %d queued emails: smtp-host, smtp-from and smtp-to must be specified" % row["num_queued"])
+        return 0
+    cursor = connection.cursor()
+    num_claimed = cursor.execute(query)
+    cursor.close()
+    # Commit the claim; also, do not hold a snapshot (nor locks) while talking to the SMTP server
+    connection.commit()
+    if not num_claimed:
+        return 0
+
+    query = """
+        SELECT 
+          alert_email_outbox_id, subject, message
+        FROM 
+          ${database_name}.alert_email_outbox
+        WHERE 
+          claimed_by = CONNECTION_ID()
+          AND ts_sent IS NULL
+        ORDER BY 
+          alert_email_outbox_id
+        """
+    query = query.replace("${database_name}", database_name)
+    rows = get_rows(query, connection)
+    connection.commit()
+    if not rows:
+        return 0
+
+    verbose("Sending %d queued alert notifications messages from %s to: %s via: %s" % (len(rows), smtp_from, smtp_to, smtp_host))
+    num_sent_messages = 0
+    smtp_session = None
+    try:
+        smtp_session = open_smtp_session(smtp_host)
+        for row in rows:
+            msg = get_email_message(row["subject"], row["message"])
+            smtp_session.sendmail(smtp_from, smtp_to.split(","), msg.as_string())
+            update_queued_emails(connection, "ts_sent = NOW(), num_attempts = num_attempts + 1, last_error = NULL, claimed_by = NULL", [int(row["alert_email_outbox_id"])])
+            num_sent_messages += 1
+    except Exception, err:
+        print_error("Failed sending email: %s" % err)
+        if options.debug:
+            traceback.print_exc()
+        unsent_alert_email_outbox_ids = [int(row["alert_email_outbox_id"]) for row in rows[num_sent_messages:]]
+        # ts_next_attempt is computed before num_attempts is incremented
+        update_queued_emails(connection, """
+            ts_next_attempt = NOW() + INTERVAL LEAST(60*POW(2, num_attempts), 3600) SECOND, 
+            num_attempts = num_attempts + 1, 
+            last_error = %s,
+            claimed_by = NULL""" % sql_string_literal(str(err)[:1023]), unsent_alert_email_outbox_ids)
+    if smtp_session:
+        try:
+            smtp_session.quit()
+        except Exception:
+            pass
+    verbose("+ Sent %d messages" % num_sent_messages)
+    return num_sent_messages
+
+
+def send_queued_emails_periodically():
+    """
+    Email sender thread for the collector daemon. Uses its own connection, so that neither waits on the other.
+    """
+    connection = None
+    while True:
+        try:
+            if connection is None:
+                connection = open_write_connection()
+            send_queued_emails(connection)
+        except MySQLdb.Error:
+            if options.debug:
+                traceback.print_exc()
+            verbose("Cannot send queued emails; will reconnect")
+            try:
+                connection.close()
+            except:
+                pass
+            connection = None
+        except Exception, err:
+            # Keep the sender thread alive
+            print_error("Failed sending queued emails: %s" % err)
+            if options.debug:
+                traceback.print_exc()
+        time.sleep(options.daemon_interval)
+
+
+def purge_alert_email_outbox():
+    """
+    Sent emails, as well as emails which have used up their attempts, are kept for --purge-days days.
+    """
+    query = """
+        DELETE FROM 
+          ${database_name}.alert_email_outbox
+        WHERE 
+          ts_queued < NOW() - INTERVAL %d DAY
+          AND (ts_sent IS NOT NULL OR num_attempts >= %d)
+        """ % (options.purge_days, options.email_max_attempts)
+    query = query.replace("${database_name}", database_name)
+    num_affected_rows = act_query(query)
+    if num_affected_rows:
+        verbose("Old alert email outbox entries purged")
+    return num_affected_rows
+
+
 def get_html_brief_report():    
     query = "SELECT html FROM %s.sv_report_html_brief" % database_name
     brief_report = get_row(query)["html"]
@@ -4433,27 +6279,123 @@ def collect_status_variables():
     disable_bin_log()
 
     status_dict = fetch_status_variables()
+    collect_custom_data()
+    sample_timestamp = get_sample_timestamp()
 
-    column_names = ", ".join(["%s" % column_name for column_name in sorted_list(status_dict.keys())])
+    column_names = ", ".join(["ts"] + ["%s" % column_name for column_name in sorted_list(status_dict.keys())])
     for column_name in status_dict.keys():
         if status_dict[column_name] is None:
             status_dict[column_name] = "NULL"
         if status_dict[column_name] == "":
             status_dict[column_name] = "NULL"
-    variable_values = ", ".join(["%s" % status_dict[column_name] for column_name in sorted_list(status_dict.keys())])
+    variable_values = ", ".join(["'%s'" % sample_timestamp] + ["%s" % status_dict[column_name] for column_name in sorted_list(status_dict.keys())])
     query = """INSERT /*! IGNORE */ INTO %s.%s
             (%s)
             VALUES (%s)
     """ % (database_name, table_name,
         column_names,
         variable_values)
-    num_affected_rows = act_query(query)
+    num_affected_rows, insert_id = act_insert_query(query)
     if num_affected_rows:
-        status_variables_insert_id = get_last_insert_id()
-        status_variables_insert_timestamp = get_last_written_timestamp()
+        status_variables_insert_id = int(insert_id)
+        status_variables_insert_timestamp = sample_timestamp
         verbose("New entry added: id=%d; ts=%s" % (status_variables_insert_id, status_variables_insert_timestamp,))
 
 
+def get_numeric_value(value):
+    """
+    Sampled values are kept as strings (with "NULL" for missing values). Return the numeric value, or None.
+    """
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        try:
+            return int(round(float(value)))
+        except (ValueError, TypeError):
+            return None
+
+
+def get_previous_sample(sample_id):
+    """
+    Return the sample with given id, as a dict of id, ts & status values. If it is the locally cached
+    (previously collected) sample, no query is made.
+    """
+    if previous_sample and previous_sample["id"] == sample_id:
+        return previous_sample
+
+    _global_variables, status_columns = get_variables_and_status_columns()
+    query = """
+            SELECT
+              id, CONCAT(ts, '') AS ts_as_string, %s
+            FROM
+              %s.%s
+            WHERE
+              id = %d
+        """ % (", ".join(status_columns), database_name, table_name, sample_id)
+    row = get_row(query, write_conn)
+    if not row:
+        return None
+    return {
+        "id": int(row["id"]),
+        "ts": row["ts_as_string"],
+        "values": dict([(column_name, row[column_name]) for column_name in status_columns]),
+        }
+
+
+def write_status_variables_diff():
+    """
+    Compute the diffs between the newly written sample and the preceding one, and store them
+    in status_variables_diff. Must run after custom data has been collected.
+    """
+    global previous_sample
+
+    if not options.materialize_diff:
+        return
+    if status_variables_insert_id is None:
+        return
+
+    _global_variables, status_columns = get_variables_and_status_columns()
+    sample_values = dict([(column_name, get_numeric_value(status_dict.get(column_name))) for column_name in status_columns])
+    # Same as sv_diff's join condition
+    auto_increment_increment = max(1, get_numeric_value(status_dict.get("auto_increment_increment")) or 1)
+    sample = get_previous_sample(status_variables_insert_id - auto_increment_increment)
+    previous_sample = {
+        "id": status_variables_insert_id,
+        "ts": status_variables_insert_timestamp,
+        "values": sample_values,
+        }
+    if sample is None:
+        verbose("No preceding sample found; will not compute diff")
+        return
+
+    diff_values = []
+    for column_name in status_columns:
+        value = sample_values[column_name]
+        previous_value = sample["values"].get(column_name)
+        if value is None or previous_value is None:
+            diff_value = None
+        elif is_signed_column(column_name):
+            diff_value = value - previous_value
+        elif value < previous_value:
+            # Counter has been reset
+            diff_value = value
+        else:
+            diff_value = value - previous_value
+        diff_values.append((diff_value is None) and "NULL" or ("%d" % diff_value))
+
+    query = """
+        INSERT /*! IGNORE */ INTO %s.status_variables_diff
+          (id, ts, ts_diff_seconds, %s)
+        VALUES
+          (%d, '%s', TIMESTAMPDIFF(SECOND, '%s', '%s'), %s)
+        """ % (database_name, ", ".join(["%s_diff" % column_name for column_name in status_columns]),
+               status_variables_insert_id, status_variables_insert_timestamp, sample["ts"], status_variables_insert_timestamp, ", ".join(diff_values))
+    act_query(query)
+    verbose("Diff computed for entry id=%d" % status_variables_insert_id)
+
+
 def write_status_variables_hour_aggregation(aggregation_timestamp):
     if aggregation_timestamp is None:
         return
@@ -4554,10 +6496,132 @@ def write_status_variables_day_aggregation(aggregation_timestamp):
         verbose("%s Entry aggregated into status_variables_aggregated_day" % aggregation_timestamp)
 
 
-def detect_status_variables_hour_aggregation_missing_values():
-    if options.skip_aggregation:
-        return
-    
+def write_status_variables_incremental_aggregation(aggregation_table_name, ts_expression, end_ts_expression, sample_id):
+    """
+    Fold a single sample into an aggregation table: _diff values and ts_diff_seconds are added to the
+    aggregated row, other values are MAX'd. NULLs are ignored, just as SUM() and MAX() ignore them.
+    end_ts is kept at the latest end of the aggregated samples.
+    """
+    global_variables, status_columns = get_variables_and_status_columns()
+    level_columns = status_columns + global_variables
+    diff_columns = ["%s_diff" % (column_name,) for column_name in status_columns]
+
+    # Target columns are qualified, since sv_sample's columns go by the same names
+    sum_update_listing = ",\n".join([" ${aggregation_table_name}.%s = IF(VALUES(%s) IS NULL, ${aggregation_table_name}.%s, IFNULL(${aggregation_table_name}.%s, 0) + VALUES(%s))" % (column_name, column_name, column_name, column_name, column_name,) for column_name in ["ts_diff_seconds"] + diff_columns])
+    max_update_listing = ",\n".join([" ${aggregation_table_name}.%s = IFNULL(GREATEST(${aggregation_table_name}.%s, VALUES(%s)), IFNULL(${aggregation_table_name}.%s, VALUES(%s)))" % (column_name, column_name, column_name, column_name, column_name,) for column_name in level_columns])
+    query = """
+        INSERT INTO ${database_name}.${aggregation_table_name}
+          (
+            id, 
+            ts, 
+            end_ts, 
+            ts_diff_seconds, 
+            %s, 
+            %s
+          )
+          SELECT
+            id,
+            ${ts_expression} AS ts,
+            ${end_ts_expression} AS end_ts,
+            ts_diff_seconds,
+            %s,
+            %s
+          FROM
+            ${database_name}.sv_sample
+          WHERE
+            id = %d
+        ON DUPLICATE KEY UPDATE
+          ${aggregation_table_name}.end_ts = GREATEST(${aggregation_table_name}.end_ts, VALUES(end_ts)),
+          %s,
+          %s
+    """ % (",\n".join(level_columns), ",\n".join(diff_columns),
+           ",\n".join(level_columns), ",\n".join(diff_columns),
+           sample_id,
+           sum_update_listing, max_update_listing)
+    query = query.replace("${database_name}", database_name)
+    query = query.replace("${aggregation_table_name}", aggregation_table_name)
+    query = query.replace("${ts_expression}", ts_expression)
+    query = query.replace("${end_ts_expression}", end_ts_expression)
+
+    num_affected_rows = act_query(query)
+    if num_affected_rows:
+        verbose("Entry id=%d folded into %s" % (sample_id, aggregation_table_name))
+
+
+def write_status_variables_aggregations():
+    """
+    Aggregate the newly written sample into the hour & day aggregation tables
+    """
+    if options.skip_aggregation:
+        return
+    if options.incremental_aggregation:
+        if status_variables_insert_id is None:
+            return
+        write_status_variables_incremental_aggregation("status_variables_aggregated_hour", 
+            "DATE(ts) + INTERVAL HOUR(ts) HOUR", "DATE(ts) + INTERVAL (HOUR(ts) + 1) HOUR", status_variables_insert_id)
+        write_status_variables_incremental_aggregation("status_variables_aggregated_day", 
+            "DATE(ts)", "DATE(ts) + INTERVAL 1 DAY", status_variables_insert_id)
+    else:
+        write_status_variables_hour_aggregation(status_variables_insert_timestamp)
+        write_status_variables_day_aggregation(status_variables_insert_timestamp)
+
+
+def refresh_chart_cache():
+    """
+    Render charts into the chart_cache table. Sample charts are rendered upon each sample. Hour and day charts
+    are only rendered when their report views get a new row, i.e. once per hour and once per day.
+    Without a new sample (e.g. upon deploy), only charts not yet cached are rendered.
+    Charts are cached without a stale indication; staleness is determined when read.
+    """
+    if not options.chart_cache:
+        return
+
+    query = "SELECT resolution, MAX(source_ts) AS source_ts FROM %s.chart_cache GROUP BY resolution" % database_name
+    cached_source_timestamps = dict([(row["resolution"], row["source_ts"]) for row in get_rows(query, write_conn)])
+    cached_resolutions = cached_source_timestamps.keys()
+
+    charts_list = get_all_report_chart_views()
+    column_names = []
+    for (chart_columns, alias, scale_from_0, scale_to_100, chart_colors) in charts_list:
+        for column_name in chart_columns.lower().split(","):
+            if column_name.strip() not in column_names:
+                column_names.append(column_name.strip())
+    charts_api = get_row("SELECT * FROM %s.charts_api" % database_name, write_conn)
+    for view_name_extension in ["sample", "hour", "day"]:
+        if status_variables_insert_timestamp is None and view_name_extension in cached_resolutions:
+            # No new sample, hence no change to report rows
+            continue
+        if view_name_extension in ["hour", "day"] and view_name_extension in cached_resolutions:
+            query = "SELECT MAX(ts) AS latest_ts FROM %s.sv_report_%s_recent" % (database_name, view_name_extension)
+            latest_ts = get_row(query, write_conn)["latest_ts"]
+            if latest_ts is not None:
+                latest_ts = get_chart_datetime(latest_ts)
+            if latest_ts == cached_source_timestamps[view_name_extension]:
+                # No new report row since charts were cached
+                continue
+        rows = get_rows(get_chart_rows_query(database_name, view_name_extension, column_names), write_conn)
+        charts = render_charts(view_name_extension, rows, charts_list, charts_api, mark_stale=False)
+        source_ts = "NULL"
+        if rows:
+            source_ts = "'%s'" % max([get_chart_datetime(row["chart_ts"]) for row in rows]).strftime("%Y-%m-%d %H:%M:%S")
+        cached_values = ["('%s', '%s', %s, %s, %s)" % (view_name_extension, alias, sql_string_literal(charts[alias][0]), sql_string_literal(charts[alias][1]), source_ts) 
+            for (chart_columns, alias, scale_from_0, scale_to_100, chart_colors) in charts_list]
+        act_query("DELETE FROM %s.chart_cache WHERE resolution = '%s'" % (database_name, view_name_extension))
+        query = """
+            INSERT INTO ${database_name}.chart_cache
+              (resolution, chart_alias, chart, chart_extended, source_ts)
+            VALUES
+              %s
+            """ % ",\n              ".join(cached_values)
+        query = query.replace("${database_name}", database_name)
+        act_query(query)
+        verbose("%s charts cached" % view_name_extension)
+
+
+def detect_status_variables_hour_aggregation_missing_values():
+    if options.skip_aggregation:
+        return
+    
     query = """
             SELECT 
               DISTINCT CONCAT(DATE(sv_sample.ts) + INTERVAL HOUR(sv_sample.ts) HOUR, '') AS aggregation_timestamp
@@ -4570,108 +6634,904 @@ def detect_status_variables_hour_aggregation_missing_values():
     query = query.replace("${database_name}", database_name)
     rows = get_rows(query, write_conn)
 
-    for row in rows:
-        aggregation_timestamp = row["aggregation_timestamp"]
-        write_status_variables_hour_aggregation(aggregation_timestamp)
+    for row in rows:
+        aggregation_timestamp = row["aggregation_timestamp"]
+        write_status_variables_hour_aggregation(aggregation_timestamp)
+
+
+def detect_status_variables_day_aggregation_missing_values():
+    if options.skip_aggregation:
+        return
+    
+    query = """
+            SELECT 
+              DISTINCT CONCAT(DATE(sv_sample.ts), '') AS aggregation_timestamp
+            FROM 
+              ${database_name}.sv_sample LEFT JOIN ${database_name}.status_variables_aggregated_day ON (DATE(sv_sample.ts) = status_variables_aggregated_day.ts) 
+            WHERE 
+              status_variables_aggregated_day.id IS NULL
+        """
+    query = query.replace("${database_name}", database_name)
+    rows = get_rows(query, write_conn)
+
+    for row in rows:
+        aggregation_timestamp = row["aggregation_timestamp"]
+        write_status_variables_day_aggregation(aggregation_timestamp)
+
+
+def purge_status_variables_partitions(partitions):
+    """
+    Drop daily partitions all of whose rows are older than --purge-days. This is a metadata operation,
+    as opposed to a row by row DELETE.
+    """
+    row = get_row("SELECT CONCAT(NOW() - INTERVAL %d DAY, '') AS purge_ts" % options.purge_days, write_conn)
+    purge_timestamp = datetime.datetime(*time.strptime(row["purge_ts"][0:19], "%Y-%m-%d %H:%M:%S")[0:6])
+
+    expired_partitions = []
+    for partition_name in partitions:
+        partition_date = get_partition_date(partition_name)
+        if partition_date is None:
+            continue
+        partition_end = datetime.datetime(partition_date.year, partition_date.month, partition_date.day) + datetime.timedelta(days=1)
+        if partition_end <= purge_timestamp:
+            expired_partitions.append(partition_name)
+    if not expired_partitions:
+        return 0
+
+    query = """ALTER TABLE %s.%s DROP PARTITION %s""" % (database_name, table_name, ", ".join(expired_partitions))
+    act_query(query)
+    verbose("Old partitions purged: %s" % ", ".join(expired_partitions))
+    return len(expired_partitions)
+
+
+def purge_rows(purged_table_name, key_column, to_key, condition="1"):
+    """
+    Delete rows with key_column <= to_key, satisfying given condition.
+    Unless --purge-chunk-size is 0, rows are deleted in bounded key ranges, pausing between chunks,
+    and stopping when the --purge-time-budget for this run is exhausted. At least one chunk is always deleted.
+    Rows left behind are purged on following runs.
+    """
+    global purge_start_time
+
+    if to_key is None:
+        return 0
+    if purge_start_time is None:
+        purge_start_time = time.time()
+
+    query = """
+      DELETE 
+        FROM ${database_name}.${purged_table_name} 
+      WHERE 
+        ${key_column} >= %d
+        AND ${key_column} <= %d
+        AND ${condition}"""
+    query = query.replace("${database_name}", database_name)
+    query = query.replace("${purged_table_name}", purged_table_name)
+    query = query.replace("${key_column}", key_column)
+    query = query.replace("${condition}", condition)
+
+    if options.purge_chunk_size <= 0:
+        return act_query(query % (0, to_key))
+
+    row = get_row("SELECT MIN(%s) AS min_key FROM %s.%s" % (key_column, database_name, purged_table_name), write_conn)
+    if not row or row["min_key"] is None:
+        return 0
+    from_key = int(row["min_key"])
+
+    start_time = time.time()
+    num_purged_rows = 0
+    num_chunks = 0
+    while from_key <= to_key:
+        chunk_to_key = min(from_key + options.purge_chunk_size - 1, to_key)
+        num_purged_rows += act_query(query % (from_key, chunk_to_key))
+        num_chunks += 1
+        from_key = chunk_to_key + 1
+        if from_key > to_key:
+            break
+        if time.time() - purge_start_time >= options.purge_time_budget:
+            verbose("Purge time budget exhausted; will resume %s purge on next run" % purged_table_name)
+            break
+        if options.purge_chunk_pause_millis > 0:
+            time.sleep(options.purge_chunk_pause_millis / 1000.0)
+    if num_purged_rows:
+        verbose("Purged %d rows from %s in %d chunks, %.2f seconds" % (num_purged_rows, purged_table_name, num_chunks, time.time() - start_time))
+    return num_purged_rows
+
+
+def get_status_variables_min_id():
+    row = get_row("SELECT MIN(id) AS min_id FROM %s.%s" % (database_name, table_name), write_conn)
+    if not row or row["min_id"] is None:
+        return None
+    return int(row["min_id"])
+
+
+def purge_status_variables():
+    global purge_start_time
+
+    disable_bin_log()
+    purge_start_time = None
+
+    if options.partition_status_variables:
+        partitions = get_status_variables_partitions()
+        if partitions:
+            maintain_status_variables_partitions(partitions)
+            return purge_status_variables_partitions(partitions)
+        verbose("%s table is not partitioned; purging rows" % table_name)
+
+    # A fixed point in time, so that all chunks agree on it
+    row = get_row("SELECT CONCAT(NOW() - INTERVAL %d DAY, '') AS purge_ts" % options.purge_days, write_conn)
+    purge_timestamp = row["purge_ts"]
+    query = "SELECT MAX(id) AS max_id FROM %s.%s WHERE ts < '%s'" % (database_name, table_name, purge_timestamp)
+    row = get_row(query, write_conn)
+    if not row or row["max_id"] is None:
+        return 0
+
+    num_affected_rows = purge_rows(table_name, "id", int(row["max_id"]), "ts < '%s'" % purge_timestamp)
+    if num_affected_rows:
+        verbose("Old entries purged")
+    return num_affected_rows
+
+
+def purge_status_variables_diff():
+    """
+    After purging old records from status_variables, matching diff rows must be purged as well.
+    """
+    if not options.materialize_diff:
+        return 0
+
+    disable_bin_log()
+
+    min_id = get_status_variables_min_id()
+    if min_id is None:
+        return 0
+    num_affected_rows = purge_rows("status_variables_diff", "id", min_id - 1)
+    if num_affected_rows:
+        verbose("Old diff entries purged")
+    return num_affected_rows
+
+
+def purge_alert():
+    """
+    Since we support all storage engines, we define no foreign keys.
+    After purging old records from status_variables, alert rows must be purged as well.
+    """
+    disable_bin_log()
+
+    min_id = get_status_variables_min_id()
+    if min_id is None:
+        return 0
+    num_affected_rows = purge_rows("alert", "sv_report_sample_id", min_id - 1)
+    if num_affected_rows:
+        verbose("Old alert entries purged")
+    return num_affected_rows
+
+
+def http_acquire_connection():
+    """
+    Get a write host connection from the HTTP connection pool. Blocks while --http-pool-size connections are in use.
+    Idle connections are checked to be alive before being handed out.
+    """
+    http_pool_semaphore.acquire()
+    try:
+        while True:
+            try:
+                connection, idle_since = http_idle_connections.get_nowait()
+            except Queue.Empty:
+                return open_write_connection()
+            # Only check connections which have been idle for a while
+            if time.time() - idle_since < 30:
+                return connection
+            try:
+                connection.ping()
+                return connection
+            except MySQLdb.Error:
+                verbose("Discarding stale HTTP pool connection")
+                try:
+                    connection.close()
+                except MySQLdb.Error:
+                    pass
+    except:
+        http_pool_semaphore.release()
+        raise
+
+
+def http_release_connection(connection, reusable=True):
+    """
+    Return a connection to the HTTP connection pool. Connections which encountered errors are closed.
+    """
+    try:
+        if reusable:
+            http_idle_connections.put((connection, time.time()))
+        else:
+            try:
+                connection.close()
+            except MySQLdb.Error:
+                pass
+    finally:
+        http_pool_semaphore.release()
+
+
+def http_get_rows(query):
+    connection = http_acquire_connection()
+    reusable = False
+    try:
+        rows = get_rows(query, connection)
+        reusable = True
+        return rows
+    finally:
+        http_release_connection(connection, reusable)
+
+
+def get_databases_metadata_query(schemas):
+    query = " UNION ALL ".join(["""
+        (SELECT database_name, CONCAT_WS(',', revision, last_deploy) AS deploy_version FROM `%s`.metadata LIMIT 1)
+        """ % schema.replace("`", "``") for schema in schemas])
+    return query
+
+
+def detect_mycheckpoint_databases(force_reload=False):
+    """
+    Read the list of mycheckpoint databases: schemas with a metadata table having mycheckpoint's columns,
+    listed by a single information_schema query, then read by batched UNION queries. Should a batch fail
+    (e.g. a schema dropped meanwhile, or an unreadable metadata table), its schemas are read one by one,
+    and failing schemas are skipped.
+    Along with the list, the deploy version of each database is read; cached data which depends on the
+    deployed schema is keyed by it.
+    The list is cached for --http-databases-ttl seconds; it is also periodically refreshed in the background.
+    """
+    global http_known_databases
+    global http_known_databases_deploy_versions
+    global http_known_databases_read_at
+    if http_known_databases and not force_reload:
+        if time.time() - http_known_databases_read_at < options.http_databases_ttl:
+            return
+
+    http_databases_lock.acquire()
+    try:
+        if http_known_databases and not force_reload:
+            # Another thread may have just read the list
+            if time.time() - http_known_databases_read_at < options.http_databases_ttl:
+                return
+        query = """
+            SELECT 
+              TABLE_SCHEMA
+            FROM 
+              information_schema.COLUMNS
+            WHERE 
+              TABLE_NAME = 'metadata'
+              AND COLUMN_NAME IN ('database_name', 'revision', 'mysql_version', 'last_deploy')
+              AND TABLE_SCHEMA NOT IN ('mysql', 'information_schema', 'performance_schema')
+            GROUP BY 
+              TABLE_SCHEMA
+            HAVING 
+              COUNT(*) = 4
+            ORDER BY 
+              TABLE_SCHEMA
+            """
+        schemas = [row["TABLE_SCHEMA"] for row in http_get_rows(query)]
+        rows = []
+        batch_size = 100
+        for batch_start in range(0, len(schemas), batch_size):
+            batch_schemas = schemas[batch_start:batch_start + batch_size]
+            try:
+                rows.extend(http_get_rows(get_databases_metadata_query(batch_schemas)))
+            except MySQLdb.Error:
+                if options.debug:
+                    traceback.print_exc()
+                verbose("Cannot read metadata of %d schemas in batch; reading one by one" % len(batch_schemas))
+                for schema in batch_schemas:
+                    try:
+                        rows.extend(http_get_rows(get_databases_metadata_query([schema])))
+                    except MySQLdb.Error, err:
+                        verbose("Skipping schema %s: %s" % (schema, err))
+        mycheckpoint_databases = [row["database_name"] for row in rows]
+        deploy_versions = dict([(row["database_name"], row["deploy_version"]) for row in rows])
+        verbose("Read %d mycheckpoint databases" % len(mycheckpoint_databases))
+        databases_list_changed = (mycheckpoint_databases != http_known_databases)
+        deploy_versions_changed = (deploy_versions != http_known_databases_deploy_versions)
+        http_known_databases = mycheckpoint_databases
+        http_known_databases_deploy_versions = deploy_versions
+        http_known_databases_read_at = time.time()
+        if databases_list_changed or deploy_versions_changed or force_reload:
+            # Cached pages embed the databases list. Entries of old deploys are keyed by their deploy version,
+            # and so are no longer used; clear them anyway.
+            http_clear_page_cache()
+    finally:
+        http_databases_lock.release()
+
+
+def refresh_mycheckpoint_databases_periodically():
+    """
+    Keep the mycheckpoint databases list fresh, so that requests do not wait on reading it.
+    """
+    while True:
+        time.sleep(options.http_databases_ttl)
+        try:
+            detect_mycheckpoint_databases()
+        except MySQLdb.Error:
+            if options.debug:
+                traceback.print_exc()
+            verbose("Cannot refresh mycheckpoint databases list")
+
+
+def http_get_html_databases_list(http_database_name):
+    databases_links_list = []
+    for database_name in http_known_databases:
+        if database_name == http_database_name:
+            database_link = "<strong>%s</strong>" % database_name
+        else:
+            database_link = """<a href="/%s/">%s</a>""" % (database_name, database_name,)
+        databases_links_list.append(database_link)
+    html_databases_list = " | ".join(databases_links_list)
+    return html_databases_list
+
+
+def http_get_row(query):
+    rows = http_get_rows(query)
+    if not rows:
+        return None
+    return rows[0]
+
+
+def http_clear_page_cache():
+    http_page_cache_lock.acquire()
+    try:
+        http_page_cache.clear()
+        http_static_components.clear()
+        http_api_columns.clear()
+        http_metrics_cache.clear()
+    finally:
+        http_page_cache_lock.release()
+
+
+def http_get_deploy_version(http_database_name):
+    """
+    The deploy version of given database, as read along with the databases list.
+    """
+    return http_known_databases_deploy_versions.get(http_database_name)
+
+
+def http_get_static_components(http_database_name):
+    """
+    Return the html_components of given database, along with their version (revision & build).
+    These only change upon deploy, and are cached by database and deploy version.
+    """
+    cache_key = (http_database_name, http_get_deploy_version(http_database_name))
+    http_page_cache_lock.acquire()
+    try:
+        components = http_static_components.get(cache_key)
+    finally:
+        http_page_cache_lock.release()
+    if components is not None:
+        return components
+
+    query = """
+        SELECT 
+          CONCAT(metadata.revision, '-', metadata.build) AS version,
+          html_components.openark_lchart,
+          html_components.openark_schart,
+          html_components.common_css
+        FROM 
+          ${database_name}.metadata, 
+          ${database_name}.html_components
+        """
+    query = query.replace("${database_name}", http_database_name)
+    row = http_get_row(query)
+    if not row:
+        return None
+    components = {
+        "version": row["version"],
+        "openark_lchart.js": row["openark_lchart"],
+        "openark_schart.js": row["openark_schart"],
+        "common_css.css": row["common_css"],
+        }
+    http_page_cache_lock.acquire()
+    try:
+        http_static_components[cache_key] = components
+    finally:
+        http_page_cache_lock.release()
+    return components
+
+
+def http_externalize_static_components(http_database_name, html):
+    """
+    HTML views inline the openark charting code and common CSS, so that they are self contained
+    (e.g. when emailed or saved to disk). When served over HTTP, these are replaced with references
+    to versioned static URLs, which browsers cache.
+    """
+    components = http_get_static_components(http_database_name)
+    if not components:
+        return html
+    for (component_name, content_type) in [("openark_lchart.js", "js"), ("openark_schart.js", "js"), ("common_css.css", "css")]:
+        component = components[component_name]
+        if not component or component not in html:
+            continue
+        url = "/%s/static/%s/%s" % (http_database_name, components["version"], component_name)
+        if content_type == "js":
+            # Close the inlining <script> element; open one which refers to the static URL
+            reference = """</script><script type="text/javascript" charset="utf-8" src="%s">""" % url
+        else:
+            reference = """</style><link rel="stylesheet" type="text/css" href="%s" /><style type="text/css">""" % url
+        html = html.replace(component, reference)
+    return html
+
+
+def http_get_cached_page(http_database_name, page_name, render_page):
+    """
+    Return a cache entry for the given page: a dict with the page's html, ETag and Last-Modified time.
+    Pages change when a new sample is taken, when the data turns stale (pages mark data older than 1 hour, 2 hours
+    and 1 day), upon deploy, and when the databases list (embedded in pages) changes. The cache, and the ETag,
+    are keyed by all of these. render_page() is called to generate the html when not cached. Least recently used pages are evicted
+    once more than --http-cache-size pages are cached.
+    """
+    global http_page_cache_counter
+
+    query = """
+        SELECT 
+          id_latest, 
+          (ts_latest < NOW() - INTERVAL 1 HOUR) + (ts_latest < NOW() - INTERVAL 2 HOUR) + (ts_latest < NOW() - INTERVAL 1 DAY) AS staleness_level
+        FROM 
+          ${database_name}.sv_latest
+        """
+    query = query.replace("${database_name}", http_database_name)
+    row = http_get_row(query)
+    cache_key = (http_database_name, page_name, row["id_latest"], row["staleness_level"], 
+        http_get_deploy_version(http_database_name), tuple(http_known_databases))
+
+    http_page_cache_lock.acquire()
+    try:
+        http_page_cache_counter += 1
+        cache_entry = http_page_cache.get(cache_key)
+        if cache_entry is not None:
+            cache_entry["last_used"] = http_page_cache_counter
+            return cache_entry
+    finally:
+        http_page_cache_lock.release()
+
+    html = render_page()
+    if not html:
+        return None
+    # Pages also change without a new sample (staleness, deploy, databases list), hence the time of rendering
+    # rather than the latest sample's timestamp.
+    last_modified = time.time()
+    cache_entry = {
+        "html": html,
+        "gzip_html": None,
+        "etag": '"%s"' % md5(repr(cache_key)).hexdigest(),
+        "last_modified": int(last_modified),
+        "last_used": http_page_cache_counter,
+        }
+    if options.http_cache_size <= 0:
+        return cache_entry
+
+    http_page_cache_lock.acquire()
+    try:
+        http_page_cache[cache_key] = cache_entry
+        while len(http_page_cache) > options.http_cache_size:
+            (last_used, least_recently_used_key) = min([(cache_entry["last_used"], cache_key) for (cache_key, cache_entry) in http_page_cache.items()])
+            del http_page_cache[least_recently_used_key]
+    finally:
+        http_page_cache_lock.release()
+    return cache_entry
+
+
+def gzip_content(content):
+    gzip_buffer = StringIO.StringIO()
+    gzip_file = gzip.GzipFile(fileobj=gzip_buffer, mode="wb")
+    gzip_file.write(content)
+    gzip_file.close()
+    return gzip_buffer.getvalue()
+
+
+def http_get_api_columns(http_database_name):
+    """
+    Return a dict mapping the views read by the series API to their (lower case) column names.
+    Cached by database and deploy version.
+    """
+    cache_key = (http_database_name, http_get_deploy_version(http_database_name))
+    http_page_cache_lock.acquire()
+    try:
+        api_columns = http_api_columns.get(cache_key)
+    finally:
+        http_page_cache_lock.release()
+    if api_columns is not None:
+        return api_columns
+
+    view_names = ["sv_%s" % tier for tier in ["sample", "hour", "day"]] + ["sv_report_%s" % tier for tier in ["sample", "hour", "day"]]
+    query = """
+        SELECT 
+          TABLE_NAME, COLUMN_NAME
+        FROM 
+          information_schema.COLUMNS
+        WHERE 
+          TABLE_SCHEMA = '%s'
+          AND TABLE_NAME IN (%s)
+        """ % (http_database_name.replace("'", "''"), ", ".join(["'%s'" % view_name for view_name in view_names]))
+    api_columns = dict([(view_name, set()) for view_name in view_names])
+    for row in http_get_rows(query):
+        api_columns[row["TABLE_NAME"].lower()].add(row["COLUMN_NAME"].lower())
+    http_page_cache_lock.acquire()
+    try:
+        http_api_columns[cache_key] = api_columns
+    finally:
+        http_page_cache_lock.release()
+    return api_columns
+
+
+def http_get_api_timestamp_expression(value):
+    """
+    API timestamps are either unix timestamps or 'YYYY-MM-DD[ HH:MM[:SS]]' strings (in the server's time zone).
+    """
+    value = value.strip()
+    if re.match("^[0-9]+$", value):
+        return "FROM_UNIXTIME(%d)" % int(value)
+    if re.match("^[0-9]{4}-[0-9]{2}-[0-9]{2}([ T][0-9]{2}:[0-9]{2}(:[0-9]{2})?)?$", value):
+        return "'%s'" % value.replace("T", " ")
+    raise ValueError("Invalid timestamp: %s" % value)
+
+
+def http_get_time_range(http_database_name, from_value, to_value, default_range_days):
+    """
+    Return a dict of the requested time range (as server timestamps and as unix timestamps), along with
+    the sampling interval, estimated by the most recent samples. Raises ValueError on invalid input.
+    """
+    if to_value:
+        to_expression = http_get_api_timestamp_expression(to_value)
+    else:
+        to_expression = "NOW()"
+    if from_value:
+        from_expression = http_get_api_timestamp_expression(from_value)
+    else:
+        from_expression = "%s - INTERVAL %d DAY" % (to_expression, default_range_days)
+
+    query = """
+        SELECT
+          CONCAT(${from_expression}, '') AS from_ts,
+          CONCAT(${to_expression}, '') AS to_ts,
+          UNIX_TIMESTAMP(${from_expression}) AS from_unix_ts,
+          UNIX_TIMESTAMP(${to_expression}) AS to_unix_ts,
+          (
+            SELECT 
+              (UNIX_TIMESTAMP(MAX(ts)) - UNIX_TIMESTAMP(MIN(ts))) / NULLIF(COUNT(*) - 1, 0)
+            FROM
+              (SELECT ts FROM ${database_name}.status_variables ORDER BY id DESC LIMIT 10) recent_samples
+          ) AS sample_interval_seconds
+        """
+    query = query.replace("${database_name}", http_database_name)
+    query = query.replace("${from_expression}", from_expression)
+    query = query.replace("${to_expression}", to_expression)
+    row = http_get_row(query)
+    if row["from_ts"] is None or row["to_ts"] is None:
+        raise ValueError("Invalid time range")
+    return {
+        "from_ts": row["from_ts"],
+        "to_ts": row["to_ts"],
+        "from_unix_ts": int(row["from_unix_ts"]),
+        "to_unix_ts": int(row["to_unix_ts"]),
+        "range_seconds": max(0, int(row["to_unix_ts"]) - int(row["from_unix_ts"])),
+        "sample_interval_seconds": float(row["sample_interval_seconds"] or 60) or 60,
+        }
+
 
+def http_get_series_query(http_database_name, metrics, time_range, max_rows):
+    """
+    Return the resolution tier (sample, hour or day) and the query for the given metrics within the given time range.
+    The finest tier which does not exceed max_rows is chosen.
+    Raises ValueError on unknown metrics.
+    """
+    range_seconds = time_range["range_seconds"]
+    if range_seconds / time_range["sample_interval_seconds"] <= max_rows:
+        tier = "sample"
+    elif range_seconds / 3600 <= max_rows:
+        tier = "hour"
+    else:
+        tier = "day"
+
+    api_columns = http_get_api_columns(http_database_name)
+    view_name = None
+    for candidate_view_name in ["sv_report_%s" % tier, "sv_%s" % tier]:
+        if not [metric for metric in metrics if metric not in api_columns[candidate_view_name]]:
+            view_name = candidate_view_name
+            break
+    if view_name is None:
+        known_columns = api_columns["sv_report_%s" % tier] | api_columns["sv_%s" % tier]
+        raise ValueError("Unknown metrics: %s" % ", ".join([metric for metric in metrics if metric not in known_columns]))
 
-def detect_status_variables_day_aggregation_missing_values():
-    if options.skip_aggregation:
-        return
-    
     query = """
-            SELECT 
-              DISTINCT CONCAT(DATE(sv_sample.ts), '') AS aggregation_timestamp
-            FROM 
-              ${database_name}.sv_sample LEFT JOIN ${database_name}.status_variables_aggregated_day ON (DATE(sv_sample.ts) = status_variables_aggregated_day.ts) 
-            WHERE 
-              status_variables_aggregated_day.id IS NULL
-        """
-    query = query.replace("${database_name}", database_name)
-    rows = get_rows(query, write_conn)
+        SELECT
+          CONCAT(ts, '') AS ts,
+          UNIX_TIMESTAMP(ts) AS unix_ts,
+          %s
+        FROM
+          ${database_name}.${view_name}
+        WHERE
+          ts >= '${from_ts}'
+          AND ts <= '${to_ts}'
+        ORDER BY
+          ts
+        """ % ", ".join(metrics)
+    query = query.replace("${database_name}", http_database_name)
+    query = query.replace("${view_name}", view_name)
+    query = query.replace("${from_ts}", time_range["from_ts"])
+    query = query.replace("${to_ts}", time_range["to_ts"])
+    return tier, query
 
-    for row in rows:
-        aggregation_timestamp = row["aggregation_timestamp"]
-        write_status_variables_day_aggregation(aggregation_timestamp)
 
+def http_fetch_series_rows(query):
+    """
+    Read all rows of a series query via server side cursor.
+    """
+    connection = http_acquire_connection()
+    reusable = False
+    try:
+        cursor = connection.cursor(MySQLdb.cursors.SSCursor)
+        cursor.execute(query)
+        rows = []
+        while True:
+            fetched_rows = cursor.fetchmany(1000)
+            if not fetched_rows:
+                break
+            rows.extend(fetched_rows)
+        cursor.close()
+        reusable = True
+        return rows
+    finally:
+        http_release_connection(connection, reusable)
 
-def purge_status_variables():
-    disable_bin_log()
 
-    query = """DELETE FROM %s.%s WHERE ts < NOW() - INTERVAL %d DAY""" % (database_name, table_name, options.purge_days)
-    num_affected_rows = act_query(query)
-    if num_affected_rows:
-        verbose("Old entries purged")
-    return num_affected_rows
+def get_float_value(value):
+    if value is None:
+        return None
+    return float(value)
 
 
-def purge_alert():
+def downsample_lttb(rows, num_points, x_index, y_indexes):
     """
-    Since we support all storage engines, we define no foreign keys.
-    After purging old records from status_variables, alert rows must be purged as well.
+    Largest-Triangle-Three-Buckets downsampling of rows to (at most) num_points rows, keeping first and last rows.
+    x_index is the index of the (numeric) x value in each row; y_indexes are indexes of the series.
+    With multiple series, a row's triangle area is the sum of the series' areas, each normalized by the
+    series' range, so that all series contribute to which rows are kept. NULL values contribute nothing.
     """
-    disable_bin_log()
+    if num_points >= len(rows) or num_points < 3:
+        return rows
+
+    y_scales = []
+    for y_index in y_indexes:
+        y_values = [get_float_value(row[y_index]) for row in rows if row[y_index] is not None]
+        if y_values and max(y_values) > min(y_values):
+            y_scales.append(max(y_values) - min(y_values))
+        else:
+            y_scales.append(1.0)
+
+    def get_point(row):
+        return (float(row[x_index]), [get_float_value(row[y_index]) for y_index in y_indexes])
+
+    sampled_rows = [rows[0]]
+    bucket_size = float(len(rows) - 2) / (num_points - 2)
+    selected_index = 0
+    for bucket in range(num_points - 2):
+        bucket_start = int(bucket * bucket_size) + 1
+        bucket_end = int((bucket + 1) * bucket_size) + 1
+        # Average point of next bucket (or the last row, for the last bucket)
+        next_bucket_start = bucket_end
+        next_bucket_end = min(int((bucket + 2) * bucket_size) + 1, len(rows))
+        if bucket == num_points - 3:
+            next_bucket_start, next_bucket_end = len(rows) - 1, len(rows)
+        next_points = [get_point(row) for row in rows[next_bucket_start:next_bucket_end]]
+        average_x = sum([x for (x, y_values) in next_points]) / len(next_points)
+        average_y_values = []
+        for series_index in range(len(y_indexes)):
+            series_values = [y_values[series_index] for (x, y_values) in next_points if y_values[series_index] is not None]
+            if series_values:
+                average_y_values.append(sum(series_values) / len(series_values))
+            else:
+                average_y_values.append(None)
+
+        (selected_x, selected_y_values) = get_point(rows[selected_index])
+        max_area = -1
+        max_area_index = bucket_start
+        for row_index in range(bucket_start, bucket_end):
+            (x, y_values) = get_point(rows[row_index])
+            area = 0
+            for series_index in range(len(y_indexes)):
+                if None in (selected_y_values[series_index], y_values[series_index], average_y_values[series_index]):
+                    continue
+                area += abs(
+                    (selected_x - average_x) * (y_values[series_index] - selected_y_values[series_index]) -
+                    (selected_x - x) * (average_y_values[series_index] - selected_y_values[series_index])
+                    ) / y_scales[series_index]
+            if area > max_area:
+                max_area = area
+                max_area_index = row_index
+        sampled_rows.append(rows[max_area_index])
+        selected_index = max_area_index
+    sampled_rows.append(rows[-1])
+    return sampled_rows
+
+
+def downsample_minmax(rows, num_points, x_index, y_indexes):
+    """
+    Downsample rows to (at most) num_points rows, keeping first and last rows.
+    Split rows into equal ranges of x; in each, keep the rows holding the minimum and maximum
+    value of each series. Spikes are thus always kept. Each series may keep two rows per range, hence
+    the number of ranges is sized by the number of series. Where num_points cannot hold even a single range,
+    evenly spaced rows are kept instead. Returns rows in original order.
+    """
+    if not rows or len(rows) <= num_points:
+        return rows
+    num_buckets = (num_points - 2) / (2 * max(1, len(y_indexes)))
+    if num_buckets < 1:
+        return [rows[(row_index * (len(rows) - 1)) / max(1, num_points - 1)] for row_index in range(num_points)]
+    min_x = float(rows[0][x_index])
+    max_x = float(rows[-1][x_index])
+    bucket_width = max((max_x - min_x) / num_buckets, 1e-9)
+    kept_indexes = set([0, len(rows) - 1])
+    buckets = {}
+    for (row_index, row) in enumerate(rows):
+        bucket = min(int((float(row[x_index]) - min_x) / bucket_width), num_buckets - 1)
+        bucket_extremes = buckets.setdefault(bucket, {})
+        for y_index in y_indexes:
+            value = row[y_index]
+            if value is None:
+                continue
+            (min_index, max_index) = bucket_extremes.get(y_index, (row_index, row_index))
+            if value < rows[min_index][y_index]:
+                min_index = row_index
+            if value > rows[max_index][y_index]:
+                max_index = row_index
+            bucket_extremes[y_index] = (min_index, max_index)
+    for bucket_extremes in buckets.values():
+        for (min_index, max_index) in bucket_extremes.values():
+            kept_indexes.add(min_index)
+            kept_indexes.add(max_index)
+    return [rows[row_index] for row_index in sorted_list(kept_indexes)]
+
+
+def get_minmax_bucket_series(rows, from_unix_ts, to_unix_ts, num_buckets, x_index, y_indexes):
+    """
+    For each series, return 2*num_buckets values: for each equal length time bucket, its minimum and maximum
+    values, ordered by their occurrence. Values are thus evenly spaced in time, as charts expect,
+    and spikes are kept. Empty buckets are None.
+    """
+    bucket_width = max(float(to_unix_ts - from_unix_ts) / num_buckets, 1e-9)
+    series = [[None] * (2 * num_buckets) for y_index in y_indexes]
+    for series_index in range(len(y_indexes)):
+        y_index = y_indexes[series_index]
+        extremes = {}
+        for row in rows:
+            value = get_float_value(row[y_index])
+            if value is None:
+                continue
+            bucket = int((float(row[x_index]) - from_unix_ts) / bucket_width)
+            if bucket < 0 or bucket >= num_buckets:
+                continue
+            (min_value, min_x, max_value, max_x) = extremes.get(bucket, (value, row[x_index], value, row[x_index]))
+            if value < min_value:
+                (min_value, min_x) = (value, row[x_index])
+            if value > max_value:
+                (max_value, max_x) = (value, row[x_index])
+            extremes[bucket] = (min_value, min_x, max_value, max_x)
+        for (bucket, (min_value, min_x, max_value, max_x)) in extremes.items():
+            if min_x <= max_x:
+                series[series_index][2 * bucket:2 * bucket + 2] = [min_value, max_value]
+            else:
+                series[series_index][2 * bucket:2 * bucket + 2] = [max_value, min_value]
+    return series
 
-    query = """
-      DELETE 
-        FROM ${database_name}.alert 
-      WHERE 
-        sv_report_sample_id < 
-          (SELECT MIN(id) FROM ${database_name}.status_variables)"""
-    query = query.replace("${database_name}", database_name)
-    num_affected_rows = act_query(query)
-    if num_affected_rows:
-        verbose("Old alert entries purged")
-    return num_affected_rows
 
+def json_default(value):
+    """
+    Serialize values json does not handle natively; these are DECIMAL columns.
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise TypeError("%r is not JSON serializable" % (value,))
 
-def detect_mycheckpoint_databases(force_reload=False):
-    global http_known_databases
-    if http_known_databases and not force_reload:
-        return
-    
+
+def json_value(value):
+    return json.dumps(value, default=json_default)
+
+
+def get_metric_type(column_name):
+    """
+    OpenMetrics type of a status_variables column. Values of signed diff status variables go up and down,
+    as do global variables. Other MySQL status variables are counters. OS and custom values may be either.
+    """
+    if column_name in get_global_variables() or is_signed_column(column_name):
+        return "gauge"
+    if column_name.startswith("os_") or column_name.startswith("custom_"):
+        return "unknown"
+    return "counter"
+
+
+def get_metric_value(value):
+    if value is None or isinstance(value, basestring):
+        return None
     try:
-        monitored_connection, write_connection = open_connections()
-        rows = get_rows("SHOW DATABASES", write_connection)
-        known_databases = [row["Database"] for row in rows]
-        mycheckpoint_databases = []
-        for db in known_databases:
-            try:
-                row = get_row("SELECT database_name, revision, mysql_version, last_deploy FROM %s.metadata" % db , write_connection)
-                mycheckpoint_databases.append(row["database_name"])
-            except:
-                # Not a mycheckpoint database
-                pass
-        print "read databases"
-        http_known_databases = mycheckpoint_databases
-    finally:
-        if monitored_connection:
-            monitored_connection.close()
-        if write_connection and write_connection is not monitored_connection:
-            write_connection.close()
+        return float(value)
+    except (TypeError, ValueError):
+        return None
 
-def http_get_html_databases_list(http_database_name):
-    databases_links_list = []
-    for database_name in http_known_databases:
-        if database_name == http_database_name:
-            database_link = "<strong>%s</strong>" % database_name
-        else:
-            database_link = """<a href="/%s/">%s</a>""" % (database_name, database_name,)
-        databases_links_list.append(database_link)
-    html_databases_list = " | ".join(databases_links_list)
-    return html_databases_list
 
+def http_get_metrics_families(http_database_name):
+    """
+    Return the metric families of the latest sample of given database, as a list of (name, type, value, unix timestamp).
+    These are the status_variables columns, and the derived sv_report_sample columns (prefixed by 'report_').
+    Cached by latest sample id and deploy version.
+    """
+    row = http_get_row("SELECT id_latest, UNIX_TIMESTAMP(ts_latest) AS unix_ts_latest FROM %s.sv_latest" % http_database_name)
+    if not row or row["id_latest"] is None:
+        return []
+    http_page_cache_lock.acquire()
+    try:
+        cached_metrics = http_metrics_cache.get(http_database_name)
+    finally:
+        http_page_cache_lock.release()
+    cache_version = (row["id_latest"], http_get_deploy_version(http_database_name))
+    if cached_metrics is not None and cached_metrics[0] == cache_version:
+        return cached_metrics[1]
+
+    unix_ts = int(row["unix_ts_latest"])
+    families = []
+    status_variables_row = http_get_row("SELECT * FROM %s.status_variables WHERE id = %d" % (http_database_name, row["id_latest"]))
+    report_row = http_get_row("SELECT * FROM %s.sv_report_sample WHERE id = %d" % (http_database_name, row["id_latest"]))
+    for (column_names_prefix, source_row) in [("", status_variables_row), ("report_", report_row)]:
+        if not source_row:
+            continue
+        for column_name in sorted_list(source_row.keys()):
+            if column_name.lower() in ["id", "ts", "ts_diff_seconds"]:
+                continue
+            value = get_metric_value(source_row[column_name])
+            if value is None:
+                continue
+            if column_names_prefix:
+                metric_type = "gauge"
+            else:
+                metric_type = get_metric_type(column_name.lower())
+            families.append(("mycheckpoint_%s%s" % (column_names_prefix, column_name.lower()), metric_type, value, unix_ts))
 
-def http_get_row(query):
+    http_page_cache_lock.acquire()
     try:
-        monitored_connection, write_connection = open_connections()
-        row = get_row(query, write_connection)
-        return row
+        http_metrics_cache[http_database_name] = (cache_version, families)
     finally:
-        if monitored_connection:
-            monitored_connection.close()
-        if write_connection and write_connection is not monitored_connection:
-            write_connection.close()
+        http_page_cache_lock.release()
+    return families
+
+
+def get_openmetrics_text(databases_families):
+    """
+    Format metric families of one or more databases (a list of (database name, families)) in OpenMetrics text format.
+    Samples of a family are grouped together, labeled by database. Samples with no unix timestamp are exposed without one.
+    """
+    families_samples = {}
+    families_types = {}
+    for (metrics_database_name, families) in databases_families:
+        database_label = metrics_database_name.replace("\\", "\\\\").replace('"', '\\"')
+        for (name, metric_type, value, unix_ts) in families:
+            families_types.setdefault(name, metric_type)
+            sample_name = name
+            if metric_type == "counter":
+                sample_name = "%s_total" % name
+            sample = '%s{database="%s"} %s' % (sample_name, database_label, repr(value))
+            if unix_ts is not None:
+                sample = "%s %d" % (sample, unix_ts)
+            families_samples.setdefault(name, []).append(sample)
+    lines = []
+    for name in sorted_list(families_samples.keys()):
+        lines.append("# TYPE %s %s" % (name, families_types[name]))
+        lines.extend(families_samples[name])
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def http_get_view_page_html(http_database_name, http_view_name):
+    html, html_query = http_get_view_html(http_database_name, http_view_name)
+    if not html:
+        return html
+    html_embed = http_get_html_embed(http_database_name, http_view_name, html_query)
+    html = http_embed_code(html, '<div class="header">', html_embed)
+    return http_externalize_static_components(http_database_name, html)
 
 
 def http_get_view_html(http_database_name, http_view_name):
@@ -4716,10 +7576,111 @@ def http_embed_code(html, anchor, code):
     return html
 
 
-def http_get_chart_zoom_html(http_database_name, chart_alias):
+def http_get_chart_zoom_downsampled_chart(http_database_name, chart_alias, query_string, chart_width):
+    """
+    Return the (js, div) of a full resolution chart, downsampled in-process to min/max values per
+    (chart pixel pair) time bucket, so that spikes are kept. The time range defaults to the last day,
+    as displayed by the sample chart, and can be set via from= and to= parameters.
+    """
+    chart_definition = get_chart_definition(chart_alias)
+    if chart_definition is None:
+        return "", ""
+    (column_names, scale_from_0, scale_to_100) = chart_definition
+    params = parse_qs(query_string or "")
+    try:
+        time_range = http_get_time_range(http_database_name, params.get("from", [None])[0], params.get("to", [None])[0], 1)
+        tier, query = http_get_series_query(http_database_name, column_names, time_range, options.http_downsample_max_rows)
+    except ValueError:
+        return "", ""
+    rows = http_fetch_series_rows(query)
+    num_buckets = chart_width / 2
+    series = get_minmax_bucket_series(rows, time_range["from_unix_ts"], time_range["to_unix_ts"], num_buckets, 1, range(2, 2 + len(column_names)))
+    chart_title = "%s: %s to %s, by %s (min/max)" % (chart_alias, time_range["from_ts"], time_range["to_ts"], tier)
+    ts_start = datetime.datetime(*time.strptime(time_range["from_ts"], "%Y-%m-%d %H:%M:%S")[0:6])
+    labels = get_range_chart_labels(chart_title, ts_start, time_range["range_seconds"])
+    charts_api = http_get_row("SELECT * FROM %s.charts_api" % http_database_name)
+    # openark_lchart reads the extended (text encoded) URL
+    extended_url = render_chart(column_names, series, scale_from_0, scale_to_100, ts_start, max(1, time_range["range_seconds"] / (2 * num_buckets)), labels, charts_api)[1]
+    js = """
+                new openark_lchart(
+                    document.getElementById("chart_div_%s_downsampled"), 
+                    {width: %d, height: 200}
+                    ).read_google_url("%s");
+        """ % (chart_alias, chart_width, extended_url)
+    div = """
+            <div class="row">
+               <div class="chart_container">
+                    <div class="corner tl"></div><div class="corner tr"></div><div class="corner bl"></div><div class="corner br"></div>
+                    <h3>Full resolution; set time range with <i>?from=...&amp;to=...</i></h3>
+                    <div id="chart_div_%s_downsampled" class="chart"></div>
+                </div>
+                <div class="clear"></div>
+            </div>
+        """ % chart_alias
+    return js, div
+
+
+def http_render_zoom_charts(http_database_name, chart_alias):
+    """
+    Render the sample, hour and day charts of a single chart in-process. Only the chart's columns are read.
+    Returns a dict mapping each resolution to SQL literals of its (URL, extended URL).
+    """
+    chart_definition = get_chart_definition(chart_alias)
+    chart_expressions = {}
+    if chart_definition is not None:
+        (column_names, scale_from_0, scale_to_100) = chart_definition
+        charts_api = http_get_row("SELECT * FROM %s.charts_api" % http_database_name)
+    for view_name_extension in ["sample", "hour", "day"]:
+        charts = {}
+        if chart_definition is not None:
+            rows = http_get_rows(get_chart_rows_query(http_database_name, view_name_extension, column_names))
+            charts = render_charts(view_name_extension, rows, [(", ".join(column_names), chart_alias, scale_from_0, scale_to_100, [])], charts_api)
+        (url, extended_url) = charts.get(chart_alias, (None, None))
+        chart_expressions[view_name_extension] = (sql_string_literal(url), sql_string_literal(extended_url))
+    return chart_expressions
+
+
+def http_query_zoom_charts(http_database_name, chart_alias):
+    """
+    Compute the sample, hour and day charts of a single chart via SQL, reading only the chart's columns.
+    Returns a dict mapping each resolution to SQL literals of its (URL, extended URL).
+    """
+    chart_definition = get_chart_definition(chart_alias)
+    chart_expressions = {}
+    for view_name_extension in ["sample", "hour", "day"]:
+        row = None
+        if chart_definition is not None:
+            (column_names, scale_from_0, scale_to_100) = chart_definition
+            query = get_report_chart_query(view_name_extension, ", ".join(column_names), chart_alias, scale_from_0, scale_to_100)
+            query = query.replace("${database_name}", http_database_name)
+            row = http_get_row(query)
+        if row:
+            chart_expressions[view_name_extension] = (sql_string_literal(row[chart_alias]), sql_string_literal(row["%s_extended" % chart_alias]))
+        else:
+            chart_expressions[view_name_extension] = ("NULL", "NULL")
+    return chart_expressions
+
+
+def http_get_chart_zoom_html(http_database_name, chart_alias, query_string=None):
     """
     This HTML page is dynamically generated by the http server. There is no supporting view here.
+    Charts are rendered in-process with --http-python-charts, and read from the sv_report_chart_* views 
+    with --chart-cache. Otherwise only the requested chart is computed.
     """
+    charts_tables = ""
+    if options.http_python_charts:
+        chart_expressions = http_render_zoom_charts(http_database_name, chart_alias)
+    elif not options.chart_cache:
+        chart_expressions = http_query_zoom_charts(http_database_name, chart_alias)
+    else:
+        charts_tables = """
+        ${database_name}.sv_report_chart_sample, 
+        ${database_name}.sv_report_chart_hour, 
+        ${database_name}.sv_report_chart_day, """
+        chart_expressions = dict([(view_name_extension, (
+            "sv_report_chart_%s.%s" % (view_name_extension, chart_alias),
+            "sv_report_chart_%s.%s_extended" % (view_name_extension, chart_alias),
+            )) for view_name_extension in ["sample", "hour", "day"]])
     js_queries = []
     div_queries = []
     for view_name_extension in ["sample", "hour", "day"]:
@@ -4728,23 +7689,25 @@ def http_get_chart_zoom_html(http_database_name, chart_alias):
                 new openark_lchart(
                     document.getElementById("chart_div_${chart_alias}_${view_name_extension}"), 
                     {width: ${chart_width}, height: ${chart_height}, squareLines: true}
-                    ).read_google_url("', sv_report_chart_${view_name_extension}.${chart_alias}_extended, '");
+                    ).read_google_url("', ${chart_extended_expression}, '");
                 '),
             '')
         """ 
         js_query = js_query.replace("${view_name_extension}", view_name_extension)
+        js_query = js_query.replace("${chart_extended_expression}", chart_expressions[view_name_extension][1])
         js_queries.append(js_query)
         div_query = """'
             <div class="row">
                <div class="chart_container">
                     <div class="corner tl"></div><div class="corner tr"></div><div class="corner bl"></div><div class="corner br"></div>
-                    <h3>', IFNULL(CONCAT('<a href="', sv_report_chart_${view_name_extension}.${chart_alias}, '">[url]</a>'), 'N/A'), '</h3>
+                    <h3>', IFNULL(CONCAT('<a href="', ${chart_expression}, '">[url]</a>'), 'N/A'), '</h3>
                     <div id="chart_div_${chart_alias}_${view_name_extension}" class="chart"></div>
                 </div>
                 <div class="clear"></div>
             </div>'
             """
         div_query = div_query.replace("${view_name_extension}", view_name_extension)
+        div_query = div_query.replace("${chart_expression}", chart_expressions[view_name_extension][0])
         div_queries.append(div_query)
 
     query = """
@@ -4809,14 +7772,11 @@ def http_get_chart_zoom_html(http_database_name, chart_alias):
             </body>
         </html>
       ') AS html
-      FROM
-        ${database_name}.sv_report_chart_sample, 
-        ${database_name}.sv_report_chart_hour, 
-        ${database_name}.sv_report_chart_day, 
+      FROM%s
         ${database_name}.metadata, 
         ${database_name}.charts_api,
         ${database_name}.html_components
-      """ % (",".join(js_queries), "".join(div_queries))
+      """ % (",".join(js_queries), "".join(div_queries), charts_tables)
     query = query.replace("${database_name}", http_database_name)
     query = query.replace("${chart_alias}", chart_alias)
     query = query.replace("${chart_width}", "800")
@@ -4825,7 +7785,10 @@ def http_get_chart_zoom_html(http_database_name, chart_alias):
     html = http_get_row(query)["html"]
     html_embed = http_get_html_embed(http_database_name, None, None)
     html = http_embed_code(html, '<div class="header">', html_embed)
-    return html
+    downsampled_chart_js, downsampled_chart_div = http_get_chart_zoom_downsampled_chart(http_database_name, chart_alias, query_string, 800)
+    html = http_embed_code(html, "window.onload = function () {", downsampled_chart_js)
+    html = http_embed_code(html, "<h2>%s</h2>" % chart_alias, downsampled_chart_div)
+    return http_externalize_static_components(http_database_name, html)
 
 
 def http_get_no_database_selected_html():
@@ -4872,23 +7835,220 @@ def http_get_no_database_selected_html():
         """ % (http_get_html_databases_list(""))
     query = query.replace("${database_name}", database_name)
     html = http_get_row(query)["html"]
-    return html
+    return http_externalize_static_components(database_name, html)
 
 
 class MCPHttpHandler(BaseHTTPRequestHandler):
-    def serve_content(self, content):
+    def serve_content(self, content, cache_entry=None):
         content = content.replace("<!--mcp_http", "")
         content = content.replace("mcp_http-->", "")
+        gzip_accepted = "gzip" in (self.headers.get("Accept-Encoding") or "")
+        if gzip_accepted:
+            if cache_entry is None:
+                content = gzip_content(content)
+            else:
+                if cache_entry["gzip_html"] is None:
+                    cache_entry["gzip_html"] = gzip_content(content)
+                content = cache_entry["gzip_html"]
         self.send_response(200)
         self.send_header("Content-type", "text/html")
+        if gzip_accepted:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Vary", "Accept-Encoding")
+        self.send_header("Content-Length", str(len(content)))
+        if cache_entry is not None:
+            self.send_header("ETag", cache_entry["etag"])
+            self.send_header("Last-Modified", self.date_time_string(cache_entry["last_modified"]))
+            # Have browsers revalidate, so that new samples show up
+            self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(content)
+
+    def serve_static_component(self, http_database_name, version, component_name):
+        components = http_get_static_components(http_database_name)
+        if not components or not components.get(component_name):
+            self.send_error(404, "Page Not Found: %s" % self.path)
+            return
+        etag = '"%s"' % md5("%s/%s" % (components["version"], component_name)).hexdigest()
+        if etag in [requested_etag.strip() for requested_etag in (self.headers.get("If-None-Match") or "").split(",")]:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        content = components[component_name]
+        gzip_accepted = "gzip" in (self.headers.get("Accept-Encoding") or "")
+        if gzip_accepted:
+            gzip_component_name = "%s.gz" % component_name
+            if gzip_component_name not in components:
+                components[gzip_component_name] = gzip_content(content)
+            content = components[gzip_component_name]
+        self.send_response(200)
+        if component_name.endswith(".css"):
+            self.send_header("Content-type", "text/css")
+        else:
+            self.send_header("Content-type", "application/javascript")
+        if gzip_accepted:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Vary", "Accept-Encoding")
+        self.send_header("Content-Length", str(len(content)))
+        self.send_header("ETag", etag)
+        if version == components["version"]:
+            # Versioned URL: content never changes
+            self.send_header("Cache-Control", "public, max-age=31536000")
+        else:
+            self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(content)
+
+    def serve_api_series(self, http_database_name, query_string):
+        """
+        /<db>/api/series?metrics=a,b[&from=...][&to=...][&points=N]
+        Stream the requested metrics as JSON; rows are read via server side cursor.
+        """
+        if json is None:
+            self.send_error(501, "JSON API requires the json or simplejson module")
+            return
+        params = parse_qs(query_string or "")
+        metrics = [metric.strip().lower() for metric in ",".join(params.get("metrics", [])).split(",") if metric.strip()]
+        try:
+            if not metrics:
+                raise ValueError("No metrics requested")
+            for metric in metrics:
+                if not re.match("^[a-z0-9_]+$", metric):
+                    raise ValueError("Invalid metric: %s" % metric)
+            points = int(params.get("points", ["500"])[0])
+            if points < 1:
+                raise ValueError("points must be at least 1")
+            downsample = params.get("downsample", ["none"])[0]
+            if downsample not in ["none", "lttb", "minmax"]:
+                raise ValueError("downsample must be one of: none, lttb, minmax")
+            time_range = http_get_time_range(http_database_name, params.get("from", [None])[0], params.get("to", [None])[0], 1)
+            if downsample == "none":
+                max_rows = points
+            else:
+                # Read at finest resolution possible; reduce to requested points in-process
+                max_rows = max(points, options.http_downsample_max_rows)
+            tier, query = http_get_series_query(http_database_name, metrics, time_range, max_rows)
+        except ValueError, err:
+            self.send_error(400, str(err))
+            return
+
+        def format_rows(rows):
+            # Drop the unix timestamp column, used for downsampling only
+            return ",\n".join([json_value(list(row[0:1]) + list(row[2:])) for row in rows])
+
+        response_prefix = '{"database": %s, "tier": %s, "downsample": %s, "from": %s, "to": %s, "metrics": [%s], "points": [' % (
+            json_value(http_database_name), json_value(tier), json_value(downsample), json_value(time_range["from_ts"]), json_value(time_range["to_ts"]), 
+            ", ".join([json_value(metric) for metric in ["ts"] + metrics]))
+        y_indexes = range(2, 2 + len(metrics))
+        if downsample != "none":
+            rows = http_fetch_series_rows(query)
+            if downsample == "lttb":
+                rows = downsample_lttb(rows, points, 1, y_indexes)
+            else:
+                rows = downsample_minmax(rows, points, 1, y_indexes)
+            self.send_response(200)
+            self.send_header("Content-type", "application/json")
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            self.wfile.write("%s\n%s\n]}\n" % (response_prefix, format_rows(rows)))
+            return
+
+        connection = http_acquire_connection()
+        reusable = False
+        try:
+            cursor = connection.cursor(MySQLdb.cursors.SSCursor)
+            cursor.execute(query)
+            self.send_response(200)
+            self.send_header("Content-type", "application/json")
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            self.wfile.write(response_prefix)
+            separator = "\n"
+            while True:
+                rows = cursor.fetchmany(1000)
+                if not rows:
+                    break
+                self.wfile.write(separator + format_rows(rows))
+                separator = ",\n"
+            self.wfile.write("\n]}\n")
+            cursor.close()
+            reusable = True
+        finally:
+            http_release_connection(connection, reusable)
+
+    def serve_metrics(self, http_database_names):
+        """
+        /metrics, /<db>/metrics: the latest sample in OpenMetrics text format.
+        A database which cannot be read is skipped; the mycheckpoint_up gauge tells whether each database was read.
+        """
+        databases_families = []
+        for http_database_name in http_database_names:
+            try:
+                families = [("mycheckpoint_up", "gauge", 1.0, None)] + http_get_metrics_families(http_database_name)
+            except Exception, err:
+                print_error("Cannot read metrics of %s: %s" % (http_database_name, err))
+                if options.debug:
+                    traceback.print_exc()
+                families = [("mycheckpoint_up", "gauge", 0.0, None)]
+            databases_families.append((http_database_name, families))
+        content = get_openmetrics_text(databases_families)
+        self.send_response(200)
+        self.send_header("Content-type", "application/openmetrics-text; version=1.0.0; charset=utf-8")
+        self.send_header("Content-Length", str(len(content)))
         self.end_headers()
         self.wfile.write(content)
+
+    def is_not_modified(self, cache_entry):
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match:
+            etags = [etag.strip() for etag in if_none_match.split(",")]
+            return cache_entry["etag"] in etags or "*" in etags
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since:
+            return if_modified_since.strip() == self.date_time_string(cache_entry["last_modified"])
+        return False
+
+    def serve_cache_entry(self, cache_entry):
+        if self.is_not_modified(cache_entry):
+            self.send_response(304)
+            self.send_header("ETag", cache_entry["etag"])
+            self.send_header("Last-Modified", self.date_time_string(cache_entry["last_modified"]))
+            self.end_headers()
+            return
+        self.serve_content(cache_entry["html"], cache_entry)
         
     def do_GET(self):
         try:
+            static_component_match = re.match("^/([^/]+)/static/([^/]+)/(openark_lchart[.]js|openark_schart[.]js|common_css[.]css)$", self.path)
+            if static_component_match:
+                if static_component_match.group(1) in http_known_databases:
+                    self.serve_static_component(static_component_match.group(1), static_component_match.group(2), static_component_match.group(3))
+                else:
+                    self.send_error(404, "Page Not Found: %s" % self.path)
+                return
+            api_series_match = re.match("^/([^/?]+)/api/series(?:[?](.*))?$", self.path)
+            if api_series_match:
+                if api_series_match.group(1) in http_known_databases:
+                    self.serve_api_series(api_series_match.group(1), api_series_match.group(2))
+                else:
+                    self.send_error(404, "Page Not Found: %s" % self.path)
+                return
+
+            if self.path == "/metrics":
+                self.serve_metrics(http_known_databases)
+                return
+            metrics_match = re.match("^/([^/]+)/metrics$", self.path)
+            if metrics_match:
+                if metrics_match.group(1) in http_known_databases:
+                    self.serve_metrics([metrics_match.group(1)])
+                else:
+                    self.send_error(404, "Page Not Found: %s" % self.path)
+                return
+
             database_match = re.match("^/([^/]+)[/]?$", self.path)
             database_view_match = re.match("^/([^/]+)/([^/]+)[/]?$", self.path)
-            chart_zoom_match = re.match("^/([^/]+)/zoom/([^/]+)[/]?$", self.path)
+            chart_zoom_match = re.match("^/([^/]+)/zoom/([^/?]+)[/]?(?:[?](.*))?$", self.path)
             http_view_name = None
             if database_match:
                 http_database_name = database_match.group(1)
@@ -4900,18 +8060,26 @@ class MCPHttpHandler(BaseHTTPRequestHandler):
                 http_database_name = chart_zoom_match.group(1)
                 
             html = None
+            cache_entry = None
             if self.path == "/refresh-databases-list":
                 detect_mycheckpoint_databases(True)
                 
             if database_match or database_view_match:
                 if http_database_name in http_known_databases:
-                    html, html_query = http_get_view_html(http_database_name, http_view_name)
-                    html_embed = http_get_html_embed(http_database_name, http_view_name, html_query)
-                    html = http_embed_code(html, '<div class="header">', html_embed)
+                    cache_entry = http_get_cached_page(http_database_name, http_view_name, 
+                        lambda: http_get_view_page_html(http_database_name, http_view_name))
             elif chart_zoom_match:
                 chart_alias = chart_zoom_match.group(2)
-                html = http_get_chart_zoom_html(http_database_name, chart_alias)
-
+                zoom_query_string = chart_zoom_match.group(3)
+                if http_database_name in http_known_databases:
+                    cache_entry = http_get_cached_page(http_database_name, "zoom/%s?%s" % (chart_alias, zoom_query_string), 
+                        lambda: http_get_chart_zoom_html(http_database_name, chart_alias, zoom_query_string))
+                else:
+                    html = http_get_chart_zoom_html(http_database_name, chart_alias)
+
+            if cache_entry is not None:
+                self.serve_cache_entry(cache_entry)
+                return
             if not html:
                 html = http_get_no_database_selected_html()
             # html must be applied at this point
@@ -4920,33 +8088,62 @@ class MCPHttpHandler(BaseHTTPRequestHandler):
             self.send_error(404, "Page Not Found: %s" % self.path)
      
 
+class MCPThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """
+    Serve each request in its own thread. Database access is bounded by the HTTP connection pool.
+    """
+    daemon_threads = True
+
+
 def serve_http():
+    global http_pool_semaphore
+    global http_idle_connections
+
     if options.run_as_service and not options.allow_http_as_service:
         verbose("Running as a service, but --allow_http_as_service not provided. Skipping HTTP")
         return
     
+    http_pool_semaphore = threading.BoundedSemaphore(options.http_pool_size)
+    http_idle_connections = Queue.Queue()
     try:
         detect_mycheckpoint_databases()
-        http_server = HTTPServer(('', options.http_port), MCPHttpHandler)
+        databases_refresh_thread = threading.Thread(target=refresh_mycheckpoint_databases_periodically)
+        databases_refresh_thread.setDaemon(True)
+        databases_refresh_thread.start()
+        http_server = MCPThreadingHTTPServer(('', options.http_port), MCPHttpHandler)
         print "started httpserver on port %d..." % options.http_port
         http_server.serve_forever()
     except KeyboardInterrupt:
         print "SIGTERM/^C received, shutting down server"
         http_server.socket.close()
+    while True:
+        try:
+            connection, _idle_since = http_idle_connections.get_nowait()
+        except Queue.Empty:
+            break
+        try:
+            connection.close()
+        except MySQLdb.Error:
+            pass
     
 
 def deploy_schema():
     create_metadata_table()
     create_numbers_table()
     create_charts_api_table()
+    create_chart_cache_table()
     create_html_components_table()
     create_custom_query_table()
+    create_custom_query_cache_table()
     create_custom_query_view()
     if not create_status_variables_table():
         upgrade_status_variables_table()
+        partition_status_variables_table()
     create_alert_condition_table()
     create_alert_table()
     create_alert_pending_table()
+    create_alert_condition_window_value_table()
+    create_alert_email_outbox_table()
     create_status_variables_views_and_aggregations()
     # Some of the following depend on sv_report_chart_sample
     create_alert_view()
@@ -4958,6 +8155,325 @@ def deploy_schema():
     verbose("Table and views deployed")
 
 
+def deploy_schema_and_aggregations():
+    deploy_schema()
+    # Aggregations read from sv_sample, which may depend on materialized diffs
+    detect_status_variables_diff_missing_values()
+    detect_status_variables_hour_aggregation_missing_values()
+    detect_status_variables_day_aggregation_missing_values()
+    refresh_chart_cache()
+
+
+def collect_checkpoint():
+    """
+    Take a single sample: collect (including custom queries), aggregate and check for alerts, then purge.
+    The sample, its diff and aggregations are written in a single transaction. Chart cache refresh and
+    alerts checking follow, each in its own transaction: should either fail, the error is reported,
+    and the sample is kept. Purging commits per chunk.
+    """
+    begin_write_transaction()
+    try:
+        collect_status_variables()
+        write_status_variables_diff()
+        write_status_variables_aggregations()
+        commit_write_transaction()
+    except:
+        rollback_write_transaction()
+        raise
+    for (sample_task_name, sample_task) in [("refresh chart cache", refresh_chart_cache), ("check alerts", check_alerts)]:
+        begin_write_transaction()
+        try:
+            sample_task()
+            commit_write_transaction()
+        except (Exception, SystemExit), err:
+            rollback_write_transaction()
+            if options.debug:
+                traceback.print_exc()
+            print_error("Failed to %s: %s" % (sample_task_name, err))
+    if purge_status_variables():
+        purge_status_variables_diff()
+        purge_alert()
+        purge_alert_email_outbox()
+    verbose("Status variables checkpoint complete")
+
+
+def reset_sample_state():
+    """
+    Forget the previously collected sample, so that a long running process can take a fresh one.
+    """
+    global status_variables_insert_id
+    global status_variables_insert_timestamp
+
+    status_dict.clear()
+    extra_dict.clear()
+    status_variables_insert_id = None
+    status_variables_insert_timestamp = None
+
+
+def reset_deploy_state():
+    """
+    Forget cached custom queries listing and report columns. These are re-read upon (re)deploy.
+    """
+    global custom_query_ids
+    global custom_query_ids_charts_enabled
+    global custom_chart_names
+    global previous_sample
+
+    custom_query_ids = None
+    custom_query_ids_charts_enabled = None
+    custom_chart_names = None
+    previous_sample = None
+    del report_columns[:]
+
+
+def get_deploy_signature():
+    """
+    A cheap, single round trip indication of the deployed schema. When the signature changes
+    (a deploy has been made, or custom queries have been modified), deploy must be re-checked.
+    """
+    query = """
+        SELECT
+          CONCAT_WS(',', revision, build, last_deploy, last_deploy_successful, deploy_options, custom_queries,
+            (
+              SELECT
+                IFNULL(
+                  GROUP_CONCAT(
+                    CONCAT(custom_query_id, ':', chart_type)
+                    ORDER BY chart_order, custom_query_id SEPARATOR ','
+                  )
+                  , '')
+              FROM
+                ${database_name}.custom_query
+            )
+          ) AS deploy_signature
+        FROM
+          ${database_name}.metadata
+        """
+    query = query.replace("${database_name}", database_name)
+    try:
+        row = get_row(query, write_conn)
+    except MySQLdb.Error:
+        return None
+    if not row:
+        return None
+    return row["deploy_signature"]
+
+
+def close_connections():
+    global monitored_conn
+    global write_conn
+
+    close_custom_query_connections()
+    try:
+        if monitored_conn:
+            monitored_conn.close()
+        if write_conn and write_conn is not monitored_conn:
+            write_conn.close()
+    except MySQLdb.Error:
+        pass
+    monitored_conn = None
+    write_conn = None
+
+
+def reconnect():
+    global monitored_conn
+    global write_conn
+    global server_clock
+
+    close_connections()
+    server_clock = None
+    monitored_conn, write_conn = open_connections()
+    init_connections()
+    verbose("Connections reopened")
+
+
+def run_daemon():
+    """
+    Keep connections open and take a sample every --daemon-interval seconds.
+    Deploy is only re-checked when the deploy signature changes, or after reconnecting.
+    Upon error, connections are closed and reopened, with exponential backoff.
+    """
+    interval = options.daemon_interval
+    backoff = interval
+    deploy_signature = get_deploy_signature()
+    connected = True
+    outage_notified = False
+    verbose("Running as collector daemon; sampling every %d seconds" % interval, True)
+    email_sender_thread = threading.Thread(target=send_queued_emails_periodically)
+    email_sender_thread.setDaemon(True)
+    email_sender_thread.start()
+    try:
+        while True:
+            cycle_start_time = time.time()
+            try:
+                if not connected:
+                    reconnect()
+                    connected = True
+                    deploy_signature = None
+                current_deploy_signature = get_deploy_signature()
+                if current_deploy_signature is None or current_deploy_signature != deploy_signature:
+                    reset_deploy_state()
+                    reset_sample_state()
+                    if not is_same_deploy():
+                        verbose("Non matching deployed revision. Will auto-deploy")
+                        deploy_schema_and_aggregations()
+                    current_deploy_signature = get_deploy_signature()
+                deploy_signature = current_deploy_signature
+
+                reset_sample_state()
+                collect_checkpoint()
+                backoff = interval
+                outage_notified = False
+            except KeyboardInterrupt:
+                raise
+            except (Exception, SystemExit), err:
+                if isinstance(err, SystemExit):
+                    # Raised by exit_with_error(), which has already reported the error. Retry rather than exit.
+                    print_error("Daemon cycle aborted")
+                else:
+                    print_error("Daemon cycle failed: %s" % err)
+                if options.debug:
+                    traceback.print_exc()
+                if not connected and not outage_notified:
+                    # Reconnecting has failed
+                    email_cannot_access_database_message()
+                    outage_notified = True
+                connected = False
+                close_connections()
+                verbose("Will reconnect in %d seconds" % backoff)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, max(options.daemon_max_backoff, interval))
+                continue
+
+            elapsed_seconds = time.time() - cycle_start_time
+            if elapsed_seconds < interval:
+                time.sleep(interval - elapsed_seconds)
+    except KeyboardInterrupt:
+        print "SIGTERM/^C received, shutting down daemon"
+
+
+def read_hosts_file():
+    """
+    Read the --hosts-file. Each section describes a single monitored host, listing mycheckpoint options
+    (e.g. monitored_host, monitored_port, database) which override the general options for that host.
+    Flags (e.g. skip_alerts) take boolean values: 1/0, yes/no, true/false, on/off.
+    Returns a list of (host_name, host_options) tuples, in file order.
+    """
+    if not options.hosts_file:
+        exit_with_error("collect_hosts requires --hosts-file")
+    if not os.path.exists(options.hosts_file):
+        exit_with_error("Cannot find hosts file: %s" % options.hosts_file)
+    config = ConfigParser.ConfigParser()
+    config.read([options.hosts_file])
+
+    hosts = []
+    for section in config.sections():
+        host_options = {}
+        for option_dest in config.options(section):
+            if not options.__dict__.has_key(option_dest):
+                exit_with_error("Unknown option in hosts file, section [%s]: %s" % (section, option_dest))
+            try:
+                if option_types[option_dest] == "bool":
+                    option_value = config.getboolean(section, option_dest)
+                elif option_types[option_dest] == "int":
+                    option_value = config.getint(section, option_dest)
+                else:
+                    option_value = config.get(section, option_dest)
+            except ValueError:
+                exit_with_error("Invalid value in hosts file, section [%s]: %s = %s" % (section, option_dest, config.get(section, option_dest)))
+            host_options[option_dest] = option_value
+        if not host_options.get("monitored_host"):
+            host_options["monitored_host"] = section
+        if not host_options.get("database"):
+            exit_with_error("No database specified for host [%s] in hosts file" % section)
+        hosts.append((section, host_options))
+    return hosts
+
+
+def collect_host(host_entry):
+    """
+    Deploy (if needed) and take a single sample of one monitored host into its own database.
+    This runs in a worker process: module-level state (connections, status_dict, custom queries listing etc.)
+    is per-process, and is reset here to the given host's context.
+    """
+    global options
+    global database_name
+    global monitored_conn
+    global write_conn
+
+    host_name, host_options = host_entry
+    # Connections inherited from the parent process belong to the parent; do not close them.
+    monitored_conn = None
+    write_conn = None
+    options = copy.copy(base_options)
+    options.__dict__.update(host_options)
+    database_name = options.database
+    reset_deploy_state()
+    reset_sample_state()
+
+    start_time = time.time()
+    try:
+        try:
+            monitored_conn, write_conn = open_connections()
+            init_connections()
+            if not is_same_deploy():
+                verbose("%s: non matching deployed revision. Will auto-deploy" % host_name)
+                deploy_schema_and_aggregations()
+            collect_checkpoint()
+            if options.inline_emails:
+                send_queued_emails()
+            return (host_name, True, time.time() - start_time)
+        except SystemExit:
+            # exit_with_error() has already reported the error. A SystemExit escaping a pool worker
+            # would make pool.map() wait forever.
+            print_error("%s: aborted" % host_name)
+            return (host_name, False, time.time() - start_time)
+        except Exception, err:
+            print_error("%s: %s" % (host_name, err))
+            if options.debug:
+                traceback.print_exc()
+            return (host_name, False, time.time() - start_time)
+    finally:
+        close_connections()
+
+
+def collect_hosts():
+    """
+    Take a sample of all hosts listed in --hosts-file, using a bounded pool of worker processes.
+    """
+    global base_options
+
+    try:
+        import multiprocessing
+    except ImportError:
+        exit_with_error("collect_hosts requires the multiprocessing module (python 2.6 and above)")
+
+    hosts = read_hosts_file()
+    if not hosts:
+        verbose("No hosts listed in %s" % options.hosts_file)
+        return True
+
+    base_options = copy.copy(options)
+    num_workers = max(1, min(options.hosts_concurrency, len(hosts)))
+    verbose("Collecting %d hosts using %d workers" % (len(hosts), num_workers))
+    start_time = time.time()
+    pool = multiprocessing.Pool(processes=num_workers)
+    try:
+        results = pool.map(collect_host, hosts, 1)
+    finally:
+        pool.close()
+        pool.join()
+
+    failed_hosts = [host_name for (host_name, success, _elapsed_seconds) in results if not success]
+    for (host_name, success, elapsed_seconds) in results:
+        verbose("%s: %s in %.2f seconds" % (host_name, success and "collected" or "failed", elapsed_seconds))
+    verbose("Collected %d of %d hosts in %.2f seconds" % (len(hosts) - len(failed_hosts), len(hosts), time.time() - start_time))
+    if failed_hosts:
+        print_error("Failed collecting hosts: %s" % ", ".join(failed_hosts))
+        return False
+    return True
+
+
 def verify_single_instance():
     global fh
     fh = open(os.path.realpath(__file__), 'r')
@@ -5009,11 +8525,28 @@ try:
         custom_query_ids_charts_enabled = None
         custom_chart_names = None
         http_known_databases = []
+        http_known_databases_deploy_versions = {}
+        http_known_databases_read_at = 0
+        http_databases_lock = threading.Lock()
         status_variables_insert_id = None
         status_variables_insert_timestamp = None
+        previous_sample = None
+        purge_start_time = None
+        write_transaction_active = False
+        server_clock = None
+        custom_query_connections = []
         options.chart_width = max(options.chart_width, 150)
         options.chart_height = max(options.chart_height, 100)
         http_server = None
+        http_pool_semaphore = None
+        http_idle_connections = None
+        http_page_cache = {}
+        http_page_cache_lock = threading.Lock()
+        http_page_cache_counter = 0
+        http_static_components = {}
+        http_api_columns = {}
+        http_metrics_cache = {}
+        base_options = None
 
         if options.single:
             verify_single_instance()
@@ -5023,6 +8556,26 @@ try:
             exit_with_error("No database specified. Specify with -d or --database")
         if options.purge_days < 1:
             exit_with_error("purge-days must be at least 1")
+        if options.daemon_interval < 1:
+            exit_with_error("daemon-interval must be at least 1")
+        if options.partition_days_ahead < 1:
+            exit_with_error("partition-days-ahead must be at least 1")
+        if options.http_pool_size < 1:
+            exit_with_error("http-pool-size must be at least 1")
+        if options.http_databases_ttl < 1:
+            exit_with_error("http-databases-ttl must be at least 1")
+        if options.backtest_days < 1:
+            exit_with_error("backtest-days must be at least 1")
+        if options.backtest_resolution not in ["sample", "hour", "day"]:
+            exit_with_error("backtest-resolution must be one of: sample, hour, day")
+        if options.smtp_timeout < 1:
+            exit_with_error("smtp-timeout must be at least 1")
+        if options.email_max_attempts < 1:
+            exit_with_error("email-max-attempts must be at least 1")
+        if options.custom_query_concurrency < 1:
+            exit_with_error("custom-query-concurrency must be at least 1")
+        if options.custom_query_timeout < 1:
+            exit_with_error("custom-query-timeout must be at least 1")
         verbose("database is %s" % database_name)
         
         # Read arguments
@@ -5030,6 +8583,10 @@ try:
         should_email_brief_report = False
         should_email_alert_pending_report = False
         should_serve_http = False
+        should_run_daemon = False
+        should_collect_hosts = False
+        should_backtest = False
+        should_send_emails = False
         for arg in args:
             if arg == "deploy":
                 verbose("Deploy requested. Will deploy")
@@ -5040,9 +8597,25 @@ try:
                 should_email_alert_pending_report = True
             elif arg == "http":
                 should_serve_http = True
+            elif arg == "daemon":
+                should_run_daemon = True
+            elif arg == "collect_hosts":
+                should_collect_hosts = True
+            elif arg == "backtest":
+                should_backtest = True
+            elif arg == "send_emails":
+                should_send_emails = True
             else:
                 exit_with_error("Unknown command: %s" % arg)
 
+        if should_collect_hosts:
+            if len(args) > 1:
+                exit_with_error("collect_hosts cannot be combined with other commands")
+            # Each host is collected by a worker process, using its own connections and database
+            if not collect_hosts():
+                sys.exit(1)
+            sys.exit(0)
+
         # Open connections. From this point and on, database access is possible
         monitored_conn, write_conn = open_connections()
         init_connections()
@@ -5053,21 +8626,14 @@ try:
                 should_deploy = True
 
         if should_deploy:
-            deploy_schema()
-            detect_status_variables_hour_aggregation_missing_values()
-            detect_status_variables_day_aggregation_missing_values()
+            deploy_schema_and_aggregations()
             should_deploy = False
             
         # Only take record if no arguments provided (no "command")
         if not args:
-            collect_status_variables()
-            if purge_status_variables():
-                purge_alert()
-            collect_custom_data()
-            write_status_variables_hour_aggregation(status_variables_insert_timestamp)
-            write_status_variables_day_aggregation(status_variables_insert_timestamp)
-            check_alerts()
-            verbose("Status variables checkpoint complete")
+            collect_checkpoint()
+            if options.inline_emails:
+                send_queued_emails()
             
         else:
             verbose("Will not monitor the database")
@@ -5078,6 +8644,15 @@ try:
         if should_email_alert_pending_report:
             email_alert_pending_report()
             
+        if should_send_emails:
+            send_queued_emails()
+
+        if should_backtest:
+            backtest_alert_conditions()
+
+        if should_run_daemon:
+            run_daemon()
+
         if should_serve_http:
             serve_http()
             
@@ -5097,6 +8672,7 @@ try:
         sys.exit(1)
 
 finally:
+    close_custom_query_connections()
     if monitored_conn:
         monitored_conn.close()
     if write_conn and write_conn is not monitored_conn:
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+generate_alert_condition_query: no monitored host query is built unless some condition refers to the
+monitored host; non-ASCII condition text is kept as is.
+"""
+from mcp_test_utils import load_mycheckpoint, FakeConnection
+
+mcp = load_mycheckpoint()
+
+conditions = []
+
+
+def responder(query):
+    return [dict(condition) for condition in conditions]
+
+mcp.write_conn = FakeConnection(responder)
+mcp.status_variables_insert_id = 17
+mcp.get_custom_query_ids = lambda: []
+
+
+def get_condition(alert_condition_id, condition_eval, monitored_host_condition_eval="1"):
+    # As returned by the query: both columns are strings
+    return {
+        "alert_condition_id": alert_condition_id,
+        "monitored_host_condition_eval": monitored_host_condition_eval,
+        "condition_eval": condition_eval,
+        "window_function": "none",
+        "window_eval": None,
+        "window_minutes": 0,
+        }
+
+conditions = [get_condition(1, "threads_running > 20"), get_condition(2, u"uptime < 600 /* réinitialisé */")]
+alert_condition_ids, query, monitored_host_query, window_conditions = mcp.generate_alert_condition_query()
+assert alert_condition_ids == [1, 2], alert_condition_ids
+assert monitored_host_query is None, monitored_host_query
+assert u"réinitialisé" in query
+assert "id = 17" in query
+
+conditions.append(get_condition(3, "1", "@@global.read_only = 0"))
+alert_condition_ids, query, monitored_host_query, window_conditions = mcp.generate_alert_condition_query()
+assert "@@global.read_only = 0 AS condition_3" in monitored_host_query, monitored_host_query
+assert "1 AS condition_1" in monitored_host_query, monitored_host_query
+print "OK"
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""
+Windowed alert conditions: the latest value is always within the window, so that window_minutes = 0
+evaluates the latest value only, both when collecting and when backtesting. Non-ASCII condition text
+is kept as is.
+"""
+import re
+
+from mcp_test_utils import load_mycheckpoint, FakeConnection
+
+mcp = load_mycheckpoint()
+
+# Backtest: one sample per minute
+timestamps = [60 * sample_index for sample_index in range(5)]
+values = [1.0, 5.0, 2.0, 0.0, 3.0]
+for window_function in ["avg", "min", "max"]:
+    window_values = mcp.get_backtest_window_values({"window_minutes": 0, "window_function": window_function}, timestamps, values)
+    assert window_values == values, (window_function, window_values)
+window_values = mcp.get_backtest_window_values({"window_minutes": 0, "window_function": "count"}, timestamps, values)
+assert window_values == [1, 1, 1, 0, 1], window_values
+window_values = mcp.get_backtest_window_values({"window_minutes": 2, "window_function": "max"}, timestamps, values)
+assert window_values == [1.0, 5.0, 5.0, 2.0, 3.0], window_values
+
+# Collection: expiring old values spares the just inserted ones
+write_connection = FakeConnection()
+mcp.write_conn = write_connection
+mcp.act_query = lambda query: write_connection.queries.append(" ".join(query.split())) or 0
+mcp.write_alert_condition_window_values([{"alert_condition_id": 3}], {"id": 17, "ts": "2026-10-17 12:00:00", "window_value_3": 4.0})
+delete_query = [query for query in write_connection.queries if query.startswith("DELETE")][0]
+assert re.search(r"sv_report_sample_id != 17\b", delete_query), delete_query
+
+# Window evaluation: non-ASCII (unicode) condition text
+mcp.write_conn = FakeConnection(lambda query: [{"condition_3": 1}])
+mcp.evaluate_alert_condition_windows([{"alert_condition_id": 3, "window_function": "avg", "condition_eval": u"window_value > 10 /* débit */"}])
+evaluate_query = mcp.write_conn.queries[-1]
+assert u"window_value_3 > 10 /* débit */ AS condition_3" in evaluate_query, evaluate_query
+print "OK"
@@ -0,0 +1,61 @@
+"""
+check_alerts: firing conditions are collected first, then written with one multi-row statement for alerts and
+one for pending alerts, followed by a single resolve statement, regardless of the number of firing conditions.
+Within the sample's write transaction, nothing is committed until the transaction is.
+"""
+from mcp_test_utils import load_mycheckpoint, FakeConnection
+
+mcp = load_mycheckpoint()
+mcp.database_name = "mycheckpoint"
+
+num_conditions = 50
+firing_alert_condition_ids = range(1, num_conditions + 1, 2)
+num_commits = [0]
+
+
+def responder(query):
+    query = " ".join(query.split())
+    if query.startswith("UPDATE mycheckpoint.alert_pending SET resolved = 1"):
+        # 2 pending alerts resolved
+        return [1, 1]
+    return []
+
+
+class TransactionConnection(FakeConnection):
+    def commit(self):
+        num_commits[0] += 1
+
+mcp.write_conn = TransactionConnection(responder)
+row = {"id": 1234}
+for alert_condition_id in range(1, num_conditions + 1):
+    row["condition_%d" % alert_condition_id] = {True: 1, False: 0}[alert_condition_id in firing_alert_condition_ids]
+row["condition_2"] = None
+mcp.generate_alert_condition_query = lambda: (range(1, num_conditions + 1), "SELECT ...", None, [])
+mcp.get_row = lambda query, connection=None: dict(row)
+mcp.queue_alert_email = lambda: [71, 72]
+
+mcp.begin_write_transaction()
+mcp.check_alerts()
+assert num_commits == [0], num_commits
+mcp.commit_write_transaction()
+assert num_commits == [1], num_commits
+
+queries = [" ".join(query.split()) for query in mcp.write_conn.queries]
+assert len(queries) == 5, queries
+(alert_query, alert_pending_query, resolve_query, notified_query, remove_query) = queries
+assert alert_query == "INSERT /*! IGNORE */ INTO mycheckpoint.alert (alert_condition_id, sv_report_sample_id) VALUES %s" % (
+    ",".join(["(%d, 1234)" % alert_condition_id for alert_condition_id in firing_alert_condition_ids])), alert_query
+assert alert_pending_query == ("INSERT INTO mycheckpoint.alert_pending (alert_condition_id, sv_report_sample_id_start, sv_report_sample_id_end) VALUES %s "
+    "ON DUPLICATE KEY UPDATE sv_report_sample_id_end = VALUES(sv_report_sample_id_end)" % (
+    ",".join(["(%d, 1234, 1234)" % alert_condition_id for alert_condition_id in firing_alert_condition_ids]))), alert_pending_query
+assert resolve_query == "UPDATE mycheckpoint.alert_pending SET resolved = 1 WHERE sv_report_sample_id_end < 1234", resolve_query
+assert notified_query == "UPDATE mycheckpoint.alert_pending SET ts_notified = NOW() WHERE alert_pending_id IN (71,72) AND resolved = 0", notified_query
+assert remove_query == "DELETE FROM mycheckpoint.alert_pending WHERE resolved = 1", remove_query
+
+# Nothing firing, nothing resolved, nothing notified: a single resolve statement
+mcp.write_conn = TransactionConnection(lambda query: [])
+row = dict([("condition_%d" % alert_condition_id, 0) for alert_condition_id in range(1, num_conditions + 1)] + [("id", 1235)])
+mcp.queue_alert_email = lambda: []
+mcp.check_alerts()
+assert [query.split()[0] for query in mcp.write_conn.queries] == ["UPDATE"], mcp.write_conn.queries
+print "OK"
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""
+Backtesting: episodes are measured as alert_pending_view measures them, including its tolerance for
+sampling jitter; non-ASCII condition text is kept as is.
+"""
+from mcp_test_utils import load_mycheckpoint
+
+mcp = load_mycheckpoint()
+
+# Five samples, a minute apart, the last one two seconds early: a 4 minutes episode
+timestamps = [0, 60, 120, 180, 238, 300]
+fires = [True, True, True, True, True, False]
+episodes = mcp.get_backtest_episodes({"alert_delay_minutes": 4}, timestamps, fires)
+assert episodes == [(0, 238, 4, True)], episodes
+episodes = mcp.get_backtest_episodes({"alert_delay_minutes": 5}, timestamps, fires)
+assert episodes == [(0, 238, 4, False)], episodes
+episodes = mcp.get_backtest_episodes({"alert_delay_minutes": 0}, [0, 60, 120], [True, False, True])
+assert episodes == [(0, 0, 0, True), (120, 120, 0, True)], episodes
+
+mcp.get_custom_query_ids = lambda: []
+query = mcp.get_backtest_query([
+    {"condition_eval": u"uptime < 600 /* réinitialisé */", "window_function": "none", "window_eval": None},
+    {"condition_eval": "window_value > 0", "window_function": "max", "window_eval": u"threads_running /* activité */"},
+    ])
+assert u"réinitialisé" in query and u"activité" in query
+print "OK"
@@ -0,0 +1,64 @@
+"""
+refresh_chart_cache: sample charts are rendered upon each sample; hour and day charts are only rendered
+when sv_report_hour / sv_report_day get a new row, or when not yet cached.
+"""
+import datetime
+import re
+
+from mcp_test_utils import load_mycheckpoint, FakeConnection
+
+mcp = load_mycheckpoint(["--chart-cache"])
+mcp.database_name = "mycheckpoint"
+mcp.status_variables_insert_timestamp = datetime.datetime(2010, 3, 7, 14, 25, 0)
+mcp.get_all_report_chart_views = lambda: [("com_select_psec", "com_select_psec", True, False, None)]
+mcp.render_charts = lambda view_name_extension, rows, charts_list, charts_api, mark_stale: {"com_select_psec": ("chart", "chart_extended")}
+
+latest_timestamps = {
+    "sample": datetime.datetime(2010, 3, 7, 14, 20, 0),
+    "hour": datetime.datetime(2010, 3, 7, 14, 0, 0),
+    "day": datetime.date(2010, 3, 7),
+    }
+
+
+def refresh(cached_source_timestamps):
+    def responder(query):
+        query = " ".join(query.split())
+        if "FROM mycheckpoint.chart_cache GROUP BY resolution" in query:
+            return [{"resolution": resolution, "source_ts": source_ts} for (resolution, source_ts) in cached_source_timestamps.items()]
+        if "AS latest_ts" in query:
+            return [{"latest_ts": latest_timestamps[re.search(r"sv_report_(\w+)_recent", query).group(1)]}]
+        if "AS chart_ts" in query:
+            return [{"chart_ts": latest_timestamps[re.search(r"sv_report_(\w+)_recent", query).group(1)]}]
+        return [{}]
+    mcp.write_conn = FakeConnection(responder)
+    mcp.refresh_chart_cache()
+    return [re.search(r"resolution = '(\w+)'", query).group(1) for query in mcp.write_conn.queries if query.startswith("DELETE")]
+
+# Nothing cached yet: all resolutions rendered
+assert refresh({}) == ["sample", "hour", "day"]
+
+# Same hour and day rows as cached: only the sample charts are rendered
+assert refresh({
+    "sample": datetime.datetime(2010, 3, 7, 14, 10, 0),
+    "hour": datetime.datetime(2010, 3, 7, 14, 0, 0),
+    "day": datetime.datetime(2010, 3, 7, 0, 0, 0),
+    }) == ["sample"]
+
+# A new hour row
+assert refresh({
+    "sample": datetime.datetime(2010, 3, 7, 13, 50, 0),
+    "hour": datetime.datetime(2010, 3, 7, 13, 0, 0),
+    "day": datetime.datetime(2010, 3, 7, 0, 0, 0),
+    }) == ["sample", "hour"]
+
+# A new day row
+assert refresh({
+    "sample": datetime.datetime(2010, 3, 6, 23, 50, 0),
+    "hour": datetime.datetime(2010, 3, 7, 14, 0, 0),
+    "day": datetime.datetime(2010, 3, 6, 0, 0, 0),
+    }) == ["sample", "day"]
+
+# Without a new sample, cached charts are kept
+mcp.status_variables_insert_timestamp = None
+assert refresh({"sample": None, "hour": None, "day": None}) == []
+print "OK"
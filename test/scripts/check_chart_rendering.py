@@ -0,0 +1,39 @@
+"""
+Python chart rendering: report charts (render_charts) and the zoom page's downsampled chart share a single
+renderer, with the same colors, scaling and encodings.
+"""
+import datetime
+
+from mcp_test_utils import load_mycheckpoint
+
+mcp = load_mycheckpoint()
+
+charts_api = {"service_url": "http://chart.apis.google.com/chart", "chart_width": 400, "chart_height": 200,
+    "simple_encoding": "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"}
+
+# Report chart: a missing hour is filled in
+now = datetime.datetime(2026, 10, 17, 12, 0, 0)
+rows = [{"chart_ts": now - datetime.timedelta(hours=hours_ago), "chart_now": now, "threads_connected": 10.0 * hours_ago, "threads_running": 1.0}
+    for hours_ago in [3, 2, 0]]
+charts = mcp.render_charts("hour", rows, [("threads_connected, threads_running", "threads", True, False, [])], charts_api)
+(url, extended_url) = charts["threads"]
+assert "&chco=ff8c00,4682b4&" in url, url
+assert "&chd=s:9p_A,CC_C&" in url, url
+assert "&chd=t:30,20,_,0|1,1,_,1&" in extended_url, extended_url
+assert "&chxr=1,0,30&" in extended_url, extended_url
+assert "&tsstep=3600" in extended_url, extended_url
+
+# Zoom page downsampled chart
+mcp.http_get_time_range = lambda http_database_name, from_value, to_value, default_range_days: {
+    "from_ts": "2026-10-16 12:00:00", "to_ts": "2026-10-17 12:00:00", "from_unix_ts": 0, "to_unix_ts": 86400, "range_seconds": 86400}
+mcp.http_get_series_query = lambda http_database_name, metrics, time_range, max_rows: ("sample", "SELECT ...")
+mcp.http_fetch_series_rows = lambda query: [("", unix_ts, float(unix_ts % 7200), 100.0) for unix_ts in range(0, 86400, 60)]
+mcp.http_get_row = lambda query: charts_api
+mcp.get_chart_definition = lambda chart_alias: (["threads_connected", "threads_running"], True, False)
+js, div = mcp.http_get_chart_zoom_downsampled_chart("mcp", "threads", "", 800)
+assert "&chco=ff8c00,4682b4&" in js, js
+assert "&chd=t:" in js, js
+assert "&chtt=threads:+2026-10-16+12:00:00+to+2026-10-17+12:00:00,+by+sample+(min/max)&" in js, js
+assert "&tsstep=108" in js, js
+assert mcp.default_chart_colors[0:2] == ["ff8c00", "4682b4"]
+print "OK"
@@ -0,0 +1,78 @@
+"""
+purge_status_variables without partitioning: rows are deleted in --purge-chunk-size primary key ranges,
+pausing --purge-chunk-pause-millis between chunks, and stopping once --purge-time-budget is exhausted.
+Rows left behind are purged on the following run.
+"""
+import re
+
+from mcp_test_utils import load_mycheckpoint, FakeConnection
+
+mcp = load_mycheckpoint(["--purge-chunk-size=4", "--purge-chunk-pause-millis=250", "--purge-time-budget=1"])
+
+
+class FakeTime(object):
+    """
+    A clock advancing by 0.2 seconds on each DELETE, and by the requested time on sleep().
+    """
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+clock = FakeTime()
+mcp.time = clock
+
+# ids 3..30; ids up to 20 are older than --purge-days
+status_variables_ids = range(3, 31)
+
+
+def responder(query):
+    query = " ".join(query.split())
+    if "AS purge_ts" in query:
+        return [{"purge_ts": "2010-03-01 00:00:00"}]
+    if "MAX(id) AS max_id" in query:
+        assert "WHERE ts < '2010-03-01 00:00:00'" in query, query
+        return [{"max_id": 20}]
+    if "MIN(id) AS min_key" in query:
+        return [{"min_key": min(status_variables_ids)}]
+    if query.startswith("DELETE"):
+        assert "AND ts < '2010-03-01 00:00:00'" in query, query
+        from_id, to_id = [int(key) for key in re.search(r"id >= (\d+) AND id <= (\d+)", query).groups()]
+        assert to_id - from_id < 4, query
+        deleted_ids = [status_variables_id for status_variables_id in status_variables_ids if from_id <= status_variables_id <= to_id]
+        for status_variables_id in deleted_ids:
+            status_variables_ids.remove(status_variables_id)
+        clock.now += 0.2
+        return deleted_ids
+    return []
+
+mcp.write_conn = FakeConnection(responder)
+
+# Chunks [3..6], [7..10], [11..14]: then the time budget is exhausted
+assert mcp.purge_status_variables() == 12
+assert status_variables_ids == range(15, 31), status_variables_ids
+assert clock.sleeps == [0.25, 0.25], clock.sleeps
+
+# Next run resumes where the previous one stopped
+del clock.sleeps[:]
+assert mcp.purge_status_variables() == 6
+assert status_variables_ids == range(21, 31), status_variables_ids
+assert clock.sleeps == [0.25], clock.sleeps
+
+# Nothing left to purge
+mcp.write_conn = FakeConnection(responder)
+assert mcp.purge_rows("status_variables", "id", 20, "ts < '2010-03-01 00:00:00'") == 0
+
+# --purge-chunk-size=0: a single unbounded DELETE
+mcp.options.purge_chunk_size = 0
+mcp.write_conn = FakeConnection(lambda query: [])
+mcp.purge_rows("alert", "sv_report_sample_id", 20)
+assert [query for query in mcp.write_conn.queries if query.startswith("DELETE")] == [
+    "DELETE FROM mycheckpoint.alert WHERE sv_report_sample_id >= 0 AND sv_report_sample_id <= 20 AND 1"], mcp.write_conn.queries
+print "OK"
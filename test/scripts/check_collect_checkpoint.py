@@ -0,0 +1,45 @@
+"""
+collect_checkpoint: the sample, its diff and aggregations are committed before chart cache refresh and
+alerts checking; a failing alert condition or chart render is reported, and does not lose the sample.
+"""
+from mcp_test_utils import load_mycheckpoint, FakeConnection
+
+mcp = load_mycheckpoint()
+
+events = []
+
+
+class TransactionConnection(FakeConnection):
+    def commit(self):
+        events.append("commit")
+
+    def rollback(self):
+        events.append("rollback")
+
+mcp.write_conn = TransactionConnection()
+
+
+def record(name):
+    return lambda: events.append(name)
+
+
+def check_alerts():
+    events.append("check_alerts")
+    raise ValueError("Unknown column 'no_such_column' in 'field list'")
+
+mcp.collect_status_variables = record("collect")
+mcp.write_status_variables_diff = record("diff")
+mcp.write_status_variables_aggregations = record("aggregations")
+mcp.refresh_chart_cache = record("refresh_chart_cache")
+mcp.check_alerts = check_alerts
+mcp.purge_status_variables = lambda: events.append("purge") or 0
+
+mcp.collect_checkpoint()
+assert events == [
+    "collect", "diff", "aggregations", "commit",
+    "refresh_chart_cache", "commit",
+    "check_alerts", "rollback",
+    "purge",
+    ], events
+assert not mcp.write_transaction_active
+print "OK"
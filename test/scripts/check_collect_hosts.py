@@ -0,0 +1,40 @@
+"""
+collect_hosts: a host failing with exit_with_error() (SystemExit) in its worker must be reported as failed,
+without hanging the pool nor affecting other hosts.
+"""
+import os
+import threading
+
+from mcp_test_utils import load_mycheckpoint, FakeConnection
+
+mcp = load_mycheckpoint(["--hosts-file=hosts.cnf", "--hosts-concurrency=2"])
+
+
+def fake_open_connections():
+    if mcp.options.monitored_host == "bad_host":
+        mcp.exit_with_error("Failed to disable binary logging")
+    connection = FakeConnection()
+    return connection, connection
+
+mcp.read_hosts_file = lambda: [
+    ("good_host", {"monitored_host": "good_host", "database": "mcp_good"}),
+    ("bad_host", {"monitored_host": "bad_host", "database": "mcp_bad"}),
+    ]
+mcp.open_connections = fake_open_connections
+mcp.init_connections = lambda: None
+mcp.is_same_deploy = lambda: True
+mcp.collect_checkpoint = lambda: None
+
+
+# pool.map() may block uninterruptibly; run it in a thread so that a hang can be detected
+results = []
+collect_thread = threading.Thread(target=lambda: results.append(mcp.collect_hosts()))
+collect_thread.setDaemon(True)
+collect_thread.start()
+collect_thread.join(30)
+if collect_thread.isAlive():
+    print "FAIL: collect_hosts did not return"
+    os._exit(1)
+
+assert results == [False], "collect_hosts should report failure"
+print "OK"
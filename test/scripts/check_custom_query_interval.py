@@ -0,0 +1,80 @@
+"""
+Custom queries with a sample_interval are evaluated once every sample_interval samples or seconds.
+Skipped samples carry the cached value forward, or write NULL, as configured per query. Evaluated values
+of interval queries are cached, and skipped samples are counted.
+"""
+from mcp_test_utils import load_mycheckpoint, FakeConnection
+
+mcp = load_mycheckpoint()
+
+
+def custom_query_row(custom_query_id, sample_interval=1, sample_interval_unit="samples", skipped_sample_value="carry_forward",
+        is_cached=0, cached_value=None, skipped_samples=None, seconds_since_evaluation=None):
+    return {
+        "custom_query_id": custom_query_id,
+        "query_eval": "SELECT %d" % custom_query_id,
+        "description": "custom query %d" % custom_query_id,
+        "sample_interval": sample_interval,
+        "sample_interval_unit": sample_interval_unit,
+        "skipped_sample_value": skipped_sample_value,
+        "result_type": "single_value",
+        "source_custom_query_id": None,
+        "value_name": None,
+        "is_cached": is_cached,
+        "cached_value": cached_value,
+        "skipped_samples": skipped_samples,
+        "seconds_since_evaluation": seconds_since_evaluation,
+        }
+
+custom_query_rows = [
+    # Every sample
+    custom_query_row(1),
+    # Every 3 samples; skipped once so far
+    custom_query_row(2, 3, is_cached=1, cached_value=42, skipped_samples=1),
+    # Every 60 seconds, evaluated 30 seconds ago; NULL when skipped
+    custom_query_row(3, 60, "seconds", "null", is_cached=1, cached_value=17, skipped_samples=0, seconds_since_evaluation=30),
+    # Every 5 samples; skipped 4 times so far
+    custom_query_row(4, 5, is_cached=1, cached_value=8, skipped_samples=4),
+    # Every 60 seconds, never evaluated
+    custom_query_row(5, 60, "seconds"),
+    ]
+
+
+def responder(query):
+    if "FROM mycheckpoint.custom_query" in " ".join(query.split()):
+        return custom_query_rows
+    return []
+
+executed_custom_query_ids = []
+
+
+def execute_custom_queries(custom_queries):
+    executed_custom_query_ids.extend([custom_query_id for (custom_query_id, query_eval, result_type) in custom_queries])
+    return dict([(custom_query_id, (custom_query_id * 100, 3)) for (custom_query_id, query_eval, result_type) in custom_queries])
+
+mcp.execute_custom_queries = execute_custom_queries
+mcp.write_conn = FakeConnection(responder)
+mcp.status_dict.clear()
+mcp.collect_custom_data()
+
+assert executed_custom_query_ids == [1, 4, 5], executed_custom_query_ids
+assert mcp.status_dict == {
+    "custom_1": 100, "custom_1_time": 3,
+    "custom_2": 42, "custom_2_time": None,
+    "custom_3": None, "custom_3_time": None,
+    "custom_4": 400, "custom_4_time": 3,
+    "custom_5": 500, "custom_5_time": 3,
+    }, mcp.status_dict
+
+write_queries = [" ".join(query.split()) for query in mcp.write_conn.queries if not query.strip().startswith("SELECT")]
+assert len(write_queries) == 2, write_queries
+# Only interval queries are cached
+assert write_queries[0].startswith("INSERT INTO mycheckpoint.custom_query_cache"), write_queries
+assert "VALUES (4, 400, 3, NOW(), 0), (5, 500, 3, NOW(), 0) ON DUPLICATE KEY UPDATE" in write_queries[0], write_queries
+assert write_queries[1] == "UPDATE mycheckpoint.custom_query_cache SET skipped_samples = skipped_samples + 1 WHERE custom_query_id IN (2, 3)", write_queries
+
+# Seconds based intervals
+assert mcp.is_custom_query_due(custom_query_row(6, 60, "seconds", is_cached=1, seconds_since_evaluation=60))
+assert not mcp.is_custom_query_due(custom_query_row(6, 60, "seconds", is_cached=1, seconds_since_evaluation=59))
+assert mcp.is_custom_query_due(custom_query_row(6, 60, "seconds", is_cached=1, seconds_since_evaluation=None))
+print "OK"
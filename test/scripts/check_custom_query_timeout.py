@@ -0,0 +1,84 @@
+"""
+execute_custom_queries: a query exceeding --custom-query-timeout is killed and reported as timed out;
+its connection is closed by its own worker thread, never while in use. A query failing with a non MySQL
+error is reported as failed, not as timed out. Queries queued behind a slow query get their own full
+timeout, and still run once the slow query is killed.
+"""
+import threading
+import time
+
+from mcp_test_utils import load_mycheckpoint, FakeConnection
+
+mcp = load_mycheckpoint(["--custom-query-timeout=1", "--custom-query-concurrency=3"])
+
+killed = threading.Event()
+connections = {}
+
+
+class CustomQueryConnection(FakeConnection):
+    def __init__(self):
+        FakeConnection.__init__(self)
+        self.busy = False
+        self.closed_while_busy = False
+        self.closing_thread = None
+
+    def close(self):
+        self.closed_while_busy = self.busy
+        self.closing_thread = threading.currentThread()
+        FakeConnection.close(self)
+
+
+def open_custom_query_connection():
+    connection_id = len(connections) + 1
+    connections[connection_id] = CustomQueryConnection()
+    return {"connection": connections[connection_id], "connection_id": connection_id}
+
+
+def execute_custom_query(custom_query_id, query_eval, connection, result_type):
+    connection.busy = True
+    try:
+        if query_eval == "slow":
+            # Runs until killed
+            killed.wait(10)
+            raise mcp.MySQLdb.Error("Query execution was interrupted")
+        if query_eval == "broken":
+            raise ValueError("invalid literal for int()")
+        return (17, 1)
+    finally:
+        connection.busy = False
+
+
+def monitored_responder(query):
+    if query.startswith("KILL QUERY"):
+        killed.set()
+    return []
+
+mcp.open_custom_query_connection = open_custom_query_connection
+mcp.execute_custom_query = execute_custom_query
+mcp.monitored_conn = FakeConnection(monitored_responder)
+
+results = mcp.execute_custom_queries([(1, "fast", "integer"), (2, "slow", "integer"), (3, "broken", "integer")])
+# Give the killed worker a moment to close its connection
+time.sleep(0.5)
+
+assert results[1] == (17, 1), results
+assert results[2][0] is None, "slow query should time out"
+assert 3 not in results, "broken query should fail, not time out"
+assert killed.isSet()
+
+closed_connections = [connection for connection in connections.values() if connection.closed]
+assert len(closed_connections) == 1, "only the killed query's connection should be closed"
+assert not closed_connections[0].closed_while_busy
+assert closed_connections[0].closing_thread is not threading.currentThread(), "connection closed by main thread"
+assert len(mcp.custom_query_connections) == 2
+
+# A single connection: queries queued behind the slow one run on a replacement connection
+mcp.options.custom_query_concurrency = 1
+killed.clear()
+results = mcp.execute_custom_queries([(4, "slow", "integer"), (5, "fast", "integer"), (6, "fast", "integer")])
+time.sleep(0.5)
+assert results[4][0] is None, "slow query should time out"
+assert results[5] == (17, 1) and results[6] == (17, 1), results
+assert len([connection for connection in connections.values() if connection.closed]) == 2
+
+print "OK"
@@ -0,0 +1,86 @@
+"""
+daemon: connections are kept open between samples; deploy is re-checked only when the deploy signature changes
+or after reconnecting. Failed cycles close the connections and retry with exponential backoff; a failure to
+reconnect is notified once.
+"""
+from mcp_test_utils import load_mycheckpoint
+
+mcp = load_mycheckpoint(["--daemon-interval=60", "--daemon-max-backoff=200"])
+
+events = []
+
+
+class FakeTime(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        events.append("sleep %d" % seconds)
+        self.now += seconds
+
+clock = FakeTime()
+mcp.time = clock
+
+deploy_signatures = ["a", "a", "b", "b", "b", "c", "c", "c", "c"]
+
+
+def get_deploy_signature():
+    events.append("signature")
+    return deploy_signatures.pop(0)
+
+collect_outcomes = ["ok", "ok", "error", "ok", "interrupt"]
+
+
+def collect_checkpoint():
+    events.append("collect")
+    clock.now += 5
+    outcome = collect_outcomes.pop(0)
+    if outcome == "error":
+        raise mcp.MySQLdb.OperationalError("Lost connection to MySQL server during query")
+    if outcome == "interrupt":
+        raise KeyboardInterrupt()
+
+reconnect_outcomes = ["error", "ok"]
+
+
+def reconnect():
+    events.append("reconnect")
+    if reconnect_outcomes.pop(0) == "error":
+        raise mcp.MySQLdb.OperationalError("Can't connect to MySQL server")
+
+same_deploy_outcomes = [False, True]
+
+
+def is_same_deploy():
+    events.append("is_same_deploy")
+    return same_deploy_outcomes.pop(0)
+
+mcp.get_deploy_signature = get_deploy_signature
+mcp.collect_checkpoint = collect_checkpoint
+mcp.reconnect = reconnect
+mcp.is_same_deploy = is_same_deploy
+mcp.deploy_schema_and_aggregations = lambda: events.append("deploy")
+mcp.close_connections = lambda: events.append("close")
+mcp.email_cannot_access_database_message = lambda: events.append("notify")
+mcp.send_queued_emails_periodically = lambda: None
+mcp.print_error = lambda message: None
+
+mcp.run_daemon()
+assert events == [
+    "signature",
+    # Unchanged signature: no deploy check
+    "signature", "collect", "sleep 55",
+    # Changed signature: deploy check, auto-deploy
+    "signature", "is_same_deploy", "deploy", "signature", "collect", "sleep 55",
+    # Failed cycle
+    "signature", "collect", "close", "sleep 60",
+    # Cannot reconnect: notify once, back off
+    "reconnect", "notify", "close", "sleep 120",
+    # Reconnected: deploy re-checked regardless of signature
+    "reconnect", "signature", "is_same_deploy", "signature", "collect", "sleep 55",
+    "signature", "collect",
+    ], events
+print "OK"
@@ -0,0 +1,61 @@
+"""
+detect_mycheckpoint_databases: mycheckpoint databases are listed by a single information_schema query, and
+their metadata read by batched UNION queries, rather than by a query per schema. The list is cached for
+--http-databases-ttl seconds.
+"""
+import re
+
+from mcp_test_utils import load_mycheckpoint
+
+mcp = load_mycheckpoint(["--http-databases-ttl=300"])
+
+
+class FakeTime(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+clock = FakeTime()
+mcp.time = clock
+
+schemas = ["mcp_%03d" % schema_index for schema_index in range(230)] + ["weird`name"]
+queries = []
+
+
+def http_get_rows(query):
+    query = " ".join(query.split())
+    queries.append(query)
+    if "information_schema.COLUMNS" in query:
+        return [{"TABLE_SCHEMA": schema} for schema in schemas]
+    read_schemas = [schema.replace("``", "`") for schema in re.findall(r"FROM `((?:[^`]|``)+)`\.metadata", query)]
+    return [{"database_name": schema, "deploy_version": "100,2026-10-01 00:00:00"} for schema in read_schemas]
+
+mcp.http_get_rows = http_get_rows
+
+mcp.detect_mycheckpoint_databases()
+assert mcp.http_known_databases == schemas, mcp.http_known_databases
+# One listing query, then 3 batches of up to 100 schemas
+assert len(queries) == 4, queries
+assert "information_schema.COLUMNS" in queries[0], queries
+assert [len(re.findall(r"\.metadata LIMIT 1", query)) for query in queries[1:]] == [100, 100, 31], queries
+assert "FROM `weird``name`.metadata" in queries[3], queries[3]
+assert mcp.http_known_databases_deploy_versions["mcp_042"] == "100,2026-10-01 00:00:00"
+
+# Cached within the TTL
+del queries[:]
+clock.now += 299
+mcp.detect_mycheckpoint_databases()
+assert queries == []
+
+# Re-read once the TTL has passed, or when forced
+schemas.remove("mcp_100")
+clock.now += 1
+mcp.detect_mycheckpoint_databases()
+assert len(queries) == 4, queries
+assert "mcp_100" not in mcp.http_known_databases
+del queries[:]
+mcp.detect_mycheckpoint_databases(force_reload=True)
+assert len(queries) == 4, queries
+print "OK"
@@ -0,0 +1,56 @@
+"""
+Options determining the deployed schema are stored in metadata upon deploy. Collecting with other options
+must not be considered the same deploy, so that auto-deploy kicks in.
+"""
+import re
+
+from mcp_test_utils import load_mycheckpoint, FakeConnection
+
+deployed_options = {}
+
+
+def metadata_responder(query):
+    match = re.search("deploy_options = '([^']*)'", query)
+    if match:
+        return [{"same_deploy": int(match.group(1) == deployed_options.get("value"))}]
+    return []
+
+
+def load(command_line_options):
+    mcp = load_mycheckpoint(command_line_options)
+    mcp.get_monitored_host_mysql_version = lambda: "5.5.0"
+    mcp.write_conn = FakeConnection(metadata_responder)
+    mcp.monitored_conn = mcp.write_conn
+    return mcp
+
+
+def deploy(command_line_options):
+    mcp = load(command_line_options)
+    mcp.create_metadata_table()
+    deployed_options["value"] = re.search("'([^']*)'\\)$", mcp.write_conn.queries[-1]).group(1)
+
+
+def is_same_deploy(command_line_options):
+    return load(command_line_options).is_same_deploy()
+
+
+deploy([])
+assert is_same_deploy([])
+assert not is_same_deploy(["--materialize-diff"])
+
+deploy(["--materialize-diff"])
+assert is_same_deploy(["--materialize-diff"])
+assert not is_same_deploy([])
+assert not is_same_deploy(["--materialize-diff", "--partition-status-variables"])
+
+deploy(["--partition-status-variables"])
+assert is_same_deploy(["--partition-status-variables"])
+assert not is_same_deploy([])
+
+deploy(["--chart-cache"])
+assert is_same_deploy(["--chart-cache"])
+assert not is_same_deploy([])
+deploy([])
+assert not is_same_deploy(["--chart-cache"])
+
+print "OK"
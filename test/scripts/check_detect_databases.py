@@ -0,0 +1,43 @@
+"""
+detect_mycheckpoint_databases: a failing schema does not hide the other databases of its batch.
+Cached static components are keyed by deploy version, so that a re-deploy is picked up.
+"""
+import re
+
+from mcp_test_utils import load_mycheckpoint
+
+mcp = load_mycheckpoint()
+
+schemas = ["mcp_%03d" % schema_index for schema_index in range(150)]
+dropped_schemas = ["mcp_007", "mcp_120"]
+deploy_versions = dict([(schema, "100,2026-10-01 00:00:00") for schema in schemas])
+queries = []
+
+
+def http_get_rows(query):
+    queries.append(query)
+    if "information_schema.COLUMNS" in query:
+        return [{"TABLE_SCHEMA": schema} for schema in schemas]
+    if "html_components" in query:
+        return [{"version": "100-1", "openark_lchart": "lchart", "openark_schart": "schart", "common_css": "css"}]
+    read_schemas = re.findall(r"FROM `([^`]+)`\.metadata", query)
+    if [schema for schema in read_schemas if schema in dropped_schemas]:
+        raise mcp.MySQLdb.Error("Table doesn't exist")
+    return [{"database_name": schema, "deploy_version": deploy_versions[schema]} for schema in read_schemas]
+
+mcp.http_get_rows = http_get_rows
+
+mcp.detect_mycheckpoint_databases()
+assert mcp.http_known_databases == [schema for schema in schemas if schema not in dropped_schemas], mcp.http_known_databases
+
+mcp.http_get_static_components("mcp_001")
+num_queries = len(queries)
+mcp.http_get_static_components("mcp_001")
+assert len(queries) == num_queries, "static components expected to be cached"
+
+# Re-deploy of mcp_001
+deploy_versions["mcp_001"] = "101,2026-10-02 00:00:00"
+mcp.detect_mycheckpoint_databases(force_reload=True)
+mcp.http_get_static_components("mcp_001")
+assert "html_components" in queries[-1], "static components expected to be re-read after deploy"
+print "OK"
@@ -0,0 +1,21 @@
+"""
+downsample_minmax: never returns more than the requested number of points, whatever the number of series,
+and keeps each series' spikes.
+"""
+from mcp_test_utils import load_mycheckpoint
+
+mcp = load_mycheckpoint()
+
+# Series peak at different rows, so that the min and max of each series are held by distinct rows
+rows = [(x, x, (x * 7) % 101, (x * 13) % 97, (x * 31) % 89, 1000 if x == 5000 else 0) for x in range(10000)]
+y_indexes = [2, 3, 4, 5]
+for num_points in [1, 2, 3, 9, 10, 11, 100, 500, 9999]:
+    downsampled_rows = mcp.downsample_minmax(rows, num_points, 1, y_indexes)
+    assert len(downsampled_rows) <= num_points, (num_points, len(downsampled_rows))
+    assert downsampled_rows == sorted(downsampled_rows)
+    if num_points >= 2:
+        assert downsampled_rows[0] == rows[0] and downsampled_rows[-1] == rows[-1]
+    if num_points >= 2 + 2 * len(y_indexes):
+        assert rows[5000] in downsampled_rows, num_points
+assert mcp.downsample_minmax(rows[:10], 10, 1, y_indexes) == rows[:10]
+print "OK"
@@ -0,0 +1,71 @@
+"""
+send_queued_emails: concurrent senders (e.g. the daemon's sender thread and a send_emails run) claim
+queued messages before sending them, so that each message is sent exactly once.
+"""
+import re
+import threading
+import time
+
+from mcp_test_utils import load_mycheckpoint, FakeConnection
+
+mcp = load_mycheckpoint(["--smtp-host=localhost", "--smtp-from=mcp@localhost", "--smtp-to=dba@localhost"])
+
+outbox_lock = threading.Lock()
+outbox = dict([(alert_email_outbox_id, {"subject": "alert %d" % alert_email_outbox_id, "claimed_by": None, "ts_sent": None})
+    for alert_email_outbox_id in range(1, 31)])
+sent_subjects = []
+
+
+def get_outbox_responder(connection_id):
+    def responder(query):
+        query = " ".join(query.split())
+        with outbox_lock:
+            if query.startswith("UPDATE") and "claimed_by = CONNECTION_ID()" in query:
+                limit = int(re.search(r"LIMIT (\d+)$", query).group(1))
+                claimable_ids = sorted([alert_email_outbox_id for (alert_email_outbox_id, row) in outbox.items()
+                    if row["ts_sent"] is None and row["claimed_by"] is None])[:limit]
+                for alert_email_outbox_id in claimable_ids:
+                    outbox[alert_email_outbox_id]["claimed_by"] = connection_id
+                return claimable_ids
+            if query.startswith("SELECT"):
+                return [{"alert_email_outbox_id": alert_email_outbox_id, "subject": row["subject"], "message": ""}
+                    for (alert_email_outbox_id, row) in sorted(outbox.items())
+                    if row["claimed_by"] == connection_id and row["ts_sent"] is None]
+            if query.startswith("UPDATE") and "ts_sent = NOW()" in query:
+                alert_email_outbox_ids = re.search(r"IN \(([\d,]+)\)", query).group(1).split(",")
+                for alert_email_outbox_id in alert_email_outbox_ids:
+                    outbox[int(alert_email_outbox_id)].update({"ts_sent": True, "claimed_by": None})
+        return []
+    return responder
+
+
+class FakeSMTP(object):
+    def __init__(self, host, timeout=None):
+        pass
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        subject = re.search(r"^Subject: (.*)$", msg, re.M).group(1)
+        with outbox_lock:
+            sent_subjects.append(subject)
+        # Let the other sender run meanwhile
+        time.sleep(0.01)
+
+    def quit(self):
+        pass
+
+mcp.smtplib.SMTP = FakeSMTP
+
+num_sent_messages = {}
+def sender(connection_id):
+    num_sent_messages[connection_id] = mcp.send_queued_emails(FakeConnection(get_outbox_responder(connection_id)))
+
+senders = [threading.Thread(target=sender, args=(connection_id,)) for connection_id in (1, 2)]
+for thread in senders:
+    thread.start()
+for thread in senders:
+    thread.join(30)
+
+assert sorted(sent_subjects) == sorted(["alert %d" % alert_email_outbox_id for alert_email_outbox_id in outbox]), sent_subjects
+assert sum(num_sent_messages.values()) == len(outbox), num_sent_messages
+assert not [row for row in outbox.values() if row["ts_sent"] is None or row["claimed_by"] is not None]
+print "OK"
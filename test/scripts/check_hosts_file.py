@@ -0,0 +1,42 @@
+"""
+read_hosts_file: per host options are typed as their command line counterparts; in particular flags are
+parsed as booleans, so that "skip_alerts = 0" does not skip alerts.
+"""
+import os
+import tempfile
+
+from mcp_test_utils import load_mycheckpoint
+
+hosts_file_name = tempfile.mktemp(suffix=".cnf")
+hosts_file = open(hosts_file_name, "w")
+hosts_file.write("""
+[db1.example.com]
+database = mcp_db1
+skip_alerts = 0
+materialize_diff = yes
+monitored_port = 3307
+
+[db2]
+monitored_host = 10.0.0.2
+database = mcp_db2
+skip_alerts = true
+disable_bin_log = off
+""")
+hosts_file.close()
+
+try:
+    mcp = load_mycheckpoint(["--hosts-file=%s" % hosts_file_name])
+    hosts = mcp.read_hosts_file()
+finally:
+    os.remove(hosts_file_name)
+
+assert [host_name for (host_name, host_options) in hosts] == ["db1.example.com", "db2"], hosts
+(db1_options, db2_options) = [host_options for (host_name, host_options) in hosts]
+assert db1_options["skip_alerts"] is False, db1_options
+assert db1_options["materialize_diff"] is True, db1_options
+assert db1_options["monitored_port"] == 3307, db1_options
+assert db1_options["monitored_host"] == "db1.example.com", db1_options
+assert db2_options["skip_alerts"] is True, db2_options
+assert db2_options["monitored_host"] == "10.0.0.2", db2_options
+assert db2_options["disable_bin_log"] is False, db2_options
+print "OK"
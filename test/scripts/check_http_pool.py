@@ -0,0 +1,107 @@
+"""
+HTTP server connection pool: write host connections are reused across requests, at most --http-pool-size
+are in use at once, connections which failed are discarded, and stale idle connections are pinged first.
+"""
+import Queue
+import threading
+import time
+
+from mcp_test_utils import load_mycheckpoint, FakeConnection
+
+mcp = load_mycheckpoint(["--http-pool-size=2"])
+
+opened_connections = []
+lock = threading.Lock()
+num_running_queries = [0]
+max_running_queries = [0]
+release_queries = threading.Event()
+
+
+def responder(query):
+    if query == "blocking":
+        lock.acquire()
+        num_running_queries[0] += 1
+        max_running_queries[0] = max(max_running_queries[0], num_running_queries[0])
+        lock.release()
+        release_queries.wait(10)
+        lock.acquire()
+        num_running_queries[0] -= 1
+        lock.release()
+    if query == "failing":
+        raise mcp.MySQLdb.OperationalError("MySQL server has gone away")
+    return [{"value": 1}]
+
+
+class PoolConnection(FakeConnection):
+    def __init__(self):
+        FakeConnection.__init__(self, responder)
+        self.num_pings = 0
+        self.alive = True
+
+    def ping(self):
+        self.num_pings += 1
+        if not self.alive:
+            raise mcp.MySQLdb.OperationalError("MySQL server has gone away")
+
+
+def open_write_connection():
+    connection = PoolConnection()
+    lock.acquire()
+    opened_connections.append(connection)
+    lock.release()
+    return connection
+
+mcp.open_write_connection = open_write_connection
+mcp.http_pool_semaphore = threading.BoundedSemaphore(mcp.options.http_pool_size)
+mcp.http_idle_connections = Queue.Queue()
+
+# Sequential requests reuse a single connection
+for i in range(3):
+    assert mcp.http_get_row("SELECT 1") == {"value": 1}
+assert len(opened_connections) == 1
+assert len(opened_connections[0].queries) == 3
+
+# Concurrent requests: no more than --http-pool-size connections at once
+threads = [threading.Thread(target=mcp.http_get_rows, args=("blocking",)) for i in range(5)]
+for thread in threads:
+    thread.start()
+time.sleep(0.3)
+assert num_running_queries == [2], num_running_queries
+release_queries.set()
+for thread in threads:
+    thread.join(10)
+assert max_running_queries == [2], max_running_queries
+assert len(opened_connections) == 2, opened_connections
+assert mcp.http_idle_connections.qsize() == 2
+
+# A failing connection is closed rather than returned to the pool
+try:
+    mcp.http_get_rows("failing")
+    assert False, "query error not raised"
+except mcp.MySQLdb.OperationalError:
+    pass
+assert mcp.http_idle_connections.qsize() == 1
+assert len([connection for connection in opened_connections if connection.closed]) == 1
+
+# Connections idle for a while are pinged; dead ones are discarded
+(connection, idle_since) = mcp.http_idle_connections.get_nowait()
+connection.alive = False
+mcp.http_idle_connections.put((connection, time.time() - 60))
+assert mcp.http_get_row("SELECT 1") == {"value": 1}
+assert connection.num_pings == 1 and connection.closed
+assert len(opened_connections) == 3
+
+# Recently used connections are handed out without a ping
+(connection, idle_since) = mcp.http_idle_connections.get_nowait()
+mcp.http_idle_connections.put((connection, idle_since))
+assert mcp.http_get_row("SELECT 1") == {"value": 1}
+assert connection.num_pings == 0
+assert len(opened_connections) == 3
+
+# All permits were released
+for i in range(mcp.options.http_pool_size):
+    assert mcp.http_pool_semaphore.acquire(False)
+assert not mcp.http_pool_semaphore.acquire(False)
+
+assert issubclass(mcp.MCPThreadingHTTPServer, mcp.ThreadingMixIn)
+print "OK"
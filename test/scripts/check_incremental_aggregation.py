@@ -0,0 +1,38 @@
+"""
+--incremental-aggregation: a sample is folded into its hour and day rows with INSERT ... ON DUPLICATE KEY UPDATE.
+_diff values and ts_diff_seconds are summed, other values are MAX'd, and end_ts is kept at its latest.
+"""
+import re
+
+from mcp_test_utils import load_mycheckpoint, FakeConnection
+
+mcp = load_mycheckpoint(["--incremental-aggregation"])
+mcp.database_name = "mycheckpoint"
+mcp.write_conn = FakeConnection()
+mcp.get_variables_and_status_columns = lambda: (["max_connections"], ["com_select", "threads_connected"])
+mcp.status_variables_insert_id = 17
+mcp.status_variables_insert_timestamp = None
+
+mcp.write_status_variables_aggregations()
+queries = mcp.write_conn.queries
+assert len(queries) == 2, queries
+for (query, table_name, end_ts_expression) in zip(queries,
+        ["status_variables_aggregated_hour", "status_variables_aggregated_day"],
+        ["DATE(ts) + INTERVAL (HOUR(ts) + 1) HOUR AS end_ts", "DATE(ts) + INTERVAL 1 DAY AS end_ts"]):
+    assert query.startswith("INSERT INTO mycheckpoint.%s" % table_name), query
+    assert end_ts_expression in query, query
+    assert "WHERE id = 17" in query, query
+    update_clause = query.split("ON DUPLICATE KEY UPDATE")[1]
+    assert "%s.end_ts = GREATEST(%s.end_ts, VALUES(end_ts))" % (table_name, table_name) in update_clause, update_clause
+    for column_name in ["ts_diff_seconds", "com_select_diff", "threads_connected_diff"]:
+        assert "%s.%s = IF(VALUES(%s) IS NULL" % (table_name, column_name, column_name) in update_clause, column_name
+    for column_name in ["max_connections", "com_select", "threads_connected"]:
+        assert "%s.%s = IFNULL(GREATEST(" % (table_name, column_name) in update_clause, column_name
+    assert not re.search(r"\b%s\.id =" % table_name, update_clause)
+
+# Nothing to fold without a new sample
+mcp.write_conn = FakeConnection()
+mcp.status_variables_insert_id = None
+mcp.write_status_variables_aggregations()
+assert mcp.write_conn.queries == []
+print "OK"
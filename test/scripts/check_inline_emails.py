@@ -0,0 +1,28 @@
+"""
+Alert emails are only queued by a collection run; they are sent inline only with --inline-emails,
+so that by default a slow SMTP server does not delay sampling.
+"""
+import copy
+
+from mcp_test_utils import load_mycheckpoint, FakeConnection
+
+mcp = load_mycheckpoint()
+
+events = []
+mcp.open_connections = lambda: (FakeConnection(), FakeConnection())
+mcp.init_connections = lambda: None
+mcp.is_same_deploy = lambda: True
+mcp.collect_checkpoint = lambda: events.append("collect")
+mcp.send_queued_emails = lambda connection=None: events.append("send")
+
+mcp.base_options = copy.copy(mcp.options)
+(host_name, succeeded, elapsed_seconds) = mcp.collect_host(("host", {"database": "mcp_host"}))
+assert succeeded
+assert events == ["collect"], events
+
+del events[:]
+mcp.base_options.inline_emails = True
+(host_name, succeeded, elapsed_seconds) = mcp.collect_host(("host", {"database": "mcp_host"}))
+assert succeeded
+assert events == ["collect", "send"], events
+print "OK"
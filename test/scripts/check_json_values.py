@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+json_value: values written by the series API are valid JSON, including strings with quotes, backslashes,
+control characters and non-ASCII text, NULLs and DECIMAL columns.
+"""
+import decimal
+import json
+
+from mcp_test_utils import load_mycheckpoint
+
+mcp = load_mycheckpoint()
+
+values = [
+    None,
+    17,
+    2.5,
+    decimal.Decimal("12.75"),
+    'say "hi" \\ bye',
+    "tab\there\nnewline\r\x00\x1f",
+    "caf\xc3\xa9",
+    u"שלום",
+    ]
+for value in values:
+    encoded = mcp.json_value(value)
+    assert "\n" not in encoded and "\t" not in encoded and "\x00" not in encoded, repr(encoded)
+    decoded = json.loads(encoded)
+    if isinstance(value, decimal.Decimal):
+        assert decoded == float(value), (value, encoded)
+    elif isinstance(value, str):
+        assert decoded == value.decode("utf-8"), (value, encoded)
+    else:
+        assert decoded == value, (value, encoded)
+
+row = ["2010-01-01 00:00:00", None, decimal.Decimal("0.5"), 3]
+assert json.loads(mcp.json_value(row)) == ["2010-01-01 00:00:00", None, 0.5, 3]
+assert mcp.json_value(row) == '["2010-01-01 00:00:00", null, 0.5, 3]', mcp.json_value(row)
+
+try:
+    mcp.json_value(object())
+    assert False, "unserializable value accepted"
+except TypeError:
+    pass
+print "OK"
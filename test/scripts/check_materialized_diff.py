@@ -0,0 +1,85 @@
+"""
+--materialize-diff: upon collection, diffs against the preceding sample are written to status_variables_diff.
+The preceding sample is read once, then cached locally. Signed status variables may go down; other counters
+going down have been reset. Missing values yield NULL diffs.
+"""
+import re
+
+from mcp_test_utils import load_mycheckpoint, FakeConnection
+
+mcp = load_mycheckpoint(["--materialize-diff"])
+mcp.get_variables_and_status_columns = lambda: (["auto_increment_increment"], ["com_select", "threads_connected", "uptime", "innodb_rows_read"])
+mcp.previous_sample = None
+
+num_sample_reads = [0]
+
+
+def responder(query):
+    query = " ".join(query.split())
+    if query.startswith("SELECT"):
+        num_sample_reads[0] += 1
+        assert "WHERE id = 8" in query, query
+        return [{"id": 8, "ts_as_string": "2010-03-07 14:00:00",
+            "com_select": 1000, "threads_connected": 12, "uptime": 5000, "innodb_rows_read": None}]
+    return []
+
+
+def collect(sample_id, sample_timestamp, status_dict):
+    mcp.status_variables_insert_id = sample_id
+    mcp.status_variables_insert_timestamp = sample_timestamp
+    mcp.status_dict = status_dict
+    mcp.write_conn.queries = []
+    mcp.write_status_variables_diff()
+    return [query for query in mcp.write_conn.queries if query.startswith("INSERT")]
+
+
+def parse_diff_insert(query):
+    columns, values = re.search(r"\((id, .*?)\) VALUES \((.*)\)$", query).groups()
+    values = re.sub(r"TIMESTAMPDIFF\(SECOND, '([^']*)', '([^']*)'\)", r"\1..\2", values)
+    return dict(zip(columns.split(", "), values.split(", ")))
+
+mcp.write_conn = FakeConnection(responder)
+
+# auto_increment_increment=2: the preceding sample is id 10-2
+diff_inserts = collect(10, "2010-03-07 14:01:00",
+    {"auto_increment_increment": "2", "com_select": "1600", "threads_connected": "9", "uptime": "60", "innodb_rows_read": "7"})
+assert len(diff_inserts) == 1, diff_inserts
+assert diff_inserts[0].startswith("INSERT /*! IGNORE */ INTO mycheckpoint.status_variables_diff"), diff_inserts
+assert parse_diff_insert(diff_inserts[0]) == {
+    "id": "10",
+    "ts": "'2010-03-07 14:01:00'",
+    "ts_diff_seconds": "2010-03-07 14:00:00..2010-03-07 14:01:00",
+    "com_select_diff": "600",
+    # Signed
+    "threads_connected_diff": "-3",
+    # Server restarted
+    "uptime_diff": "60",
+    # No preceding value
+    "innodb_rows_read_diff": "NULL",
+    }, diff_inserts
+assert num_sample_reads == [1]
+
+# The sample just collected is now the preceding sample; it is not read again
+diff_inserts = collect(12, "2010-03-07 14:02:00",
+    {"auto_increment_increment": "2", "com_select": "1650", "threads_connected": "10", "uptime": "120", "innodb_rows_read": ""})
+assert parse_diff_insert(diff_inserts[0]) == {
+    "id": "12",
+    "ts": "'2010-03-07 14:02:00'",
+    "ts_diff_seconds": "2010-03-07 14:01:00..2010-03-07 14:02:00",
+    "com_select_diff": "50",
+    "threads_connected_diff": "1",
+    "uptime_diff": "60",
+    "innodb_rows_read_diff": "NULL",
+    }, diff_inserts
+assert num_sample_reads == [1]
+
+# No preceding sample: nothing written
+mcp.write_conn = FakeConnection(lambda query: [])
+mcp.previous_sample = None
+assert collect(20, "2010-03-07 15:00:00", {"auto_increment_increment": "1", "com_select": "1"}) == []
+
+# No new sample: nothing written
+mcp.write_conn = FakeConnection(responder)
+assert collect(None, None, {}) == []
+assert mcp.write_conn.queries == []
+print "OK"
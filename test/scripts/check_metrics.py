@@ -0,0 +1,63 @@
+"""
+/metrics: the latest sample is exposed in OpenMetrics text format. Status counters are typed as counters,
+signed status variables and global variables as gauges. Derived sv_report_sample values are exposed as
+gauges. Metrics are cached by latest sample id.
+"""
+import decimal
+
+from mcp_test_utils import load_mycheckpoint
+
+mcp = load_mycheckpoint()
+
+mcp.http_known_databases_deploy_versions = {"mcp_a": "100,2026-10-01 00:00:00"}
+latest = {"id_latest": 17, "unix_ts_latest": 1760000000}
+queries = []
+
+
+def http_get_row(query):
+    queries.append(query)
+    if "FROM mcp_a.sv_latest" in query:
+        return dict(latest)
+    if "FROM mcp_a.status_variables WHERE id = " in query:
+        return {"id": 17, "ts": "2025-10-09 08:53:20", "ts_diff_seconds": 60, "Com_select": 1200L, "threads_connected": 12L,
+            "max_connections": 500L, "os_loadavg_millis": 1500L, "custom_3": None, "version_comment": "MySQL"}
+    if "FROM mcp_a.sv_report_sample WHERE id = " in query:
+        return {"id": 17, "ts": "2025-10-09 08:53:20", "com_select_psec": decimal.Decimal("20.00")}
+    raise AssertionError("Unexpected query: %s" % query)
+
+mcp.http_get_row = http_get_row
+
+families = mcp.http_get_metrics_families("mcp_a")
+assert families == [
+    ("mycheckpoint_com_select", "counter", 1200.0, 1760000000),
+    ("mycheckpoint_max_connections", "gauge", 500.0, 1760000000),
+    ("mycheckpoint_os_loadavg_millis", "unknown", 1500.0, 1760000000),
+    ("mycheckpoint_threads_connected", "gauge", 12.0, 1760000000),
+    ("mycheckpoint_report_com_select_psec", "gauge", 20.0, 1760000000),
+    ], families
+assert len(queries) == 3
+
+# Same latest sample: only sv_latest is read
+del queries[:]
+assert mcp.http_get_metrics_families("mcp_a") == families
+assert len(queries) == 1, queries
+
+# A new sample
+del queries[:]
+latest["id_latest"] = 18
+mcp.http_get_metrics_families("mcp_a")
+assert len(queries) == 3 and "WHERE id = 18" in queries[1], queries
+
+text = mcp.get_openmetrics_text([
+    ("mcp_a", families[0:2]),
+    ('mcp_"b"', [("mycheckpoint_com_select", "counter", 7.0, None)]),
+    ])
+assert text == "\n".join([
+    "# TYPE mycheckpoint_com_select counter",
+    'mycheckpoint_com_select_total{database="mcp_a"} 1200.0 1760000000',
+    'mycheckpoint_com_select_total{database="mcp_\\"b\\""} 7.0',
+    "# TYPE mycheckpoint_max_connections gauge",
+    'mycheckpoint_max_connections{database="mcp_a"} 500.0 1760000000',
+    "# EOF",
+    ]) + "\n", text
+print "OK"
@@ -0,0 +1,35 @@
+"""
+/metrics: a database which cannot be read is skipped, and reported via the mycheckpoint_up gauge;
+the other databases are still exposed.
+"""
+import StringIO
+import types
+
+from mcp_test_utils import load_mycheckpoint
+
+mcp = load_mycheckpoint()
+
+
+def http_get_metrics_families(http_database_name):
+    if http_database_name == "mcp_broken":
+        raise mcp.MySQLdb.Error("Table 'mcp_broken.sv_latest' doesn't exist")
+    return [("mycheckpoint_uptime", "counter", 1234.0, 1760000000)]
+
+mcp.http_get_metrics_families = http_get_metrics_families
+
+handler = types.InstanceType(mcp.MCPHttpHandler)
+handler.wfile = StringIO.StringIO()
+responses = []
+handler.send_response = lambda code: responses.append(code)
+handler.send_header = lambda name, value: None
+handler.end_headers = lambda: None
+
+handler.serve_metrics(["mcp_a", "mcp_broken", "mcp_b"])
+lines = handler.wfile.getvalue().splitlines()
+assert responses == [200], responses
+assert 'mycheckpoint_up{database="mcp_a"} 1.0' in lines, lines
+assert 'mycheckpoint_up{database="mcp_broken"} 0.0' in lines, lines
+assert 'mycheckpoint_uptime_total{database="mcp_b"} 1234.0 1760000000' in lines, lines
+assert not [line for line in lines if "mcp_broken" in line and not line.startswith("mycheckpoint_up{")], lines
+assert lines[-1] == "# EOF"
+print "OK"
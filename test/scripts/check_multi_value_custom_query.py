@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Multi-value custom queries: a single execution returns many values, either as columns of a single row
+('value_columns') or as (name, value) rows ('name_value_rows'). Each value is stored by its own custom query,
+referencing the executed one via source_custom_query_id and naming the value by value_name.
+"""
+from mcp_test_utils import load_mycheckpoint, FakeConnection
+
+mcp = load_mycheckpoint()
+
+
+class ResultCursor(object):
+    def __init__(self, column_names, rows):
+        self.description = [(column_name,) for column_name in column_names]
+        self.rows = rows
+
+    def execute(self, query):
+        return len(self.rows)
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class ResultConnection(object):
+    def __init__(self, column_names, rows):
+        self.column_names = column_names
+        self.rows = rows
+
+    def cursor(self):
+        return ResultCursor(self.column_names, self.rows)
+
+mcp.print_error = lambda message: None
+
+(custom_value, query_time) = mcp.execute_custom_query(7, "SELECT ...", ResultConnection(["Queue_A", "queue_b"], [(5, None)]), "value_columns")
+assert custom_value == {u"queue_a": 5, u"queue_b": None}, custom_value
+
+(custom_value, query_time) = mcp.execute_custom_query(7, "SELECT ...", ResultConnection(["name", "value"],
+    [("sales", 10L), ("Caf\xc3\xa9", "12")]), "name_value_rows")
+assert custom_value == {u"sales": 10, u"café": 12}, custom_value
+
+# Invalid results
+assert mcp.execute_custom_query(7, "SELECT ...", ResultConnection(["a", "b"], [(1, 2), (3, 4)]), "value_columns") is None
+assert mcp.execute_custom_query(7, "SELECT ...", ResultConnection(["name", "value", "extra"], [("a", 1, 2)]), "name_value_rows") is None
+assert mcp.execute_custom_query(7, "SELECT ...", ResultConnection(["name", "value"], [("a", "many")]), "name_value_rows") is None
+assert mcp.execute_custom_query(7, "SELECT ...", ResultConnection(["a", "b"], [(1, 2)]), "single_value") is None
+
+
+def custom_query_row(custom_query_id, result_type="single_value", source_custom_query_id=None, value_name=None):
+    return {
+        "custom_query_id": custom_query_id, "query_eval": "SELECT ...", "description": "custom query %d" % custom_query_id,
+        "sample_interval": 1, "sample_interval_unit": "samples", "skipped_sample_value": "carry_forward",
+        "result_type": result_type, "source_custom_query_id": source_custom_query_id, "value_name": value_name,
+        "is_cached": 0, "cached_value": None, "skipped_samples": None, "seconds_since_evaluation": None,
+        }
+
+custom_query_rows = [
+    custom_query_row(10, "name_value_rows"),
+    custom_query_row(11, source_custom_query_id=10, value_name="Sales"),
+    custom_query_row(12, source_custom_query_id=10, value_name="caf\xc3\xa9"),
+    custom_query_row(13, source_custom_query_id=10, value_name="refunds"),
+    custom_query_row(20, "value_columns"),
+    custom_query_row(21, source_custom_query_id=20, value_name="queue_a"),
+    ]
+mcp.write_conn = FakeConnection(lambda query: custom_query_rows)
+
+executed_custom_queries = []
+custom_query_results = {}
+
+
+def execute_custom_queries(custom_queries):
+    executed_custom_queries.extend(custom_queries)
+    return custom_query_results
+
+mcp.execute_custom_queries = execute_custom_queries
+
+# Values custom queries are not executed on their own; the source query is executed once
+custom_query_results.update({10: ({u"sales": 10, u"café": 12}, 4), 20: (None, 10000)})
+mcp.status_dict.clear()
+mcp.collect_custom_data()
+assert executed_custom_queries == [(10, "SELECT ...", "name_value_rows"), (20, "SELECT ...", "value_columns")], executed_custom_queries
+assert mcp.status_dict == {
+    # Number of values returned
+    "custom_10": 2, "custom_10_time": 4,
+    "custom_11": 10, "custom_11_time": 4,
+    "custom_12": 12, "custom_12_time": 4,
+    # Not returned by the query
+    "custom_13": None, "custom_13_time": 4,
+    # Timed out, and so are its values
+    "custom_20": None, "custom_20_time": 10000,
+    "custom_21": None, "custom_21_time": 10000,
+    }, mcp.status_dict
+print "OK"
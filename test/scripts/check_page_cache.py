@@ -0,0 +1,32 @@
+"""
+http_get_cached_page: a cached page (and its ETag) is not served once the databases list, the deploy version
+or the staleness of the latest sample have changed, even with no new sample.
+"""
+from mcp_test_utils import load_mycheckpoint
+
+mcp = load_mycheckpoint()
+
+latest = {"id_latest": 100, "staleness_level": 0}
+mcp.http_get_row = lambda query: dict(latest)
+mcp.http_known_databases = ["mcp_a"]
+mcp.http_known_databases_deploy_versions = {"mcp_a": "100,2026-10-01 00:00:00"}
+renders = []
+
+
+def render_page():
+    renders.append(1)
+    return "<html>%d</html>" % len(renders)
+
+etags = [mcp.http_get_cached_page("mcp_a", "sv_report_html_brief", render_page)["etag"]]
+etags.append(mcp.http_get_cached_page("mcp_a", "sv_report_html_brief", render_page)["etag"])
+assert len(renders) == 1 and etags[0] == etags[1], "expected a cached page"
+
+mcp.http_known_databases = ["mcp_a", "mcp_b"]
+etags.append(mcp.http_get_cached_page("mcp_a", "sv_report_html_brief", render_page)["etag"])
+mcp.http_known_databases_deploy_versions = {"mcp_a": "101,2026-10-02 00:00:00"}
+etags.append(mcp.http_get_cached_page("mcp_a", "sv_report_html_brief", render_page)["etag"])
+latest["staleness_level"] = 1
+etags.append(mcp.http_get_cached_page("mcp_a", "sv_report_html_brief", render_page)["etag"])
+assert len(renders) == 4, renders
+assert len(set(etags)) == 4, etags
+print "OK"
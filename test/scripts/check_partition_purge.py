@@ -0,0 +1,56 @@
+"""
+--partition-status-variables: purge adds the upcoming daily partitions by splitting pmax, and drops the
+partitions all of whose rows are older than --purge-days, rather than deleting rows.
+"""
+import re
+
+from mcp_test_utils import load_mycheckpoint, FakeConnection
+
+mcp = load_mycheckpoint(["--partition-status-variables", "--partition-days-ahead=3", "--purge-days=2"])
+
+partitions = ["p20100301", "p20100302", "p20100303", "p20100304", "p20100305", "pmax"]
+
+
+def responder(query):
+    query = " ".join(query.split())
+    if "INFORMATION_SCHEMA.PARTITIONS" in query:
+        assert "TABLE_SCHEMA = 'mycheckpoint' AND TABLE_NAME = 'status_variables'" in query, query
+        return [{"PARTITION_NAME": partition_name} for partition_name in partitions]
+    if "CURDATE()" in query:
+        return [{"current_date_as_string": "2010-03-05"}]
+    if "AS purge_ts" in query:
+        assert "INTERVAL 2 DAY" in query, query
+        return [{"purge_ts": "2010-03-03 12:30:00"}]
+    if query.startswith("SELECT") or query.startswith("DELETE"):
+        raise AssertionError("Rows purge on a partitioned table: %s" % query)
+    return []
+
+mcp.write_conn = FakeConnection(responder)
+assert mcp.purge_status_variables() == 2
+
+alter_queries = [query for query in mcp.write_conn.queries if query.startswith("ALTER")]
+assert len(alter_queries) == 2, alter_queries
+reorganize_query, drop_query = alter_queries
+
+# Partitions for 2010-03-06 .. 2010-03-08, then a new catch-all pmax
+assert reorganize_query.startswith("ALTER TABLE mycheckpoint.status_variables REORGANIZE PARTITION pmax INTO"), reorganize_query
+assert re.findall(r"PARTITION (\w+) VALUES LESS THAN", reorganize_query) == ["p20100306", "p20100307", "p20100308", "pmax"], reorganize_query
+assert "PARTITION p20100308 VALUES LESS THAN (UNIX_TIMESTAMP('2010-03-09'))" in reorganize_query, reorganize_query
+
+# 2010-03-03 still holds rows newer than the purge timestamp
+assert drop_query == "ALTER TABLE mycheckpoint.status_variables DROP PARTITION p20100301, p20100302", drop_query
+
+# Partitions are already in place, and none expired
+partitions = ["p20100303", "p20100304", "p20100305", "p20100306", "p20100307", "p20100308", "pmax"]
+mcp.write_conn = FakeConnection(responder)
+assert mcp.purge_status_variables() == 0
+assert not [query for query in mcp.write_conn.queries if query.startswith("ALTER")], mcp.write_conn.queries
+
+# Clause used when creating or partitioning the table
+partitions_clause = " ".join(mcp.get_status_variables_partitions_clause(mcp.parse_date("2010-02-27"), mcp.parse_date("2010-03-01")).split())
+assert partitions_clause == ("PARTITION BY RANGE (UNIX_TIMESTAMP(ts)) ( "
+    "PARTITION p20100227 VALUES LESS THAN (UNIX_TIMESTAMP('2010-02-28')), "
+    "PARTITION p20100228 VALUES LESS THAN (UNIX_TIMESTAMP('2010-03-01')), "
+    "PARTITION p20100301 VALUES LESS THAN (UNIX_TIMESTAMP('2010-03-02')), "
+    "PARTITION pmax VALUES LESS THAN MAXVALUE )"), partitions_clause
+print "OK"
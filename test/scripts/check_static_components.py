@@ -0,0 +1,89 @@
+"""
+Over HTTP, the openark chart code and common CSS are served from versioned static URLs with long lived cache
+headers, and HTML pages refer to them rather than inline them.
+"""
+import gzip
+import StringIO
+import types
+
+from mcp_test_utils import load_mycheckpoint
+
+mcp = load_mycheckpoint()
+
+mcp.http_known_databases = ["mcp_a"]
+mcp.http_known_databases_deploy_versions = {"mcp_a": "100,2026-10-01 00:00:00"}
+queries = []
+
+
+def http_get_row(query):
+    queries.append(query)
+    return {"version": "100-7", "openark_lchart": "function openark_lchart() {}", "openark_schart": "function openark_schart() {}",
+        "common_css": "body {color: #333;}"}
+
+mcp.http_get_row = http_get_row
+
+# Components are read once per deploy version
+components = mcp.http_get_static_components("mcp_a")
+assert mcp.http_get_static_components("mcp_a") is components
+assert len(queries) == 1
+assert "FROM mcp_a.metadata, mcp_a.html_components" in " ".join(queries[0].split()), queries[0]
+mcp.http_known_databases_deploy_versions = {"mcp_a": "101,2026-10-02 00:00:00"}
+components = mcp.http_get_static_components("mcp_a")
+assert len(queries) == 2
+
+html = """<html><head>
+<script type="text/javascript" charset="utf-8">function openark_lchart() {}</script>
+<style type="text/css">body {color: #333;}</style>
+</head><body></body></html>"""
+externalized_html = mcp.http_externalize_static_components("mcp_a", html)
+assert "function openark_lchart() {}" not in externalized_html, externalized_html
+assert "body {color: #333;}" not in externalized_html, externalized_html
+assert '<script type="text/javascript" charset="utf-8"></script><script type="text/javascript" charset="utf-8" src="/mcp_a/static/100-7/openark_lchart.js"></script>' in externalized_html, externalized_html
+assert '<style type="text/css"></style><link rel="stylesheet" type="text/css" href="/mcp_a/static/100-7/common_css.css" /><style type="text/css"></style>' in externalized_html, externalized_html
+# Not inlined, hence not referenced
+assert "openark_schart.js" not in externalized_html, externalized_html
+
+
+def get(path, request_headers={}):
+    handler = types.InstanceType(mcp.MCPHttpHandler)
+    handler.path = path
+    handler.headers = request_headers
+    handler.wfile = StringIO.StringIO()
+    response = {"headers": {}}
+    def send_response(code):
+        response["code"] = code
+    def send_header(name, value):
+        response["headers"][name] = value
+    def send_error(code, message=None):
+        response["code"] = code
+    handler.send_response = send_response
+    handler.send_header = send_header
+    handler.send_error = send_error
+    handler.end_headers = lambda: None
+    handler.do_GET()
+    response["content"] = handler.wfile.getvalue()
+    return response
+
+response = get("/mcp_a/static/100-7/openark_lchart.js")
+assert response["code"] == 200, response
+assert response["content"] == "function openark_lchart() {}", response
+assert response["headers"]["Content-type"] == "application/javascript", response
+assert response["headers"]["Cache-Control"] == "public, max-age=31536000", response
+etag = response["headers"]["ETag"]
+
+response = get("/mcp_a/static/100-7/common_css.css", {"Accept-Encoding": "gzip, deflate"})
+assert response["code"] == 200, response
+assert response["headers"]["Content-type"] == "text/css", response
+assert response["headers"]["Content-Encoding"] == "gzip", response
+assert gzip.GzipFile(fileobj=StringIO.StringIO(response["content"])).read() == "body {color: #333;}", response
+
+response = get("/mcp_a/static/100-7/openark_lchart.js", {"If-None-Match": etag})
+assert response["code"] == 304 and response["content"] == "", response
+
+# A URL of a previous version: served, but not to be cached
+response = get("/mcp_a/static/99-3/openark_lchart.js")
+assert response["code"] == 200, response
+assert response["headers"]["Cache-Control"] == "no-cache", response
+
+assert get("/mcp_unknown/static/100-7/openark_lchart.js")["code"] == 404
+print "OK"
@@ -0,0 +1,64 @@
+"""
+Zoom pages compute only the requested chart: its sample, hour and day charts are read from queries over the
+chart's own columns, rather than from the sv_report_chart_* views computing all charts.
+"""
+from mcp_test_utils import load_mycheckpoint
+
+mcp = load_mycheckpoint()
+
+other_charts_columns = ["uptime_percent", "innodb_read_hit_percent", "com_select_psec"]
+queries = []
+zoomed_chart_alias = "innodb_io"
+
+
+def http_get_row(query):
+    queries.append(" ".join(query.split()))
+    return {zoomed_chart_alias: "http://chart/?cht=lc&chd=s:9", "%s_extended" % zoomed_chart_alias: "http://chart/?cht=lc&chd=e:AA"}
+
+mcp.http_get_row = http_get_row
+
+chart_expressions = mcp.http_query_zoom_charts("mcp_db", "innodb_io")
+assert chart_expressions == dict([(view_name_extension, ("'http://chart/?cht=lc&chd=s:9'", "'http://chart/?cht=lc&chd=e:AA'"))
+    for view_name_extension in ["sample", "hour", "day"]]), chart_expressions
+assert len(queries) == 3, queries
+for (query, view_name_extension) in zip(queries, ["sample", "hour", "day"]):
+    assert "innodb_buffer_pool_reads_psec" in query and "innodb_buffer_pool_pages_flushed_psec" in query, query
+    for column_name in other_charts_columns:
+        assert column_name not in query, (column_name, query)
+    assert "mcp_db.sv_report_chart_" not in query, query
+    assert "${" not in query, query
+    assert "mcp_db.charts_api" in query, query
+assert "FROM mcp_db.sv_report_hour_recent" in queries[1], queries[1]
+assert "FROM mcp_db.sv_report_day_recent" in queries[2], queries[2]
+
+# Custom charts are zoomed just the same
+del queries[:]
+zoomed_chart_alias = "custom_3_psec"
+mcp.http_query_zoom_charts("mcp_db", "custom_3_psec")
+assert len(queries) == 3 and not [query for query in queries if "custom_3_psec" not in query], queries
+
+# Unknown charts issue no query
+del queries[:]
+chart_expressions = mcp.http_query_zoom_charts("mcp_db", "no_such_chart")
+assert chart_expressions == dict([(view_name_extension, ("NULL", "NULL")) for view_name_extension in ["sample", "hour", "day"]]), chart_expressions
+assert queries == []
+
+# --http-python-charts reads the chart's columns only, and renders in-process
+rows_queries = []
+
+
+def http_get_rows(query):
+    rows_queries.append(" ".join(query.split()))
+    return []
+
+mcp.http_get_rows = http_get_rows
+mcp.http_get_row = lambda query: {"chart_width": 400, "chart_height": 200, "service_url": "http://chart/", "simple_encoding": "AB"}
+chart_expressions = mcp.http_render_zoom_charts("mcp_db", "innodb_io")
+assert sorted(chart_expressions.keys()) == ["day", "hour", "sample"], chart_expressions
+assert len(rows_queries) == 3, rows_queries
+for (query, view_name_extension) in zip(rows_queries, ["sample", "hour", "day"]):
+    assert "innodb_buffer_pool_reads_psec" in query and "innodb_buffer_pool_pages_flushed_psec" in query, query
+    assert "FROM mcp_db.sv_report_%s_recent" % view_name_extension in query, query
+    for column_name in other_charts_columns:
+        assert column_name not in query, (column_name, query)
+print "OK"
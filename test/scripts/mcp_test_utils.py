@@ -0,0 +1,100 @@
+"""
+Helpers for the scripted checks in this directory.
+
+The checks exercise mycheckpoint's logic without a MySQL server: mycheckpoint.py is loaded as a module
+(without running its main block), and database access is replaced by fake connections.
+Run each check with python 2, e.g.:
+    python test/scripts/check_collect_hosts.py
+"""
+import os
+import sys
+import types
+
+try:
+    import MySQLdb
+except ImportError:
+    # The checks do not connect to MySQL; they only need the names mycheckpoint refers to.
+    MySQLdb = types.ModuleType("MySQLdb")
+    class MySQLdbError(Exception):
+        pass
+    class MySQLdbWarning(Warning):
+        pass
+    MySQLdb.Error = MySQLdbError
+    MySQLdb.OperationalError = MySQLdbError
+    MySQLdb.Warning = MySQLdbWarning
+    MySQLdb.cursors = types.ModuleType("MySQLdb.cursors")
+    MySQLdb.cursors.DictCursor = None
+    MySQLdb.cursors.SSCursor = None
+    sys.modules["MySQLdb"] = MySQLdb
+    sys.modules["MySQLdb.cursors"] = MySQLdb.cursors
+
+
+def load_mycheckpoint(command_line_options=[]):
+    """
+    Load src/mycheckpoint.py as the "mycheckpoint" module. Of its main block, only the options parsing and
+    globals initialization are executed; no connection is made and no command is run.
+    """
+    file_name = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "src", "mycheckpoint.py")
+    source = open(file_name).read()
+    main_block_index = source.rindex("\ntry:\n")
+    definitions = source[:main_block_index]
+    main_block = source[main_block_index:]
+    initialization = main_block[main_block.index("        revision_placeholder = "):main_block.index("        if options.single:")]
+    initialization = "\n".join([line[8:] for line in initialization.split("\n")])
+
+    module = types.ModuleType("mycheckpoint")
+    module.__file__ = file_name
+    sys.modules["mycheckpoint"] = module
+    exec compile(definitions, file_name, "exec") in module.__dict__
+    saved_argv = sys.argv
+    sys.argv = ["mycheckpoint", "--skip-defaults-file"] + list(command_line_options)
+    try:
+        exec compile(initialization, file_name, "exec") in module.__dict__
+    finally:
+        sys.argv = saved_argv
+    return module
+
+
+class FakeCursor(object):
+    """
+    Records executed queries on its connection; returns rows provided by the connection's responder.
+    """
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+        self.lastrowid = None
+
+    def execute(self, query):
+        self.connection.queries.append(" ".join(query.split()))
+        self.rows = self.connection.responder(query) or []
+        return len(self.rows)
+
+    def fetchone(self):
+        if self.rows:
+            return self.rows[0]
+        return None
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+    def __init__(self, responder=None):
+        self.queries = []
+        self.responder = responder or (lambda query: [])
+        self.closed = False
+
+    def cursor(self, cursor_class=None):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True